@@ -2,30 +2,70 @@
 from pipin import install_requirements
 install_requirements()
 
-import requests
 from bs4 import BeautifulSoup
-import os
-import json
-import time
-from threading import Timer
 import logging
+import time
+from fetch_engine import get_fetch_engine
+from knowledge_store import get_store
+from page_cache import get_page_cache
+from html_stream import stream_paragraph_text
+from ingest_pool import get_ingest_pipeline
+from scheduler import PassiveLearningScheduler
+from text_index import get_text_index
+from vector_index import get_vector_index
+from source_fingerprints import get_source_fingerprints
+from metrics import instrument
+from search_cache import get_search_cache
 
 # Configure logging
 logging.basicConfig(filename='learning_system.log', level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
 
 # Constants
 SCHEMA_THRESHOLD = 5  # Define the threshold below which passive learning will trigger
+ANSWER_TOP_K = 1  # Number of ranked answers answer_question returns by default
+SEARCH_URL = "https://www.google.com/search?q={topic}+site:wikipedia.org"  # Search used to find pages for a topic
+EARLY_STOP_SENTENCES = None  # Set to 2 to stop reading a page once its definition and example are in
+
+# Maps the keys of a learned data item to the schema fields they are stored under
+DATA_FIELDS = {
+    "definition": "definitions",
+    "example": "examples",
+    "use_case": "use_cases",
+    "related_topic": "related_topics",
+    "source": "sources",
+}
+
+knowledge_store = get_store()
+text_index = get_text_index()
+vector_index = get_vector_index()
+fetch_engine = get_fetch_engine()
+page_cache = get_page_cache()
+search_cache = get_search_cache()
+passive_scheduler = None  # Created by start_passive_learning
 
 # Function to calculate schema strength
 def calculate_schema_strength(schema_data):
     return len(schema_data.get("definitions", []))  # Calculate strength based on definitions count
 
 # Function to fetch related information about a topic (Google search & scraping)
+# Resolutions are cached, so a topic is only searched again once its entry expires
+@instrument("search_resolution")
 def fetch_information(topic):
-    search_url = f"https://www.google.com/search?q={topic}+site:wikipedia.org"
+    search_url = SEARCH_URL.format(topic=topic)
+    return search_cache.resolve(f"APLS {search_url}", lambda: search_links(topic, search_url))
+
+# Function to resolve many topics at once; each distinct topic is searched at most once
+def resolve_topics(topics):
+    unique = list(dict.fromkeys(topics))
+    resolved = dict(zip(unique, fetch_engine.map(fetch_information, unique, return_exceptions=True)))
+    return [resolved[topic] for topic in topics]
+
+# Function to run the search for a topic and pick the Wikipedia links out of the results
+def search_links(topic, search_url):
     headers = {
         "User-Agent": "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/58.0.3029.110 Safari/537.3"}
-    response = requests.get(search_url, headers=headers)
+    response = fetch_engine.get(search_url, headers=headers)
+    response.raise_for_status()  # A throttled or failed search must not be cached as "no links"
     soup = BeautifulSoup(response.text, "html.parser")
 
     links = []
@@ -39,145 +79,192 @@ def fetch_information(topic):
                 links.append(actual_url)
                 if len(links) >= 3:  # Limit to top 3 results for this example
                     break
+
+    # Remember what was fetched in the topic manifest
+    knowledge_store.manifest.record_fetch(topic, links)
     return links
 
+# Function to download a page, sending the cache's conditional headers
+@instrument("page_fetch")
+def download_page(url, headers):
+    response = fetch_engine.get(url, headers=headers, stream=True)
+    response.raise_for_status()  # Raise an error for bad responses
+    return response
+
 # Function to scrape content from Wikipedia pages
-def scrape_wikipedia_page(url):
+def scrape_wikipedia_page(url, max_sentences=None):
     logging.info(f"Scraping Wikipedia page: {url}")
-    response = requests.get(url)
-    response.raise_for_status()  # Raise an error for bad responses
-    soup = BeautifulSoup(response.text, "html.parser")
-    paragraphs = soup.find_all("p")
-    text_content = "\n".join([para.get_text() for para in paragraphs if para.get_text()])
-    return text_content
+    if max_sentences is None:
+        max_sentences = EARLY_STOP_SENTENCES
+
+    # Paragraphs are extracted while the page streams in; unchanged pages come back
+    # as 304 and are served from the page cache without a parse
+    return page_cache.fetch_text(
+        url, download_page, lambda response, sink: stream_paragraph_text(response, sink, max_sentences))
+
+# Function to scrape several pages concurrently, returning (link, text) for the ones that succeeded
+def scrape_pages(links):
+    pages = fetch_engine.map(scrape_wikipedia_page, links, return_exceptions=True)
+    scraped = []
+    for link, page in zip(links, pages):
+        if isinstance(page, Exception):
+            logging.error(f"Failed to scrape {link}: {page}")
+        else:
+            scraped.append((link, page))
+    return scraped
+
+# Function to build the data stored for a scraped page
+def page_to_data(text, link):
+    return {
+        "definition": text.split('.')[0],  # Taking the first sentence as a definition
+        "example": text.split('.')[1] if '.' in text else "",  # Second sentence as an example
+        "use_case": "",  # You could enhance this with more specific scraping logic
+        "related_topic": "",  # Placeholder for future improvements
+        "source": link
+    }
 
 # Function to store learned data and update schema
-def store_learned_data(topic, data):
-    file_name = f"{topic}_knowledge.json"
-
-    # Initialize schema structure if the file does not exist
-    if not os.path.exists(file_name):
-        schema = {
-            "topic": topic,
-            "definitions": [],
-            "examples": [],
-            "use_cases": [],
-            "related_topics": [],
-            "sources": []
-        }
-    else:
-        with open(file_name, "r") as file:
-            schema = json.load(file)
-
-    # Update the schema with new data
-    if "definition" in data:
-        schema["definitions"].append(data["definition"])
-    if "example" in data:
-        schema["examples"].append(data["example"])
-    if "use_case" in data:
-        schema["use_cases"].append(data["use_case"])
-    if "related_topic" in data:
-        schema["related_topics"].append(data["related_topic"])
-    if "source" in data:
-        schema["sources"].append(data["source"])
-
-    # Save updated schema
-    with open(file_name, "w") as file:
-        json.dump(schema, file, indent=4)
+# Delta mode: given the page text the data came from, only paragraphs that are new since
+# the source's last visit are learned from, and an unchanged page writes nothing.
+# Returns False when nothing was stored.
+def store_learned_data(topic, data, page_text=None):
+    fingerprint = None
+    if page_text is not None:
+        changed, fingerprint = get_source_fingerprints(topic).delta(data["source"], page_text)
+        if not changed:
+            logging.info(f"No new paragraphs for '{topic}' from {data['source']}.")
+            get_source_fingerprints(topic).record(data["source"], fingerprint)
+            return False
+        data = page_to_data("\n".join(changed), data["source"])
+
+    # Append the new items to the topic's segment log instead of rewriting the whole schema
+    records = [(field, data[key]) for key, field in DATA_FIELDS.items() if key in data]
+    knowledge_store.append_many(topic, records)
 
+    # Index the new definitions/examples/use cases so questions never reload the schema
+    text_index.catch_up(topic)
+    vector_index.catch_up(topic)  # New rows for the topic's TF-IDF matrix, if one is loaded
+
+    get_source_fingerprints(topic).record(data.get("source"), fingerprint)
     logging.info(f"Knowledge about '{topic}' updated successfully with new data: {data}")
+    return True
 
-# Function to actively learn about a topic and store initial knowledge
+# Function to actively learn about a topic and store initial knowledge, returns the number of pages stored
 def learn_about_topic(topic):
     logging.info(f"Learning about '{topic}'...")
     links = fetch_information(topic)
 
-    for link in links:
-        new_data = scrape_wikipedia_page(link)
-        data_to_store = {
-            "definition": new_data.split('.')[0],  # Taking the first sentence as a definition
-            "example": new_data.split('.')[1] if '.' in new_data else "",  # Second sentence as an example
-            "use_case": "",  # You could enhance this with more specific scraping logic
-            "related_topic": "",  # Placeholder for future improvements
-            "source": link
-        }
-        store_learned_data(topic, data_to_store)
-        time.sleep(2)  # Adding sleep to simulate more natural fetching
+    # Pages download in parallel; the fetch engine's per-host rate limit replaces the fixed sleeps
+    pages = scrape_pages(links)
+    for link, new_data in pages:
+        store_learned_data(topic, page_to_data(new_data, link), page_text=new_data)
+    return len(pages)
+
+# Function to learn many topics at once, with page parsing spread over a process pool
+def learn_about_topics(topics):
+    resolved = resolve_topics(topics)
+    work = []
+    for topic, links in zip(topics, resolved):
+        if isinstance(links, Exception):
+            logging.error(f"Failed to search for '{topic}': {links}")
+            continue
+        work.extend((topic, link) for link in links)
+
+    # Results come back in link order, so each topic's knowledge is stored as learn_about_topic would
+    results = get_ingest_pipeline().run([link for _, link in work])
+    for (topic, _), (link, new_data, _) in zip(work, results):
+        if isinstance(new_data, Exception):
+            logging.error(f"Failed to scrape {link}: {new_data}")
+            continue
+        store_learned_data(topic, page_to_data(new_data, link), page_text=new_data)
 
 # Function to check schema strength and learn passively if needed
+# Returns False when the topic needed learning but nothing could be stored
 def passive_learning(topic):
-    file_name = f"{topic}_knowledge.json"
-
-    if os.path.exists(file_name):
-        with open(file_name, "r") as file:
-            schema = json.load(file)
-    else:
+    if not knowledge_store.has_topic(topic):
         logging.warning(f"No knowledge file found for '{topic}'. Initiating active learning.")
-        learn_about_topic(topic)
-        return
+        return learn_about_topic(topic) > 0
 
-    # Step 1: Check schema strength
-    schema_strength = calculate_schema_strength(schema)
+    # Step 1: Check schema strength from the topic manifest, without loading the knowledge itself
+    schema_strength = knowledge_store.manifest.strength(topic)
 
     # Step 2: Trigger passive learning if strength is below threshold
     if schema_strength < SCHEMA_THRESHOLD:
         logging.info(f"Schema for '{topic}' is weak (strength: {schema_strength}). Learning passively...")
         links = fetch_information(topic)
 
-        for link in links:
-            new_data = scrape_wikipedia_page(link)
-            data_to_store = {
-                "definition": new_data.split('.')[0], 
-                "example": new_data.split('.')[1] if '.' in new_data else "", 
-                "use_case": "",
-                "related_topic": "",
-                "source": link
-            }
-            store_learned_data(topic, data_to_store)
-            time.sleep(2)
+        pages = scrape_pages(links)
+        for link, new_data in pages:
+            # Revisited pages only contribute the paragraphs that changed since the last visit
+            store_learned_data(topic, page_to_data(new_data, link), page_text=new_data)
 
         logging.info(f"Passive learning for '{topic}' completed.")
+        return len(pages) > 0
     else:
         logging.info(f"Schema for '{topic}' is strong (strength: {schema_strength}). No passive learning needed.")
+        return True
 
-# Function to assess all schemas periodically for passive learning
-def assess_schemas(schemas):
-    for topic in schemas:
+# Function to list every known topic whose schema is below the threshold, from the manifest alone
+def find_weak_topics():
+    return [topic for topic, strength in knowledge_store.manifest.strengths().items() if strength < SCHEMA_THRESHOLD]
+
+# Function to assess schemas for passive learning, every known topic by default
+def assess_schemas(schemas=None):
+    for topic in (knowledge_store.topics() if schemas is None else schemas):
         passive_learning(topic)
 
+# Function to rank topics for the scheduler, weaker schemas are assessed first
+def schema_weakness(topic):
+    return SCHEMA_THRESHOLD - knowledge_store.manifest.strength(topic)
+
 # Function to schedule periodic schema assessments (passive learning)
 def start_passive_learning(schemas, interval=3600):
-    Timer(interval, lambda: assess_schemas(schemas)).start()
+    global passive_scheduler
+    if passive_scheduler is None:
+        passive_scheduler = PassiveLearningScheduler(passive_learning, schema_weakness, interval=interval)
+        passive_scheduler.start()
+    else:
+        passive_scheduler.set_interval(interval)  # The latest call's interval applies to every topic
+
+    # New topics are first assessed one interval from now, like the old one-shot timer
+    passive_scheduler.add_topics(schemas, due=time.time() + interval)
+    return passive_scheduler
 
 # Function to learn about a topic and start passive monitoring
 def learn_and_monitor(topic):
     learn_about_topic(topic)
     start_passive_learning([topic], interval=10)  # Check every 10 seconds for demo purposes
 
-# Function to answer questions about a topic based on learned knowledge
-def answer_question(topic, question):
-    file_name = f"{topic}_knowledge.json"
-
+# Function to rank stored answers for a question with the BM25 text index
+def rank_answers(topic, question, top_k=5):
     # Check if knowledge exists, if not, learn about the topic first
-    if not os.path.exists(file_name):
+    if not knowledge_store.has_topic(topic):
         learn_about_topic(topic)
 
-    with open(file_name, "r") as file:
-        schema = json.load(file)
+    text_index.catch_up(topic)
+    return text_index.search(question, top_k=top_k, topic=topic)
 
-    # Search schema for an answer
-    answer = None
-    if "definitions" in schema:
-        for definition in schema["definitions"]:
-            if question.lower() in definition.lower():
-                answer = definition
-                break
+# Function to answer questions about a topic based on learned knowledge
+def answer_question(topic, question, top_k=ANSWER_TOP_K):
+    answers = [result["text"] for result in rank_answers(topic, question, top_k)]
 
-    if answer:
-        return f"Answer to your question: {answer}"
+    if len(answers) == 1:
+        return f"Answer to your question: {answers[0]}"
+    elif answers:
+        ranked = "\n".join(f"{rank}. {answer}" for rank, answer in enumerate(answers, start=1))
+        return f"Answers to your question:\n{ranked}"
     else:
         return f"I couldn't find an exact answer in my current knowledge about '{topic}'. Learning new information..."
 
+# Function to answer a batch of questions about a topic at once
+# Returns, per question, up to top_k dicts with score, topic, field and text, best first
+def answer_questions(topic, questions, top_k=ANSWER_TOP_K):
+    if not knowledge_store.has_topic(topic):
+        learn_about_topic(topic)
+
+    # Every question is scored against the topic's TF-IDF matrix in one matrix multiply
+    return vector_index.search_many(topic, questions, top_k=top_k)
+
 # Entry point for the program
 if __name__ == "__main__":
     # Step 1: Learn about a topic
@@ -5,13 +5,25 @@ from pipin import install_requirements
 install_requirements()
 
 import streamlit as st
-import requests
-from flask import Flask, request, jsonify
+from flask import Flask, Response, jsonify
 import threading
+import time
 import argparse
-
-# Global variable to store conversation history
-conversation_history = []
+import os
+import metrics
+from message_log import follow, open_message_log
+from knowledge_sync import register_sync_routes, sync_with_peer
+from message_routes import register_message_routes
+from peer_client import FACE_PATH, get_peer_client, stream_events
+from serving import add_serving_arguments, serve_from_args, store_path
+from wire import install_wire, request_data
+
+# Bounded conversation history; set BRAIN_COMM_SPILL_FILE to also keep every message on disk,
+# or BRAIN_COMM_STORE (--store) to share it through sqlite with other processes
+conversation_history = open_message_log(os.getenv("BRAIN_COMM_STORE"), os.getenv("BRAIN_COMM_SPILL_FILE"))
+DISPLAY_LIMIT = 200  # Messages shown in the conversation box
+STATUS_LIMIT = 10  # Recent deliveries whose status is shown
+LIVE_HEARTBEAT = 1  # Seconds between keep-alives of the UI's event stream, so reruns aren't held up
 
 # Default ports and passwords
 DEFAULT_PORT = 5000
@@ -19,59 +31,95 @@ DEFAULT_PEER_PORT = 5001
 DEFAULT_PASSWORD = "secure_token"
 
 # Streamlit UI setup
-def streamlit_ui(peer_port, password):
-    global conversation_history
+def streamlit_ui(port, peer_port, password):
     st.title("Brain Communication System")
 
     # Placeholders for conversation and input
-    conversation = st.empty()
+    conversation = st.container(height=400)
     user_input = st.text_input("Send a message to the other brain:")
 
-    # Update conversation in real-time
-    def update_conversation(new_message):
-        conversation_history.append(new_message)
-        conversation.text_area("Conversation", value="\n".join(conversation_history), height=400)
+    # Update conversation, fetching only the messages added since the last rerun
+    def update_conversation():
+        seen = follow(conversation_history, st.session_state.setdefault("conversation", []), keep=DISPLAY_LIMIT)
+        for entry in seen:
+            conversation.text(f"{entry['sender']}: {entry['message']}")
+        return seen
 
-    # When user sends a message
+    # When user sends a message; it is queued and the UI doesn't wait for the peer
+    deliveries = st.session_state.setdefault("deliveries", [])
     if user_input:
-        new_message = f"Brain 1: {user_input}"
-        update_conversation(new_message)
-        status = send_message(user_input, peer_port, password)
-        st.write(f"Message status: {status}")
+        conversation_history.append("Brain 1", user_input)
+        deliveries.append(send_message(user_input, peer_port, password))
+        del deliveries[:-STATUS_LIMIT]
+    seen = update_conversation()
+
+    # Delivery status of the most recent messages, redrawn below whenever one of them changes
+    status_box = st.empty()
+    def show_statuses():
+        with status_box.container():
+            for delivery in reversed(deliveries):
+                detail = f" ({delivery.error})" if delivery.error else ""
+                st.write(f"Message status: {delivery.status}{detail} - {delivery.message[:40]}")
+        return [delivery.status for delivery in deliveries]
+    shown = show_statuses()
+
+    # Exchange only the knowledge entries one of the two brains lacks
+    if st.button("Sync knowledge with the other brain"):
+        try:
+            stats = sync_with_peer(f'http://localhost:{peer_port}', password)
+            st.write(f"Knowledge synced: {stats['topics']} topics, pulled {stats['pulled']} "
+                     f"and pushed {stats['pushed']} entries in {stats['requests']} requests")
+        except Exception as e:
+            st.error(f"Knowledge sync failed: {e}")
+
+    # Append each message pushed by our server's /events channel until the next rerun
+    live = st.empty()
+    last_id = seen[-1]["id"] if seen else conversation_history.last_id
+    appended = 0
+    for entry in stream_events(f"http://localhost:{port}", password, last_id, heartbeat=LIVE_HEARTBEAT):
+        if [delivery.status for delivery in deliveries] != shown:
+            shown = show_statuses()  # Queued messages resolve in the background
+        if entry is None:
+            live.caption(f"Live, updated {time.strftime('%H:%M:%S')}")
+            continue
+        conversation.text(f"{entry['sender']}: {entry['message']}")
+        seen.append(entry)
+        appended += 1
+        if appended >= DISPLAY_LIMIT:
+            st.rerun()  # Re-render the bounded history instead of growing the box forever
 
 # Flask app for receiving webhooks
 app = Flask(__name__)
+install_wire(app)  # Peers may send and accept msgpack and compressed bodies
 
 @app.route('/receive_message', methods=['POST'])
+@metrics.instrument("receive_message")
 def receive_message():
-    global conversation_history
-    data = request.json
+    data = request_data() or {}
     token = data.get("token")
     message = data.get("message")
 
     # Verify the token (password) before accepting the message
     if token == app.config['password']:
-        new_message = f"Brain 2: {message}"
-        conversation_history.append(new_message)
+        conversation_history.append("Brain 2", message)
+        metrics.inc("messages_received")
         return jsonify({"status": "Message received and displayed!"})
     else:
+        metrics.inc("messages_rejected")
         return jsonify({"status": "Unauthorized access!"}), 401
 
-# Function to send a message to the other brain's webhook
+register_message_routes(app, lambda: conversation_history, lambda: app.config['password'], sender="Brain 2")
+register_sync_routes(app, lambda: app.config['password'])
+
+# Prometheus scrape endpoint for the stage latencies and counters
+@app.route('/metrics', methods=['GET'])
+def metrics_endpoint():
+    return Response(metrics.render_prometheus(), content_type=metrics.CONTENT_TYPE)
+
+# Function to send a message to the other brain
+# Queues it on the peer's pooled client and returns its Delivery without waiting
 def send_message(message, peer_port, password):
-    payload = {
-        "token": password,
-        "message": message
-    }
-    try:
-        # Send to the peer's port
-        response = requests.post(f'http://localhost:{peer_port}/receive_message', json=payload)
-        if response.status_code == 200:
-            return response.json().get("status")
-        else:
-            return "Error sending message!"
-    except requests.exceptions.RequestException as e:
-        return f"Failed to send message: {e}"
+    return get_peer_client(f'http://localhost:{peer_port}', password, FACE_PATH).send(message)
 
 # Webhook listener thread for Flask
 def run_flask(port, password):
@@ -90,14 +138,24 @@ def parse_arguments():
     parser.add_argument('--port', type=int, default=DEFAULT_PORT, help='Port to run the Flask server (default: 5000)')
     parser.add_argument('--peer_port', type=int, default=DEFAULT_PEER_PORT, help='Port of the peer brain to communicate with (default: 5001)')
     parser.add_argument('--password', type=str, default=DEFAULT_PASSWORD, help='Password for secure communication (default: "secure_token")')
+    add_serving_arguments(parser)
     return parser.parse_args()
 
 # Entry point for the script
 if __name__ == "__main__":
     args = parse_arguments()
+    if store_path(args):
+        # Production servers and separate UI processes share the conversation through sqlite
+        conversation_history = open_message_log(store_path(args))
+
+    if args.serve != "dev":
+        # Production mode: only the webhook routes, under a multi-worker server in the foreground
+        app.config['password'] = args.password
+        serve_from_args(app, '127.0.0.1', args.port, args)
+    else:
+        # Start the Flask server for webhooks
+        if not args.ui_only:
+            start_flask_thread(args.port, args.password)
 
-    # Start the Flask server for webhooks
-    start_flask_thread(args.port, args.password)
-
-    # Launch the Streamlit UI and allow communication
-    streamlit_ui(args.peer_port, args.password)
+        # Launch the Streamlit UI and allow communication
+        streamlit_ui(args.port, args.peer_port, args.password)
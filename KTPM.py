@@ -3,58 +3,89 @@ from pipin import install_requirements
 install_requirements()
 
 
-import json
-import os
-import requests
 from bs4 import BeautifulSoup
 import difflib
+from fetch_engine import get_fetch_engine
+from page_cache import get_page_cache
+from html_stream import stream_paragraph_text
+from knowledge_store import ARTICLES_FIELD, get_store
+from dedup_index import NearDuplicateIndex, get_dedup_index
+from ingest_pool import get_ingest_pipeline
+from metrics import instrument
+from search_cache import get_search_cache
+from source_fingerprints import get_source_fingerprints
 
 SCHEMA_THRESHOLD = 10  # Threshold for triggering passive learning
+SEARCH_URL = "https://www.google.com/search?q={topic}+site:wikipedia.org"  # Search used to find pages for a topic
+
+knowledge_store = get_store()
+fetch_engine = get_fetch_engine()
+page_cache = get_page_cache()
+search_cache = get_search_cache()
 
 # Function to calculate schema strength based on stored knowledge
 def calculate_schema_strength(knowledge):
     return len(knowledge)
 
-# Function to load existing knowledge for a topic from a file
+# Function to load existing knowledge for a topic from the knowledge store
+# Articles live in the shared blob store and are only decompressed when accessed
 def load_existing_knowledge(topic):
-    file_name = f"{topic}_knowledge.json"
-    
-    if os.path.exists(file_name):
-        with open(file_name, 'r') as file:
-            knowledge = json.load(file)
-        return knowledge
-    else:
-        return []
+    return knowledge_store.read_lazy(topic, ARTICLES_FIELD)
 
 # Enhanced function to fetch and validate information from reliable sources (e.g., Wikipedia)
+# Resolutions are cached, so a topic is only searched again once its entry expires
+@instrument("search_resolution")
 def fetch_information(topic):
-    search_url = f"https://www.google.com/search?q={topic}+site:wikipedia.org"
+    search_url = SEARCH_URL.format(topic=topic)
+    return search_cache.resolve(f"KTPM {search_url}", lambda: search_links(topic, search_url))
+
+# Function to resolve many topics at once; each distinct topic is searched at most once
+def resolve_topics(topics):
+    unique = list(dict.fromkeys(topics))
+    resolved = dict(zip(unique, fetch_engine.map(fetch_information, unique, return_exceptions=True)))
+    return [resolved[topic] for topic in topics]
+
+# Function to run the search for a topic and pick the Wikipedia links out of the results
+def search_links(topic, search_url):
     headers = {
         "User-Agent": "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/58.0.3029.110 Safari/537.3"}
-    response = requests.get(search_url, headers=headers)
+    response = fetch_engine.get(search_url, headers=headers)
+    response.raise_for_status()  # A throttled or failed search must not be cached as "no links"
     soup = BeautifulSoup(response.text, "html.parser")
     
     links = []
     for link in soup.find_all("a"):
-        href = link.get("href")
+        href = link.get("href") or ""
+        # Search results wrap the target as "/url?q=<url>&..."; take the URL and discard the parameters
+        if href.startswith("/url?q="):
+            href = href.split("/url?q=")[1].split("&")[0]
         if "wikipedia.org/wiki/" in href:
             links.append(href)
             if len(links) >= 3:  # Limit to top 3 results for this example
                 break
+
+    # Remember what was fetched in the topic manifest
+    knowledge_store.manifest.record_fetch(topic, links)
     return links
 
+# Function to download a page, sending the cache's conditional headers
+@instrument("page_fetch")
+def download_page(url, headers):
+    return fetch_engine.get(url, headers=headers, stream=True)
+
 # Enhanced function to scrape and clean content from Wikipedia pages
 def scrape_wikipedia_page(url):
-    response = requests.get(url)
-    soup = BeautifulSoup(response.text, "html.parser")
-    paragraphs = soup.find_all("p")
-    
-    # Extract and clean text content
-    text_content = "\n".join([para.get_text() for para in paragraphs if para.get_text()])
-    return text_content
+    # Paragraphs are extracted while the page streams in; unchanged pages come back
+    # as 304 and are served from the page cache without a parse
+    return page_cache.fetch_text(url, download_page, stream_paragraph_text)
 
 # Function to validate relevance of new information based on similarity to existing schema
+@instrument("validation")
 def validate_information(new_data, knowledge):
+    # A topic's near-duplicate index only compares against LSH candidates instead of every entry
+    if isinstance(knowledge, NearDuplicateIndex):
+        return not knowledge.is_duplicate(new_data)
+
     # Use difflib's SequenceMatcher to compare similarity between new data and existing schema knowledge
     for entry in knowledge:
         similarity = difflib.SequenceMatcher(None, new_data, entry).ratio()
@@ -63,47 +94,89 @@ def validate_information(new_data, knowledge):
     return True  # Otherwise, the data is considered relevant and new
 
 # Function to update schema only with validated and relevant information
-def update_schema(topic, new_data):
-    file_name = f"{topic}_knowledge.json"
-    
-    if os.path.exists(file_name):
-        with open(file_name, 'r') as file:
-            knowledge = json.load(file)
-    else:
-        knowledge = []
+# A MinHash signature computed ahead of time (e.g. by the ingestion pool) can be passed in
+# Delta mode: with the `source` URL of the page, only paragraphs that are new since the
+# source's last visit are validated and stored, and an unchanged page writes nothing
+def update_schema(topic, new_data, signature=None, source=None):
+    dedup_index = get_dedup_index(topic)
+
+    fingerprints = fingerprint = None
+    if source is not None:
+        fingerprints = get_source_fingerprints(topic)
+        changed, fingerprint = fingerprints.delta(source, new_data)
+        if not changed:
+            fingerprints.record(source, fingerprint)
+            print(f"No new paragraphs for '{topic}' from {source}.")
+            return
+        delta = "\n".join(changed)
+        if delta != new_data:  # Only part of the page is new, the precomputed signature no longer applies
+            new_data, signature = delta, None
+
+    probe = new_data if signature is None else signature
     
     # Validate new data before updating schema
-    if validate_information(new_data, knowledge):
-        knowledge.append(new_data)
-        
-        # Save updated knowledge back to file
-        with open(file_name, 'w') as file:
-            json.dump(knowledge, file, indent=4)
+    if validate_information(probe, dedup_index):
+        # Append to the topic's segment log, existing entries are never rewritten
+        knowledge_store.append(topic, ARTICLES_FIELD, new_data)
+        dedup_index.add_stored(probe)
         
         print(f"Schema for '{topic}' updated with new information.")
     else:
         print(f"New information for '{topic}' was found to be redundant or irrelevant.")
 
+    if fingerprints is not None:
+        fingerprints.record(source, fingerprint)
+
 # Enhanced function to monitor and trigger passive learning with strict data validation
 def monitor_and_learn_passively(topic):
-    knowledge = load_existing_knowledge(topic)
-    
-    if calculate_schema_strength(knowledge) < SCHEMA_THRESHOLD:
+    # The topic manifest holds the strength, so the stored articles aren't loaded just to count them
+    if knowledge_store.manifest.strength(topic) < SCHEMA_THRESHOLD:
         print(f"Schema for '{topic}' is weak. Triggering passive learning.")
         
         # Fetch new, relevant information
         links = fetch_information(topic)
         
-        for link in links:
+        # Download the pages concurrently, then validate and store them in their original order
+        pages = fetch_engine.map(scrape_wikipedia_page, links, return_exceptions=True)
+        for link, new_data in zip(links, pages):
             print(f"Scraping content from: {link}")
-            new_data = scrape_wikipedia_page(link)
+            if isinstance(new_data, Exception):
+                print(f"Failed to scrape '{link}': {new_data}")
+                continue
             
-            # Update schema with validated information
-            update_schema(topic, new_data)
+            # Update schema with validated information, only what changed since the page's last visit
+            update_schema(topic, new_data, source=link)
     
     else:
         print(f"Schema for '{topic}' is strong. No passive learning required.")
 
+# Function to passively learn many topics at once: pages are parsed and signed on a
+# process pool, then validated and stored topic by topic in their original order
+def bulk_monitor_and_learn(topics):
+    weak = [topic for topic in topics if knowledge_store.manifest.strength(topic) < SCHEMA_THRESHOLD]
+    if not weak:
+        return
+
+    resolved = resolve_topics(weak)
+    work = []
+    for topic, links in zip(weak, resolved):
+        if isinstance(links, Exception):
+            print(f"Failed to search for '{topic}': {links}")
+            continue
+        work.extend((topic, link) for link in links)
+
+    results = get_ingest_pipeline().run([link for _, link in work], with_signatures=True)
+    for (topic, _), (link, new_data, signature) in zip(work, results):
+        print(f"Scraping content from: {link}")
+        if isinstance(new_data, Exception):
+            print(f"Failed to scrape '{link}': {new_data}")
+            continue
+        update_schema(topic, new_data, signature, source=link)
+
+# Function to list every known topic whose schema is below the threshold, from the manifest alone
+def find_weak_topics():
+    return [topic for topic, strength in knowledge_store.manifest.strengths().items() if strength < SCHEMA_THRESHOLD]
+
 # Test monitoring for a known topic
 if __name__ == "__main__":
     test_topic = "machine learning"
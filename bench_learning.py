@@ -0,0 +1,260 @@
+# Offline benchmark for the learning pipeline
+#
+# Runs APLS and KTPM against a local stand-in for Google and Wikipedia so their
+# throughput can be tracked from release to release without touching the network.
+#
+# The stand-in server runs in its own process and serves:
+#   /search?q=<topic>+site:wikipedia.org  result links in the "/url?q=" form APLS parses
+#   /wikipedia.org/wiki/<page>            synthetic articles of --article-kb kilobytes,
+#                                         with ETags so the page cache can revalidate
+#
+# Each phase reports pages/sec, p50/p99 latency per call, peak RSS and bytes written
+# per topic. Everything is written to a scratch directory that is removed afterwards.
+#
+# Usage:
+#   python bench_learning.py --topics 50 --article-kb 64 --json bench_output.txt
+import argparse
+import contextlib
+import hashlib
+import io
+import json
+import multiprocessing
+import os
+import random
+import resource
+import shutil
+import sys
+import tempfile
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, quote, unquote, urlsplit
+
+REPO_DIR = os.path.dirname(os.path.abspath(__file__))
+LINKS_PER_SEARCH = 3
+QUESTIONS_PER_TOPIC = 5
+
+_WORDS = ("knowledge schema learning network model data system theory process structure "
+          "function method signal memory language pattern neuron concept science history "
+          "algorithm computer brain value field study research analysis object feature").split()
+
+
+# Function to generate a deterministic article of roughly `size` bytes for a page name
+def synthetic_article(name, size):
+    rng = random.Random(name)
+    paragraphs = []
+    length = 0
+    while length < size:
+        sentences = [" ".join(rng.choice(_WORDS) for _ in range(rng.randint(8, 20))).capitalize() + "."
+                     for _ in range(rng.randint(3, 6))]
+        paragraph = f"{name.replace('_', ' ')} {' '.join(sentences)}"
+        paragraphs.append(f"<p>{paragraph} <sup>[{len(paragraphs) + 1}]</sup></p>")
+        length += len(paragraph)
+    body = "\n".join(paragraphs)
+    return (f"<html><head><title>{name}</title><script>var page = 1;</script></head>"
+            f"<body><div id=\"content\"><h1>{name}</h1>\n{body}\n</div></body></html>")
+
+
+class StandInHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    article_size = 64 * 1024
+
+    def log_message(self, format, *args):
+        pass
+
+    def _send(self, status, body=b"", headers=None):
+        self.send_response(status)
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self):
+        url = urlsplit(self.path)
+        host = f"http://{self.headers['Host']}"
+
+        if url.path == "/search":
+            query = parse_qs(url.query).get("q", [""])[0]
+            topic = query.replace("site:wikipedia.org", "").strip().replace(" ", "_")
+            links = [f'<a href="/search?q={quote(topic)}&start=10">Next</a>']
+            for n in range(1, LINKS_PER_SEARCH + 1):
+                target = f"{host}/wikipedia.org/wiki/{quote(topic)}_{n}"
+                links.append(f'<a href="/url?q={target}&sa=U&ved=0">{topic} {n}</a>')
+            body = f"<html><body>{''.join(links)}</body></html>".encode("utf-8")
+            self._send(200, body, {"Content-Type": "text/html; charset=utf-8"})
+
+        elif url.path.startswith("/wikipedia.org/wiki/"):
+            name = unquote(url.path.rsplit("/", 1)[1])
+            etag = '"' + hashlib.sha1(f"{name}:{self.article_size}".encode()).hexdigest() + '"'
+            if self.headers.get("If-None-Match") == etag:
+                self.server.stats["not_modified"] += 1
+                self._send(304, headers={"ETag": etag})
+                return
+            body = synthetic_article(name, self.article_size).encode("utf-8")
+            self.server.stats["articles"] += 1
+            self.server.stats["bytes"] += len(body)
+            self._send(200, body, {"Content-Type": "text/html; charset=utf-8", "ETag": etag})
+
+        else:
+            self._send(404)
+
+
+def _serve(article_size, ready, stats_requests):
+    StandInHandler.article_size = article_size
+    server = ThreadingHTTPServer(("127.0.0.1", 0), StandInHandler)
+    server.daemon_threads = True
+    server.stats = {"articles": 0, "not_modified": 0, "bytes": 0}
+    ready.send(server.server_address[1])
+
+    # The bench process asks for counters over the pipe between phases
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    while True:
+        if stats_requests.recv() is None:
+            break
+        stats_requests.send(dict(server.stats))
+    server.shutdown()
+
+
+class StandInServer:
+    """Runs the stand-in HTTP server in a child process."""
+
+    def __init__(self, article_size):
+        ready_recv, ready_send = multiprocessing.Pipe(duplex=False)
+        self.control, child_control = multiprocessing.Pipe()
+        self.process = multiprocessing.Process(
+            target=_serve, args=(article_size, ready_send, child_control), daemon=True)
+        self.process.start()
+        self.port = ready_recv.recv()
+
+    def stats(self):
+        self.control.send("stats")
+        return self.control.recv()
+
+    def stop(self):
+        self.control.send(None)
+        self.process.join(timeout=5)
+
+
+def _percentile(samples, fraction):
+    if not samples:
+        return 0.0
+    ordered = sorted(samples)
+    return ordered[min(len(ordered) - 1, int(round(fraction * (len(ordered) - 1))))]
+
+
+def _disk_usage(paths):
+    total = 0
+    for path in paths:
+        for directory, _, files in os.walk(path):
+            total += sum(os.path.getsize(os.path.join(directory, name)) for name in files)
+    return total
+
+
+DATA_PATHS = ("knowledge_store", "text_index", "page_cache")
+
+
+def run_phase(name, calls, server, topics):
+    """Times every call, then reports against the server's counters and the disk."""
+    before_pages = server.stats()
+    before_disk = _disk_usage(DATA_PATHS)
+    latencies = []
+    errors = 0
+    start = time.perf_counter()
+    with contextlib.redirect_stdout(io.StringIO()):  # KTPM prints a line per page
+        for call in calls:
+            began = time.perf_counter()
+            try:
+                call()
+            except Exception:
+                errors += 1
+            latencies.append(time.perf_counter() - began)
+    elapsed = time.perf_counter() - start
+    after_pages = server.stats()
+
+    pages = (after_pages["articles"] - before_pages["articles"]
+             + after_pages["not_modified"] - before_pages["not_modified"])
+    return {
+        "phase": name,
+        "calls": len(calls),
+        "errors": errors,
+        "seconds": round(elapsed, 3),
+        "pages": pages,
+        "pages_per_sec": round(pages / elapsed, 2) if elapsed else 0.0,
+        "not_modified": after_pages["not_modified"] - before_pages["not_modified"],
+        "p50_ms": round(_percentile(latencies, 0.50) * 1000, 2),
+        "p99_ms": round(_percentile(latencies, 0.99) * 1000, 2),
+        "peak_rss_mb": round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1),
+        "bytes_written_per_topic": int((_disk_usage(DATA_PATHS) - before_disk) / max(1, len(topics))),
+    }
+
+
+def parse_arguments():
+    parser = argparse.ArgumentParser(description="Offline benchmark for the APLS/KTPM learning pipeline")
+    parser.add_argument('--topics', type=int, default=20, help='Number of synthetic topics (default: 20)')
+    parser.add_argument('--article-kb', type=int, default=64, help='Size of each synthetic article in KB (default: 64)')
+    parser.add_argument('--host-rate', type=float, default=1000.0,
+                        help='Per-host request rate for the fetch engine (default: 1000, effectively unthrottled)')
+    parser.add_argument('--bulk', action='store_true', help='Also time APLS.learn_about_topics on the process pool')
+    parser.add_argument('--json', type=str, default=None, help='Also write the results as JSON to this file')
+    return parser.parse_args()
+
+
+def main():
+    args = parse_arguments()
+    server = StandInServer(args.article_kb * 1024)
+    workdir = tempfile.mkdtemp(prefix="pybrain-bench-")
+    json_path = os.path.abspath(args.json) if args.json else None
+
+    # Import the learning modules from inside the scratch directory so every file they write lands there
+    os.chdir(workdir)
+    sys.path.insert(0, REPO_DIR)
+    with contextlib.redirect_stdout(io.StringIO()):
+        import APLS
+        import KTPM
+
+    search_url = f"http://127.0.0.1:{server.port}/search?q={{topic}}+site:wikipedia.org"
+    APLS.SEARCH_URL = KTPM.SEARCH_URL = search_url
+    APLS.fetch_engine.host_rate = args.host_rate
+    APLS.fetch_engine.host_burst = max(1, int(args.host_rate))
+
+    topics = [f"bench topic {n}" for n in range(args.topics)]
+    questions = [(topic, " ".join(random.Random(f"{topic}{q}").sample(_WORDS, 3)))
+                 for topic in topics for q in range(QUESTIONS_PER_TOPIC)]
+
+    results = []
+    try:
+        results.append(run_phase("learn_about_topic",
+                                 [lambda t=t: APLS.learn_about_topic(t) for t in topics], server, topics))
+        results.append(run_phase("passive_learning",
+                                 [lambda t=t: APLS.passive_learning(t) for t in topics], server, topics))
+        ktpm_topics = [f"{topic} articles" for topic in topics]
+        results.append(run_phase("monitor_and_learn_passively",
+                                 [lambda t=t: KTPM.monitor_and_learn_passively(t) for t in ktpm_topics],
+                                 server, ktpm_topics))
+        results.append(run_phase("answer_question",
+                                 [lambda t=t, q=q: APLS.answer_question(t, q) for t, q in questions],
+                                 server, topics))
+        if args.bulk:
+            bulk_topics = [f"{topic} bulk" for topic in topics]
+            results.append(run_phase("learn_about_topics (bulk)",
+                                     [lambda: APLS.learn_about_topics(bulk_topics)], server, bulk_topics))
+    finally:
+        APLS.knowledge_store.manifest.flush()  # Write it now, not at exit outside the scratch directory
+        os.chdir(REPO_DIR)
+        shutil.rmtree(workdir, ignore_errors=True)
+        server.stop()
+
+    columns = ("phase", "calls", "errors", "pages_per_sec", "p50_ms", "p99_ms", "peak_rss_mb",
+               "bytes_written_per_topic")
+    print(" | ".join(columns))
+    for result in results:
+        print(" | ".join(str(result[column]) for column in columns))
+
+    if json_path:
+        with open(json_path, "w") as file:
+            json.dump({"topics": args.topics, "article_kb": args.article_kb, "results": results}, file, indent=4)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,329 @@
+# Two-brain load generator and latency benchmark for the messaging layer
+#
+# Starts two instances of the FACE.py (or main.py) server on ephemeral local ports,
+# each in a production serving mode with its own message store in a scratch
+# directory. Client threads then send messages to both brains as fast as they
+# answer. With --batch-size 1 every message is one request to the single-message
+# endpoint (/receive_message or /send_message); larger batches go to
+# /messages/batch.
+#
+# A second phase measures brain-to-brain delivery: --delivery-messages messages
+# go from brain A to brain B through the PeerClient the UIs send with, and each is
+# timed until it shows up on brain B's /events stream.
+#
+# Reports throughput, p50/p95/p99 request latency (from sending a request to having
+# its acks back), p50/p95/p99 end-to-end delivery latency, the error rates, and the
+# CPU time and peak RSS of each server's process tree read from /proc. Linux only,
+# no external services.
+#
+# Usage:
+#   python bench_messaging.py --messages 20000 --concurrency 16 --message-size 256 --batch-size 10
+import argparse
+import json
+import os
+import shutil
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+
+from peer_client import FACE_PATH, MAIN_PATH, PeerClient, stream_events
+
+REPO_DIR = os.path.dirname(os.path.abspath(__file__))
+PASSWORD = "bench_password"
+SINGLE_ENDPOINTS = {"face": FACE_PATH, "main": MAIN_PATH}
+DELIVERY_TIMEOUT = 60  # Seconds to wait for the last delivered message to show up on /events
+CLOCK_TICKS = os.sysconf("SC_CLK_TCK")
+SAMPLE_INTERVAL = 0.2  # Seconds between /proc samples
+
+
+# Function to find a free local port
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def _percentile(samples, fraction):
+    if not samples:
+        return 0.0
+    ordered = sorted(samples)
+    return ordered[min(len(ordered) - 1, int(round(fraction * (len(ordered) - 1))))]
+
+
+# Function to list a process and all of its descendants (e.g. gunicorn workers)
+def process_tree(pid):
+    children = {}
+    for entry in os.listdir("/proc"):
+        if not entry.isdigit():
+            continue
+        try:
+            with open(f"/proc/{entry}/stat") as file:
+                stat = file.read()
+        except OSError:
+            continue
+        ppid = int(stat.rsplit(")", 1)[1].split()[1])
+        children.setdefault(ppid, []).append(int(entry))
+    tree, pending = [], [pid]
+    while pending:
+        current = pending.pop()
+        tree.append(current)
+        pending.extend(children.get(current, []))
+    return tree
+
+
+# Function to read CPU seconds and RSS in bytes of a process tree
+def tree_usage(pid):
+    cpu = rss = 0
+    for member in process_tree(pid):
+        try:
+            with open(f"/proc/{member}/stat") as file:
+                fields = file.read().rsplit(")", 1)[1].split()
+            with open(f"/proc/{member}/status") as file:
+                status = dict(line.split(":", 1) for line in file if ":" in line)
+        except OSError:
+            continue  # Exited between listing and reading
+        cpu += (int(fields[11]) + int(fields[12])) / CLOCK_TICKS  # utime + stime
+        rss += int(status.get("VmRSS", "0 kB").split()[0]) * 1024
+    return cpu, rss
+
+
+class BrainServer:
+    """One FACE.py or main.py server process in a production serving mode."""
+
+    def __init__(self, name, script, peer_port, args, workdir):
+        self.name = name
+        self.port = free_port()
+        self.workdir = os.path.join(workdir, name)
+        os.makedirs(self.workdir)
+        command = [sys.executable, os.path.join(REPO_DIR, f"{'FACE' if script == 'face' else 'main'}.py"),
+                   "--port", str(self.port), "--serve", args.serve, "--workers", str(args.workers),
+                   "--threads", str(args.threads), "--store", os.path.join(self.workdir, "messages.db")]
+        if script == "face":
+            command += ["--peer_port", str(peer_port), "--password", PASSWORD, "--host", "127.0.0.1"]
+        environment = dict(os.environ, BRAIN_COMM_PASSWORD=PASSWORD, PYTHONPATH=REPO_DIR)
+        self.log = open(os.path.join(self.workdir, "server.log"), "w")
+        self.process = subprocess.Popen(command, cwd=self.workdir, env=environment,
+                                        stdout=self.log, stderr=subprocess.STDOUT)
+        self.base_url = f"http://127.0.0.1:{self.port}"
+        self.peak_rss = 0
+
+    def wait_ready(self, timeout=60):
+        deadline = time.time() + timeout
+        while time.time() < deadline:
+            if self.process.poll() is not None:
+                raise RuntimeError(f"{self.name} exited with {self.process.returncode}, see its server.log")
+            try:
+                if requests.get(f"{self.base_url}/messages", headers={"X-Brain-Token": PASSWORD}, timeout=1).ok:
+                    return
+            except requests.exceptions.RequestException:
+                pass
+            time.sleep(0.2)
+        raise RuntimeError(f"{self.name} did not come up within {timeout}s")
+
+    def sample(self):
+        cpu, rss = tree_usage(self.process.pid)
+        self.peak_rss = max(self.peak_rss, rss)
+        return cpu
+
+    def stop(self):
+        self.process.terminate()
+        try:
+            self.process.wait(timeout=30)
+        except subprocess.TimeoutExpired:
+            self.process.kill()
+        self.log.close()
+
+
+def run_load(servers, args):
+    """Sends args.messages messages across both servers; returns latencies and error counts."""
+    payload = "x" * args.message_size
+    requests_needed = -(-args.messages // args.batch_size)
+    single_endpoint = SINGLE_ENDPOINTS[args.server]
+    local = threading.local()
+    latencies = []
+    errors = [0]
+    lock = threading.Lock()
+
+    def session():
+        if not hasattr(local, "session"):
+            local.session = requests.Session()
+            local.session.headers["X-Brain-Token"] = PASSWORD
+        return local.session
+
+    def send(number):
+        server = servers[number % len(servers)]  # Alternate between the two brains
+        count = min(args.batch_size, args.messages - number * args.batch_size)
+        began = time.perf_counter()
+        failed = 0
+        try:
+            if args.batch_size == 1:
+                response = session().post(server.base_url + single_endpoint,
+                                          json={"token": PASSWORD, "message": payload}, timeout=30)
+                failed = 0 if response.status_code == 200 else 1
+            else:
+                response = session().post(server.base_url + "/messages/batch",
+                                          json={"messages": [payload] * count}, timeout=30)
+                if response.status_code == 200:
+                    failed = sum(1 for ack in response.json()["acks"] if not ack.get("ok"))
+                else:
+                    failed = count
+        except requests.exceptions.RequestException:
+            failed = count
+        elapsed = time.perf_counter() - began
+        with lock:
+            latencies.append(elapsed)
+            errors[0] += failed
+
+    with ThreadPoolExecutor(max_workers=args.concurrency) as executor:
+        list(executor.map(send, range(requests_needed)))
+    return latencies, errors[0], requests_needed
+
+
+def run_delivery(receiver, args):
+    """
+    Sends args.delivery_messages messages to a brain through a PeerClient, as the other
+    brain's UI does, and times each one until the receiver's /events stream has it.
+    Returns the latencies and how many messages never arrived.
+    """
+    last_id = requests.get(f"{receiver.base_url}/messages", params={"limit": 1},
+                           headers={"X-Brain-Token": PASSWORD}, timeout=10).json()["last_id"]
+    sent = {}  # message -> perf_counter() when it was handed to the client
+    latencies = []
+    lock = threading.Lock()
+    all_seen = threading.Event()
+
+    def follow():
+        for entry in stream_events(receiver.base_url, PASSWORD, last_id, heartbeat=1):
+            if entry is None:
+                continue
+            arrived = time.perf_counter()
+            with lock:
+                began = sent.pop(entry["message"], None)
+                if began is not None:
+                    latencies.append(arrived - began)
+                if len(latencies) >= args.delivery_messages:
+                    all_seen.set()
+                    return
+
+    threading.Thread(target=follow, daemon=True).start()
+    time.sleep(0.5)  # Let the stream connect before the first message lands
+    client = PeerClient(receiver.base_url, PASSWORD, SINGLE_ENDPOINTS[args.server])
+    for number in range(args.delivery_messages):
+        message = f"{number}:".ljust(args.message_size, "x")
+        with lock:
+            sent[message] = time.perf_counter()
+        client.send(message)
+        if args.delivery_rate:
+            time.sleep(1 / args.delivery_rate)
+    all_seen.wait(DELIVERY_TIMEOUT)
+    client.close(wait=False)
+    with lock:
+        return list(latencies), len(sent)
+
+
+def parse_arguments():
+    parser = argparse.ArgumentParser(description="Two-brain load generator for the messaging layer")
+    parser.add_argument('--server', choices=sorted(SINGLE_ENDPOINTS), default="face",
+                        help='Which server script to benchmark (default: face)')
+    parser.add_argument('--messages', type=int, default=20000, help='Messages to send in total (default: 20000)')
+    parser.add_argument('--concurrency', type=int, default=16, help='Client threads sending at once (default: 16)')
+    parser.add_argument('--message-size', type=int, default=256, help='Bytes per message (default: 256)')
+    parser.add_argument('--batch-size', type=int, default=1,
+                        help='Messages per request; 1 uses the single-message endpoint (default: 1)')
+    parser.add_argument('--serve', choices=("waitress", "gunicorn"), default="waitress",
+                        help='Serving mode of the two servers (default: waitress)')
+    parser.add_argument('--workers', type=int, default=2, help='gunicorn worker processes per server (default: 2)')
+    parser.add_argument('--threads', type=int, default=8, help='Request threads per worker (default: 8)')
+    parser.add_argument('--delivery-messages', type=int, default=1000,
+                        help='Messages sent from one brain to the other to time end-to-end delivery (default: 1000)')
+    parser.add_argument('--delivery-rate', type=float, default=200,
+                        help='Delivery phase messages per second, 0 for as fast as possible (default: 200)')
+    parser.add_argument('--json', type=str, default=None, help='Also write the results as JSON to this file')
+    return parser.parse_args()
+
+
+def main():
+    args = parse_arguments()
+    workdir = tempfile.mkdtemp(prefix="pybrain-bench-messaging-")
+    json_path = os.path.abspath(args.json) if args.json else None
+
+    # Each brain names the other as its peer, as two FACE.py instances would
+    first = BrainServer("brain-a", args.server, free_port(), args, workdir)
+    second = BrainServer("brain-b", args.server, first.port, args, workdir)
+    servers = [first, second]
+    stop_sampling = threading.Event()
+    try:
+        for server in servers:
+            server.wait_ready()
+        cpu_before = [server.sample() for server in servers]
+
+        def sampler():
+            while not stop_sampling.wait(SAMPLE_INTERVAL):
+                for server in servers:
+                    server.sample()
+
+        threading.Thread(target=sampler, daemon=True).start()
+        start = time.perf_counter()
+        latencies, errors, request_count = run_load(servers, args)
+        elapsed = time.perf_counter() - start
+        stop_sampling.set()
+        cpu_after = [server.sample() for server in servers]
+        deliveries, undelivered = run_delivery(second, args) if args.delivery_messages else ([], 0)
+    finally:
+        stop_sampling.set()
+        for server in servers:
+            server.stop()
+        shutil.rmtree(workdir, ignore_errors=True)
+
+    result = {
+        "server": args.server,
+        "serve": args.serve,
+        "messages": args.messages,
+        "requests": request_count,
+        "concurrency": args.concurrency,
+        "message_size": args.message_size,
+        "batch_size": args.batch_size,
+        "seconds": round(elapsed, 3),
+        "messages_per_sec": round(args.messages / elapsed, 1) if elapsed else 0.0,
+        "requests_per_sec": round(request_count / elapsed, 1) if elapsed else 0.0,
+        "p50_ms": round(_percentile(latencies, 0.50) * 1000, 2),
+        "p95_ms": round(_percentile(latencies, 0.95) * 1000, 2),
+        "p99_ms": round(_percentile(latencies, 0.99) * 1000, 2),
+        "errors": errors,
+        "error_rate": round(errors / args.messages, 4) if args.messages else 0.0,
+        "delivery_messages": args.delivery_messages,
+        "delivery_p50_ms": round(_percentile(deliveries, 0.50) * 1000, 2),
+        "delivery_p95_ms": round(_percentile(deliveries, 0.95) * 1000, 2),
+        "delivery_p99_ms": round(_percentile(deliveries, 0.99) * 1000, 2),
+        "undelivered": undelivered,
+        "servers": [{
+            "name": server.name,
+            "cpu_seconds": round(after - before, 2),
+            "cpu_percent": round(100 * (after - before) / elapsed, 1) if elapsed else 0.0,
+            "peak_rss_mb": round(server.peak_rss / (1024 * 1024), 1),
+        } for server, before, after in zip(servers, cpu_before, cpu_after)],
+    }
+
+    columns = ("messages_per_sec", "requests_per_sec", "p50_ms", "p95_ms", "p99_ms", "error_rate")
+    print(" | ".join(columns))
+    print(" | ".join(str(result[column]) for column in columns))
+    if args.delivery_messages:
+        print(f"brain-to-brain delivery: p50 {result['delivery_p50_ms']} ms, p95 {result['delivery_p95_ms']} ms, "
+              f"p99 {result['delivery_p99_ms']} ms, {undelivered} of {args.delivery_messages} not delivered")
+    for server in result["servers"]:
+        print(f"{server['name']}: cpu {server['cpu_seconds']}s ({server['cpu_percent']}%), "
+              f"peak rss {server['peak_rss_mb']} MB")
+
+    if json_path:
+        with open(json_path, "w") as file:
+            json.dump(result, file, indent=4)
+
+
+if __name__ == "__main__":
+    main()
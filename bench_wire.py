@@ -0,0 +1,123 @@
+# Benchmark of the peer payload encodings in wire.py
+#
+# Encodes and decodes the payloads brains actually exchange in every format and
+# coding wire.py offers here:
+#
+#   messages  a /messages/batch body of --batch-size chat messages
+#   entries   a /sync/entries answer of knowledge entries (definitions, examples,
+#             article blob references)
+#   blobs     a /sync/blobs answer carrying article texts
+#
+# Reports bytes on the wire, the ratio to plain JSON, and the median encode and
+# decode time per payload over --repeat rounds. No servers and no network involved.
+#
+# Usage:
+#   python bench_wire.py --batch-size 500 --message-size 256 --repeat 50 --json bench_wire.json
+import argparse
+import hashlib
+import json
+import random
+import time
+
+import wire
+
+_WORDS = ("knowledge schema learning network model data system theory process structure "
+          "function method signal memory language pattern neuron concept science history "
+          "algorithm computer brain value field study research analysis object feature").split()
+
+
+def _sentence(rng, size):
+    words = []
+    while sum(len(word) + 1 for word in words) < size:
+        words.append(rng.choice(_WORDS))
+    return " ".join(words)[:size]
+
+
+# Function to build the benchmark payloads, deterministic for a given seed
+def payloads(batch_size, message_size, article_kb, seed=0):
+    rng = random.Random(seed)
+    messages = {"token": "bench_password",
+                "messages": [_sentence(rng, message_size) for _ in range(batch_size)]}
+    entries = {"entries": []}
+    for number in range(batch_size):
+        field = rng.choice(("definitions", "examples", "use_cases", "articles"))
+        if field == "articles":
+            value = {"blob": hashlib.sha256(str(number).encode()).hexdigest()}
+        else:
+            value = _sentence(rng, rng.randint(40, 240))
+        entry = json.dumps([field, value], sort_keys=True).encode()
+        entries["entries"].append({"h": hashlib.blake2b(entry, digest_size=16).hexdigest(),
+                                   "f": field, "v": value})
+    blobs = {"blobs": {hashlib.sha256(str(number).encode()).hexdigest(): _sentence(rng, article_kb * 1024)
+                       for number in range(max(1, batch_size // 50))}}
+    return {"messages": messages, "entries": entries, "blobs": blobs}
+
+
+# Function to list every (format, coding) pair wire.py supports in this environment
+def encodings():
+    return [(content_type, coding) for content_type in reversed(wire.formats())
+            for coding in [None] + wire.codings()]
+
+
+def _median(samples):
+    ordered = sorted(samples)
+    return ordered[len(ordered) // 2]
+
+
+def measure(payload, content_type, coding, repeat):
+    encode_times, decode_times = [], []
+    for _ in range(repeat):
+        began = time.perf_counter()
+        body, headers = wire.encode_body(payload, content_type, coding)
+        encode_times.append(time.perf_counter() - began)
+        began = time.perf_counter()
+        decoded = wire.decode_body(body, headers["Content-Type"], headers.get("Content-Encoding"))
+        decode_times.append(time.perf_counter() - began)
+    if decoded != payload:
+        raise RuntimeError(f"{content_type} with {coding} did not round-trip")
+    return len(body), _median(encode_times), _median(decode_times)
+
+
+def parse_arguments():
+    parser = argparse.ArgumentParser(description="Benchmark of the peer payload encodings")
+    parser.add_argument('--batch-size', type=int, default=500, help='Messages or entries per payload (default: 500)')
+    parser.add_argument('--message-size', type=int, default=256, help='Bytes per chat message (default: 256)')
+    parser.add_argument('--article-kb', type=int, default=32, help='Size of each article text in KB (default: 32)')
+    parser.add_argument('--repeat', type=int, default=30, help='Rounds per measurement (default: 30)')
+    parser.add_argument('--json', type=str, default=None, help='Also write the results as JSON to this file')
+    return parser.parse_args()
+
+
+def main():
+    args = parse_arguments()
+    results = []
+    for name, payload in payloads(args.batch_size, args.message_size, args.article_kb).items():
+        baseline = None
+        for content_type, coding in encodings():
+            size, encode, decode = measure(payload, content_type, coding, args.repeat)
+            baseline = baseline or size  # Plain JSON comes first
+            results.append({
+                "payload": name,
+                "format": content_type.split("/")[1],
+                "coding": coding or "none",
+                "bytes": size,
+                "ratio": round(size / baseline, 3),
+                "encode_ms": round(encode * 1000, 3),
+                "decode_ms": round(decode * 1000, 3),
+            })
+
+    columns = ("payload", "format", "coding", "bytes", "ratio", "encode_ms", "decode_ms")
+    print(" | ".join(columns))
+    for result in results:
+        print(" | ".join(str(result[column]) for column in columns))
+    missing = [name for name, module in (("msgpack", wire.msgpack), ("zstandard", wire.zstandard)) if module is None]
+    if missing:
+        print(f"Not installed, so not measured: {', '.join(missing)}")
+
+    if args.json:
+        with open(args.json, "w") as file:
+            json.dump({"arguments": vars(args), "results": results}, file, indent=4)
+
+
+if __name__ == "__main__":
+    main()
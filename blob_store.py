@@ -0,0 +1,168 @@
+# Content-addressed blob store for article texts
+#
+# KTPM keeps whole Wikipedia articles, and the same article is often collected under
+# several topics. Each text is stored here once, zlib-compressed and keyed by the
+# sha256 of its content; topic logs only hold a {"blob": <sha256>} reference.
+#
+#   knowledge_store/@blobs/pack-00000001.dat  compressed texts back to back
+#   knowledge_store/@blobs/index.jsonl        one {"h", "p", "o", "l"} line per blob
+#
+# Packs are read through mmap, so reading one article decompresses that article and
+# nothing else. A pack's bytes are always written before its index line, so a crash
+# leaves at most some unreferenced bytes at the end of the active pack, or a pack
+# past it; both are dropped when the store is opened again.
+import hashlib
+import json
+import mmap
+import os
+import threading
+import re
+import zlib
+from collections.abc import Sequence
+
+INDEX_FILE = "index.jsonl"
+PACK_MAX_BYTES = 64 * 1024 * 1024  # Start a new pack past this size
+COMPRESSION_LEVEL = 6
+_PACK_RE = re.compile(r"pack-(\d{8})\.dat")
+
+
+def _pack_name(pack):
+    return f"pack-{pack:08d}.dat"
+
+
+# Function to build the reference a topic log stores in place of a text
+def make_ref(digest):
+    return {"blob": digest}
+
+
+def is_ref(value):
+    return isinstance(value, dict) and "blob" in value
+
+
+def content_hash(text):
+    return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+
+class BlobStore:
+    """Deduplicated, compressed text storage with an in-memory hash index."""
+
+    def __init__(self, root, pack_max_bytes=PACK_MAX_BYTES):
+        self.root = root
+        self.pack_max_bytes = pack_max_bytes
+        self.index = {}  # sha256 -> (pack, offset, length)
+        self.active_pack = 1
+        self.active_size = 0
+        self._maps = {}  # pack -> mmap
+        self._lock = threading.Lock()
+        self._load()
+
+    def _path(self, pack):
+        return os.path.join(self.root, _pack_name(pack))
+
+    def _load(self):
+        os.makedirs(self.root, exist_ok=True)
+        index_path = os.path.join(self.root, INDEX_FILE)
+        if os.path.exists(index_path):
+            valid = 0
+            with open(index_path, "rb") as file:
+                for line in file:
+                    if not line.endswith(b"\n"):
+                        break  # Torn write from a crash, drop it below
+                    try:
+                        entry = json.loads(line)
+                    except ValueError:
+                        break
+                    self.index[entry["h"]] = (entry["p"], entry["o"], entry["l"])
+                    self.active_pack = max(self.active_pack, entry["p"])
+                    valid += len(line)
+            if valid != os.path.getsize(index_path):
+                with open(index_path, "r+b") as file:
+                    file.truncate(valid)
+
+        # Drop bytes written to the active pack whose index line never made it
+        end = max((offset + length for pack, offset, length in self.index.values()
+                   if pack == self.active_pack), default=0)
+        active = self._path(self.active_pack)
+        if os.path.exists(active) and os.path.getsize(active) > end:
+            with open(active, "r+b") as file:
+                file.truncate(end)
+        self.active_size = end
+
+        # A crash right after a rollover can leave a pack no index line points into yet
+        for name in os.listdir(self.root):
+            match = _PACK_RE.fullmatch(name)
+            if match and int(match.group(1)) > self.active_pack:
+                os.remove(os.path.join(self.root, name))
+
+    def __contains__(self, digest):
+        return digest in self.index
+
+    def __len__(self):
+        return len(self.index)
+
+    def put(self, text):
+        """Stores a text if it isn't stored yet and returns its sha256."""
+        digest = content_hash(text)
+        if digest in self.index:
+            return digest
+        data = zlib.compress(text.encode("utf-8"), COMPRESSION_LEVEL)
+
+        with self._lock:
+            if digest in self.index:  # Stored by another thread meanwhile
+                return digest
+            if self.active_size and self.active_size + len(data) > self.pack_max_bytes:
+                self.active_pack += 1
+                self.active_size = 0
+            with open(self._path(self.active_pack), "ab") as pack:
+                offset = pack.tell()  # Where the bytes really land, whatever the file already held
+                pack.write(data)
+            line = json.dumps({"h": digest, "p": self.active_pack, "o": offset, "l": len(data)}) + "\n"
+            with open(os.path.join(self.root, INDEX_FILE), "a") as index:
+                index.write(line)
+            self.index[digest] = (self.active_pack, offset, len(data))
+            self.active_size = offset + len(data)
+        return digest
+
+    def _map(self, pack, end):
+        with self._lock:
+            mapped = self._maps.get(pack)
+            if mapped is None or len(mapped) < end:  # The active pack grew since it was mapped
+                if mapped is not None:
+                    mapped.close()
+                with open(self._path(pack), "rb") as file:
+                    mapped = self._maps[pack] = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+            return mapped
+
+    def get(self, digest):
+        pack, offset, length = self.index[digest]
+        data = self._map(pack, offset + length)[offset:offset + length]
+        return zlib.decompress(data).decode("utf-8")
+
+    def resolve(self, value):
+        """Returns the text behind a reference, or the value itself if it isn't one."""
+        return self.get(value["blob"]) if is_ref(value) else value
+
+    def close(self):
+        with self._lock:
+            for mapped in self._maps.values():
+                mapped.close()
+            self._maps.clear()
+
+
+class LazyBlobList(Sequence):
+    """A read-only list of stored values whose blob references are resolved on access."""
+
+    def __init__(self, values, blobs):
+        self.values = values
+        self.blobs = blobs
+
+    def __len__(self):
+        return len(self.values)
+
+    def __getitem__(self, item):
+        if isinstance(item, slice):
+            return LazyBlobList(self.values[item], self.blobs)
+        return self.blobs.resolve(self.values[item])
+
+    def __repr__(self):
+        return f"LazyBlobList({len(self.values)} values)"
@@ -0,0 +1,199 @@
+# Near-duplicate index (shingling + MinHash + LSH banding)
+#
+# KTPM used to compare every new article against every stored one with
+# difflib.SequenceMatcher. This index keeps one MinHash signature per stored article
+# and buckets the signatures by LSH bands, so a lookup only compares against the
+# few articles that share a band with the new text.
+#
+# Signatures are stored next to the topic's segments in `minhash.bin` as raw
+# unsigned 64-bit integers, NUM_PERM per article, appended in store order.
+# They are computed with NumPy in exact uint64 arithmetic, so they are the same
+# as the pure Python ones existing signature files were written with.
+import hashlib
+import os
+import random
+import re
+import threading
+from array import array
+
+import numpy as np
+
+from knowledge_store import ARTICLES_FIELD, get_store
+
+NUM_PERM = 128  # Hash functions per signature
+BANDS = 16  # LSH bands of NUM_PERM // BANDS rows; (1/16)^(1/8) puts the LSH threshold near 0.7
+SHINGLE_SIZE = 5  # Words per shingle
+SIMILARITY_THRESHOLD = 0.7  # Same cut-off validate_information has always used
+SIGNATURE_FILE = "minhash.bin"
+
+_PRIME = (1 << 61) - 1
+_rng = random.Random(1)  # Fixed seed, signatures must stay comparable across runs
+_PERMUTATIONS = [(_rng.randrange(1, _PRIME), _rng.randrange(0, _PRIME)) for _ in range(NUM_PERM)]
+_P = np.uint64(_PRIME)
+_LOW32 = np.uint64(0xFFFFFFFF)
+_LOW29 = np.uint64((1 << 29) - 1)
+_A = np.array([a for a, _ in _PERMUTATIONS], dtype=np.uint64)[:, None]  # One row per permutation
+_A_HI, _A_LO = _A >> np.uint64(32), _A & _LOW32
+_B = np.array([b for _, b in _PERMUTATIONS], dtype=np.uint64)[:, None]
+_CHUNK = 4096  # Shingles hashed per step, bounds the NUM_PERM x chunk temporaries
+_WORD_RE = re.compile(r"\w+")
+
+
+# Function to split a text into hashed word shingles
+def shingle_hashes(text, size=SHINGLE_SIZE):
+    words = _WORD_RE.findall(text.lower())
+    if len(words) < size:
+        grams = {" ".join(words)}
+    else:
+        grams = {" ".join(words[i:i + size]) for i in range(len(words) - size + 1)}
+    return {int.from_bytes(hashlib.blake2b(gram.encode("utf-8"), digest_size=8).digest(), "little")
+            for gram in grams}
+
+
+# Function to fold a uint64 array below 2 * _PRIME, using 2^61 = 1 (mod _PRIME)
+def _fold(x):
+    return (x & _P) + (x >> np.uint64(61))
+
+
+# Function to compute (a * h + b) % _PRIME for every permutation and hash without overflowing uint64
+# a and h are split into 32-bit halves; 2^64 = 8 and 2^61 = 1 (mod _PRIME) fold the partial products
+def _permuted(hashes):
+    h = _fold(hashes)
+    h = np.where(h >= _P, h - _P, h)
+    h_hi, h_lo = h >> np.uint64(32), h & _LOW32
+    mid = _A_HI * h_lo + _A_LO * h_hi  # < 2^62
+    total = ((_A_HI * h_hi) << np.uint64(3)) \
+        + (mid >> np.uint64(29)) + ((mid & _LOW29) << np.uint64(32)) \
+        + _fold(_A_LO * h_lo) + _B  # < 2^64
+    total = _fold(total)
+    return np.where(total >= _P, total - _P, total)
+
+
+# Function to compute the MinHash signature of a text
+def minhash_signature(text):
+    hashes = np.fromiter(shingle_hashes(text), dtype=np.uint64)
+    signature = np.full(NUM_PERM, np.iinfo(np.uint64).max, dtype=np.uint64)
+    for start in range(0, len(hashes), _CHUNK):
+        np.minimum(signature, _permuted(hashes[start:start + _CHUNK]).min(axis=1), out=signature)
+    return signature.tolist()
+
+
+# Function to estimate Jaccard similarity from two signatures
+def estimate_similarity(sig_a, sig_b):
+    return sum(1 for a, b in zip(sig_a, sig_b) if a == b) / NUM_PERM
+
+
+class NearDuplicateIndex:
+    """MinHash/LSH index over the articles stored for one topic."""
+
+    def __init__(self, topic, store=None, threshold=SIMILARITY_THRESHOLD):
+        self.topic = topic
+        self.store = store or get_store()
+        self.threshold = threshold
+        self.path = os.path.join(self.store.topic_dir(topic), SIGNATURE_FILE)
+        self.signatures = []
+        self.buckets = [{} for _ in range(BANDS)]
+        self._last = (None, None)  # Memo so validating and adding the same text hashes once
+        self._lock = threading.RLock()
+        self._load()
+
+    def _load(self):
+        if os.path.exists(self.path):
+            values = array("Q")
+            with open(self.path, "rb") as file:
+                data = file.read()
+            whole = len(data) - len(data) % (NUM_PERM * values.itemsize)
+            values.frombytes(data[:whole])
+            for i in range(0, len(values), NUM_PERM):
+                self._insert(values[i:i + NUM_PERM].tolist())
+            if whole != len(data):  # Torn signature from a crash
+                with open(self.path, "r+b") as file:
+                    file.truncate(whole)
+
+        # Catch up with articles appended without the index (legacy imports, older runs)
+        self.catch_up()
+
+    def catch_up(self):
+        """Adds signatures for articles stored since the index last saw the topic, e.g. by a sync."""
+        with self._lock:
+            if self.store.count(self.topic, ARTICLES_FIELD) <= len(self.signatures):
+                return
+            for article in self.store.read_lazy(self.topic, ARTICLES_FIELD, start=len(self.signatures)):
+                self.add(article)
+
+    def signature(self, text_or_signature):
+        if not isinstance(text_or_signature, str):
+            return list(text_or_signature)
+        text, signature = self._last
+        if text is not text_or_signature:
+            signature = minhash_signature(text_or_signature)
+            self._last = (text_or_signature, signature)
+        return signature
+
+    def _band_keys(self, signature):
+        rows = NUM_PERM // BANDS
+        return [tuple(signature[band * rows:(band + 1) * rows]) for band in range(BANDS)]
+
+    def _insert(self, signature):
+        position = len(self.signatures)
+        self.signatures.append(signature)
+        for bucket, key in zip(self.buckets, self._band_keys(signature)):
+            bucket.setdefault(key, []).append(position)
+
+    def candidates(self, text_or_signature):
+        signature = self.signature(text_or_signature)
+        with self._lock:
+            found = set()
+            for bucket, key in zip(self.buckets, self._band_keys(signature)):
+                found.update(bucket.get(key, ()))
+            return found
+
+    def is_duplicate(self, text_or_signature):
+        signature = self.signature(text_or_signature)
+        with self._lock:
+            return any(estimate_similarity(signature, self.signatures[position]) > self.threshold
+                       for position in self.candidates(signature))
+
+    def add(self, text_or_signature):
+        signature = self.signature(text_or_signature)
+        with self._lock:
+            with open(self.path, "ab") as file:
+                array("Q", signature).tofile(file)
+            self._insert(signature)
+
+    def add_stored(self, text_or_signature):
+        """Adds the signature of the article just appended to the store, unless a catch-up already has."""
+        signature = self.signature(text_or_signature)
+        with self._lock:
+            if len(self.signatures) < self.store.count(self.topic, ARTICLES_FIELD):
+                self.add(signature)
+
+    def __len__(self):
+        return len(self.signatures)
+
+
+_indexes = {}
+_indexes_lock = threading.Lock()
+
+
+# Function to get the shared near-duplicate index of a topic, caught up with its stored articles
+def get_dedup_index(topic, store=None):
+    store = store or get_store()
+    key = (store.root, topic)
+    with _indexes_lock:
+        index = _indexes.get(key)
+        if index is None:
+            index = _indexes[key] = NearDuplicateIndex(topic, store)
+            return index
+    index.catch_up()
+    return index
+
+
+# Function to catch a topic's index up with articles stored behind its back, if it is loaded
+# Unloaded indexes catch up by themselves when they are next opened
+def catch_up_dedup_index(topic, store=None):
+    store = store or get_store()
+    with _indexes_lock:
+        index = _indexes.get((store.root, topic))
+    if index is not None:
+        index.catch_up()
@@ -0,0 +1,141 @@
+# Concurrent fetch engine with per-host rate limiting
+#
+# APLS and KTPM used to download pages one at a time and APLS slept a fixed two
+# seconds after each one. The engine below downloads on a bounded thread pool and
+# spaces requests to the same host with a token bucket, so independent pages are
+# fetched in parallel while every host still sees a polite request rate.
+import logging
+import random
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import urlsplit
+
+import requests
+
+MAX_WORKERS = 8  # Pages downloaded at the same time
+HOST_RATE = 1.0  # Requests per second allowed to a single host
+HOST_BURST = 3  # Requests a host may receive back to back before the rate applies
+TIMEOUT = 10  # Seconds for connect and for each read
+MAX_RETRIES = 3  # Attempts after the first one
+BACKOFF_BASE = 0.5  # Seconds, doubled per retry with full jitter
+MAX_BACKOFF = 30.0  # Longest wait between attempts, whatever a server's Retry-After asks for
+RETRY_STATUSES = {429, 500, 502, 503, 504}
+USER_AGENT = "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/58.0.3029.110 Safari/537.3"
+
+
+class TokenBucket:
+    """Refills `rate` tokens per second up to `capacity`; acquire() blocks for one."""
+
+    def __init__(self, rate, capacity):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def acquire(self):
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                wait = (1 - self.tokens) / self.rate
+            time.sleep(wait)
+
+
+class FetchEngine:
+    """Thread-pool downloader shared by APLS and KTPM."""
+
+    def __init__(self, max_workers=MAX_WORKERS, host_rate=HOST_RATE, host_burst=HOST_BURST,
+                 timeout=TIMEOUT, max_retries=MAX_RETRIES, backoff_base=BACKOFF_BASE, max_backoff=MAX_BACKOFF):
+        self.host_rate = host_rate
+        self.host_burst = host_burst
+        self.timeout = timeout
+        self.max_retries = max_retries
+        self.backoff_base = backoff_base
+        self.max_backoff = max_backoff
+        self.executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="fetch")
+        self._buckets = {}
+        self._buckets_lock = threading.Lock()
+        self._local = threading.local()
+
+    def _session(self):
+        # requests.Session is not thread-safe, so each worker keeps its own pooled session
+        session = getattr(self._local, "session", None)
+        if session is None:
+            session = self._local.session = requests.Session()
+            session.headers["User-Agent"] = USER_AGENT
+        return session
+
+    def _bucket(self, url):
+        host = urlsplit(url).netloc
+        with self._buckets_lock:
+            if host not in self._buckets:
+                self._buckets[host] = TokenBucket(self.host_rate, self.host_burst)
+            return self._buckets[host]
+
+    def _backoff(self, attempt, response=None):
+        retry_after = response.headers.get("Retry-After") if response is not None else None
+        if retry_after and retry_after.isdigit():
+            return min(self.max_backoff, float(retry_after))
+        return random.uniform(0, min(self.max_backoff, self.backoff_base * (2 ** attempt)))
+
+    def get(self, url, headers=None, stream=False):
+        """
+        GETs a URL under the host's rate limit, retrying connection errors, timeouts
+        and 429/5xx responses with exponential backoff. The last response is returned
+        as is, so callers still decide what a bad status means to them.
+        """
+        bucket = self._bucket(url)
+        for attempt in range(self.max_retries + 1):
+            bucket.acquire()
+            try:
+                response = self._session().get(url, headers=headers, timeout=self.timeout, stream=stream)
+            except (requests.exceptions.ConnectionError, requests.exceptions.Timeout) as e:
+                if attempt == self.max_retries:
+                    raise
+                delay = self._backoff(attempt)
+                logging.warning(f"Fetching {url} failed ({e}), retrying in {delay:.1f}s")
+            else:
+                if response.status_code not in RETRY_STATUSES or attempt == self.max_retries:
+                    return response
+                delay = self._backoff(attempt, response)
+                response.close()
+                logging.warning(f"Fetching {url} returned {response.status_code}, retrying in {delay:.1f}s")
+            time.sleep(delay)
+
+    def map(self, func, items, return_exceptions=False):
+        """
+        Runs func over items on the pool and returns the results in input order.
+        With return_exceptions, a failed item yields its exception instead of raising.
+        """
+        futures = [self.executor.submit(func, item) for item in items]
+        results = []
+        for future in futures:
+            try:
+                results.append(future.result())
+            except Exception as e:
+                if not return_exceptions:
+                    raise
+                results.append(e)
+        return results
+
+    def shutdown(self):
+        self.executor.shutdown(wait=True)
+
+
+_engine = None
+_engine_lock = threading.Lock()
+
+
+# Function to get the fetch engine shared by every module of this process
+def get_fetch_engine():
+    global _engine
+    with _engine_lock:
+        if _engine is None:
+            _engine = FetchEngine()
+        return _engine
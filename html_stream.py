@@ -0,0 +1,135 @@
+# Streaming paragraph extractor
+#
+# scrape_wikipedia_page used to build a full BeautifulSoup tree for each article and
+# call get_text() twice per <p>. The extractor below is an event-driven
+# html.parser.HTMLParser that is fed the response while it downloads and only keeps
+# the text of the paragraph it is currently inside, never a DOM.
+#
+# The output matches the old "\n".join of every non-empty <p>'s get_text(), and can
+# optionally stop reading once enough sentences for a definition/example are in.
+import codecs
+import time
+from html.parser import HTMLParser
+
+import metrics
+from metrics import instrument
+
+CHUNK_SIZE = 16 * 1024
+_SKIPPED_TAGS = {"script", "style"}  # get_text() leaves their strings out as well
+_VOID_TAGS = {"area", "base", "br", "col", "embed", "hr", "img", "input", "link", "meta",
+              "source", "track", "wbr"}
+
+
+class ParagraphExtractor(HTMLParser):
+    """Collects the text of every <p> element as the HTML is fed in."""
+
+    def __init__(self):
+        super().__init__(convert_charrefs=True)
+        self.paragraphs = []
+        self.sentences = 0  # "." seen in completed paragraphs, the split APLS uses
+        self._parts = None  # Text of the open <p>, None outside of one
+        self._open_tags = []  # Names of the currently open elements, only the names
+        self._paragraph_depth = None  # Position of the open <p> in _open_tags
+        self._skip_depth = 0
+
+    def handle_starttag(self, tag, attrs):
+        if tag in _VOID_TAGS:
+            return
+        if tag == "p":
+            self._close_paragraph()  # A new <p> implicitly closes an unterminated one
+            self._parts = []
+            self._paragraph_depth = len(self._open_tags)
+        elif tag in _SKIPPED_TAGS:
+            self._skip_depth += 1
+        self._open_tags.append(tag)
+
+    def handle_startendtag(self, tag, attrs):
+        pass  # Self-closing tags carry no text
+
+    def handle_endtag(self, tag):
+        if tag not in self._open_tags:
+            return  # Stray end tag, ignored like the tree builders do
+        # Pop up to the matching start tag, closing whatever was left open inside it
+        while self._open_tags:
+            closed = self._open_tags.pop()
+            if closed in _SKIPPED_TAGS and self._skip_depth:
+                self._skip_depth -= 1
+            if self._paragraph_depth is not None and len(self._open_tags) <= self._paragraph_depth:
+                self._close_paragraph()
+            if closed == tag:
+                break
+
+    def handle_data(self, data):
+        if self._parts is not None and not self._skip_depth:
+            self._parts.append(data)
+
+    def _close_paragraph(self):
+        if self._parts is None:
+            return
+        text = "".join(self._parts)
+        self._parts = None
+        del self._open_tags[self._paragraph_depth:]
+        self._paragraph_depth = None
+        if text:
+            self.paragraphs.append(text)
+            self.sentences += text.count(".")
+
+    def close(self):
+        super().close()
+        self._close_paragraph()
+
+    def text(self):
+        return "\n".join(self.paragraphs)
+
+
+# Function to extract the paragraph text of an HTML document that is already in memory
+@instrument("html_parse")
+def extract_paragraph_text(html):
+    extractor = ParagraphExtractor()
+    extractor.feed(html)
+    extractor.close()
+    return extractor.text()
+
+
+# Function to extract paragraph text from a streamed requests response
+def stream_paragraph_text(response, sink=None, max_sentences=None):
+    """
+    Feeds a `stream=True` response into a ParagraphExtractor chunk by chunk.
+
+    Every raw chunk is also handed to `sink` when one is given (the page cache uses
+    it to compress the body on the fly). With `max_sentences`, reading stops as soon
+    as the completed paragraphs hold that many sentences.
+
+    Time spent waiting for the body is recorded as the page_download stage and the
+    rest as html_parse, so slow servers don't show up as slow parsing.
+
+    Returns (text, complete); complete is False when the page was cut short.
+    """
+    extractor = ParagraphExtractor()
+    decoder = codecs.getincrementaldecoder(response.encoding or "utf-8")(errors="replace")
+    chunks = response.iter_content(chunk_size=CHUNK_SIZE)
+    started = time.perf_counter()
+    downloading = 0.0
+    error = True
+    try:
+        while True:
+            waited = time.perf_counter()
+            chunk = next(chunks, None)
+            downloading += time.perf_counter() - waited
+            if chunk is None:
+                break
+            if sink is not None:
+                sink(chunk)
+            extractor.feed(decoder.decode(chunk))
+            if max_sentences is not None and extractor.sentences >= max_sentences:
+                error = False
+                return extractor.text(), False
+        extractor.feed(decoder.decode(b"", final=True))
+        extractor.close()
+        error = False
+        return extractor.text(), True
+    finally:
+        response.close()
+        if metrics.ENABLED:
+            metrics.observe("page_download", downloading, error)
+            metrics.observe("html_parse", time.perf_counter() - started - downloading, error)
@@ -0,0 +1,126 @@
+# Process-pool parse-and-validate stage for bulk ingestion
+#
+# Extracting paragraph text and computing MinHash signatures are CPU-bound, so doing
+# them on the main thread keeps a bulk ingestion run on a single core no matter how
+# many pages were downloaded. This pipeline keeps the network on the fetch engine's
+# threads and ships downloaded pages to a ProcessPoolExecutor in chunks, so parse
+# work for one chunk overlaps with the downloads of the next.
+#
+# Results come back in link order. The order-sensitive part, deciding whether a
+# page duplicates something stored earlier, stays with the caller, which feeds the
+# precomputed signatures to update_schema one page at a time.
+import logging
+import os
+import threading
+import zlib
+from concurrent.futures import ProcessPoolExecutor
+
+import metrics
+from dedup_index import minhash_signature
+from fetch_engine import get_fetch_engine
+from html_stream import extract_paragraph_text
+from page_cache import COMPRESSION_LEVEL, get_page_cache
+
+CHUNK_SIZE = 8  # Pages handed to a worker process per task
+WORKERS = os.cpu_count() or 1
+
+
+# Function run in the worker processes: extract, sign and compress a chunk of pages
+# The chunk's metrics go back with it, the parent merges them into its own
+def _prepare_chunk(items, with_signatures):
+    metrics.drain()  # Values inherited from the parent when the worker was forked
+    prepared = []
+    for kind, payload in items:
+        if kind == "html":
+            text = extract_paragraph_text(payload)
+            compressed = zlib.compress(payload.encode("utf-8"), COMPRESSION_LEVEL)
+        else:  # Text revalidated from the page cache, nothing to parse
+            text, compressed = payload, None
+        signature = minhash_signature(text) if with_signatures else None
+        prepared.append((text, signature, compressed))
+    return prepared, metrics.drain()
+
+
+class IngestPipeline:
+    """Downloads on threads, parses and signs on processes, returns results in order."""
+
+    def __init__(self, workers=WORKERS, chunk_size=CHUNK_SIZE):
+        self.chunk_size = chunk_size
+        self.executor = ProcessPoolExecutor(max_workers=workers)
+        self.fetch_engine = get_fetch_engine()
+        self.page_cache = get_page_cache()
+
+    def _fetch(self, url, headers):
+        response = self.fetch_engine.get(url, headers=headers)
+        response.raise_for_status()
+        return response
+
+    def _download(self, url):
+        text, response = self.page_cache.revalidate(url, self._fetch)
+        if response is None:
+            return "text", text, None
+        return "html", response.text, response
+
+    def _submit(self, batch, with_signatures):
+        items = [(download[0], download[1]) for _, download in batch if not isinstance(download, Exception)]
+        return batch, self.executor.submit(_prepare_chunk, items, with_signatures)
+
+    def run(self, links, with_signatures=False):
+        """
+        Returns one (link, text, signature) per link, in link order; a link that failed
+        to download or parse yields (link, exception, None) instead.
+        """
+        downloads = [self.fetch_engine.executor.submit(self._download, link) for link in links]
+
+        # Hand pages to the process pool chunk by chunk as their downloads finish
+        submitted = []
+        batch = []
+        for link, future in zip(links, downloads):
+            try:
+                batch.append((link, future.result()))
+            except Exception as e:
+                batch.append((link, e))
+            if len(batch) >= self.chunk_size:
+                submitted.append(self._submit(batch, with_signatures))
+                batch = []
+        if batch:
+            submitted.append(self._submit(batch, with_signatures))
+
+        results = []
+        for batch, future in submitted:
+            try:
+                prepared, worker_metrics = future.result()
+                prepared, error = iter(prepared), None
+                metrics.merge(worker_metrics)
+            except Exception as e:
+                prepared, error = None, e
+                logging.error(f"Parsing a batch of {len(batch)} pages failed: {e}")
+
+            for link, download in batch:
+                if isinstance(download, Exception):
+                    results.append((link, download, None))
+                elif error is not None:
+                    results.append((link, error, None))
+                else:
+                    text, signature, compressed = next(prepared)
+                    response = download[2]
+                    if compressed is not None and response.status_code == 200:
+                        self.page_cache.put(link, response.headers, compressed, text)
+                    results.append((link, text, signature))
+        return results
+
+    def shutdown(self):
+        self.executor.shutdown(wait=True)
+
+
+_pipeline = None
+_pipeline_lock = threading.Lock()
+
+
+# Function to get the ingestion pipeline shared by every module of this process
+def get_ingest_pipeline():
+    global _pipeline
+    with _pipeline_lock:
+        if _pipeline is None:
+            _pipeline = IngestPipeline()
+        return _pipeline
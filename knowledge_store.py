@@ -0,0 +1,413 @@
+# Append-only segmented knowledge store
+#
+# Topic knowledge used to live in a single `{topic}_knowledge.json` file that was
+# read, extended by one item and rewritten in full on every update. This store keeps
+# each topic as a directory of append-only segment files instead:
+#
+#   knowledge_store/<topic>/seg-00000001-00000001.log
+#
+# Every line of a segment is one JSON record `{"f": <field>, "v": <value>}`. An
+# in-memory offset index maps each field to the byte ranges of its values, so an
+# append is a single write to the active segment and a read of entry N is one seek.
+# Sealed segments are merged in the background once too many of them pile up.
+# Per-topic counts, strength and a content digest are kept in `manifest.json`.
+# Article texts are stored once in the content-addressed blob store under `@blobs/`
+# and the topic logs only reference them.
+import json
+import logging
+import os
+import threading
+from urllib.parse import quote, unquote
+
+from blob_store import BlobStore, LazyBlobList, is_ref, make_ref
+from manifest import MANIFEST_FILE, TopicManifest, chain_digest
+from metrics import instrument
+
+STORE_DIR = "knowledge_store"
+SEGMENT_MAX_BYTES = 4 * 1024 * 1024  # Roll over to a new segment past this size
+COMPACTION_SEGMENTS = 8  # Merge sealed segments once this many have accumulated
+
+# Fields of the JSON schema written by APLS.store_learned_data
+SCHEMA_FIELDS = ("definitions", "examples", "use_cases", "related_topics", "sources")
+# Field holding the raw article texts collected by KTPM.update_schema
+ARTICLES_FIELD = "articles"
+# Blob store directory inside the store root; "@" is escaped in topic directory names
+BLOB_DIR = "@blobs"
+
+
+LEGACY_SUFFIX = "_knowledge.json"
+
+
+# Function to build the legacy single-file name for a topic
+def legacy_file_name(topic):
+    return f"{topic}{LEGACY_SUFFIX}"
+
+
+# Function to list the topics that have a legacy single-file knowledge file in the working directory
+def legacy_topics():
+    return [name[:-len(LEGACY_SUFFIX)] for name in os.listdir(".")
+            if name.endswith(LEGACY_SUFFIX) and os.path.isfile(name)]
+
+
+def _segment_name(first, last):
+    return f"seg-{first:08d}-{last:08d}.log"
+
+
+def _parse_segment_name(name):
+    if not (name.startswith("seg-") and name.endswith(".log")):
+        return None
+    try:
+        first, last = name[4:-4].split("-")
+        return int(first), int(last)
+    except ValueError:
+        return None
+
+
+class _TopicLog:
+    """Segment files and offset index of a single topic."""
+
+    def __init__(self, directory, segment_max_bytes):
+        self.directory = directory
+        self.segment_max_bytes = segment_max_bytes
+        self.lock = threading.RLock()
+        self.segments = []  # [(first, last)] in log order, the last one is active
+        self.index = {}  # field -> [(segment, offset, length)]
+        self.active_size = 0  # Bytes in the active segment
+        self.compacting = False
+        self._load()
+
+    def _path(self, segment):
+        return os.path.join(self.directory, _segment_name(*segment))
+
+    def _load(self):
+        os.makedirs(self.directory, exist_ok=True)
+        found = sorted(
+            (parsed for parsed in map(_parse_segment_name, os.listdir(self.directory)) if parsed),
+            key=lambda seg: (seg[0], -seg[1]),
+        )
+
+        # A compaction that crashed after writing its merged segment leaves the
+        # segments it covered behind; the merged one wins.
+        for segment in found:
+            if self.segments and segment[1] <= self.segments[-1][1]:
+                os.remove(self._path(segment))
+                continue
+            self.segments.append(segment)
+
+        for segment in self.segments:
+            self._index_segment(segment)
+
+        if not self.segments:
+            self.segments.append((1, 1))
+        active = self._path(self.segments[-1])
+        self.active_size = os.path.getsize(active) if os.path.exists(active) else 0
+
+    def _index_segment(self, segment):
+        path = self._path(segment)
+        offset = 0
+        with open(path, "rb") as file:
+            for line in file:
+                if not line.endswith(b"\n"):
+                    break  # Torn write from a crash, drop it below
+                try:
+                    record = json.loads(line)
+                except ValueError:
+                    break
+                self.index.setdefault(record["f"], []).append((segment, offset, len(line)))
+                offset += len(line)
+
+        if offset != os.path.getsize(path):
+            with open(path, "r+b") as file:
+                file.truncate(offset)
+
+    def _roll(self):
+        next_id = self.segments[-1][1] + 1
+        self.segments.append((next_id, next_id))
+        self.active_size = 0
+
+    def append(self, records):
+        lines = [
+            (field, (json.dumps({"f": field, "v": value}) + "\n").encode("utf-8"))
+            for field, value in records
+        ]
+        with self.lock:
+            if self.active_size >= self.segment_max_bytes:
+                self._roll()
+            segment = self.segments[-1]
+            offset = self.active_size
+            # Opened per append so thousands of idle topics don't each pin a file handle
+            with open(self._path(segment), "ab") as active:
+                active.write(b"".join(line for _, line in lines))
+            for field, line in lines:
+                self.index.setdefault(field, []).append((segment, offset, len(line)))
+                offset += len(line)
+            self.active_size = offset
+
+    def read(self, field, start=0, stop=None):
+        with self.lock:
+            locations = self.index.get(field, [])[start:stop]
+            handles = {}
+            values = []
+            try:
+                for segment, offset, length in locations:
+                    file = handles.get(segment)
+                    if file is None:
+                        file = handles[segment] = open(self._path(segment), "rb")
+                    file.seek(offset)
+                    values.append(json.loads(file.read(length))["v"])
+            finally:
+                for file in handles.values():
+                    file.close()
+            return values
+
+    def read_all(self):
+        """Reads every record in log order with one sequential pass per segment."""
+        with self.lock:
+            records = []
+            for segment in self.segments:
+                if not os.path.exists(self._path(segment)):
+                    continue  # Active segment of a topic nothing was appended to yet
+                with open(self._path(segment), "rb") as file:
+                    for line in file:
+                        record = json.loads(line)
+                        records.append((record["f"], record["v"]))
+            return records
+
+    def count(self, field):
+        with self.lock:
+            return len(self.index.get(field, []))
+
+    def fields(self):
+        with self.lock:
+            return [field for field, locations in self.index.items() if locations]
+
+    def counts(self):
+        with self.lock:
+            return {field: len(locations) for field, locations in self.index.items() if locations}
+
+    def sealed_segments(self):
+        with self.lock:
+            return self.segments[:-1]
+
+    def compact(self):
+        """Merges all sealed segments into one, leaving the active segment alone."""
+        sealed = self.sealed_segments()
+        if len(sealed) < 2:
+            return False
+
+        # Sealed segments are immutable, so they can be copied without the lock
+        merged = (sealed[0][0], sealed[-1][1])
+        bases = {}
+        tmp_path = self._path(merged) + ".tmp"
+        with open(tmp_path, "wb") as out:
+            for segment in sealed:
+                bases[segment] = out.tell()
+                with open(self._path(segment), "rb") as src:
+                    while True:
+                        chunk = src.read(1024 * 1024)
+                        if not chunk:
+                            break
+                        out.write(chunk)
+            out.flush()
+            os.fsync(out.fileno())
+
+        with self.lock:
+            os.replace(tmp_path, self._path(merged))
+            for field, locations in self.index.items():
+                self.index[field] = [
+                    (merged, bases[seg] + offset, length) if seg in bases else (seg, offset, length)
+                    for seg, offset, length in locations
+                ]
+            self.segments = [merged] + self.segments[len(sealed):]
+
+        for segment in sealed:
+            if segment != merged:
+                os.remove(self._path(segment))
+        return True
+
+
+
+class KnowledgeStore:
+    """
+    Append-only knowledge storage shared by APLS and KTPM.
+
+    APLS topics use the schema fields in SCHEMA_FIELDS, KTPM topics keep their
+    article texts under ARTICLES_FIELD. Topics that still only exist as a legacy
+    `{topic}_knowledge.json` file are imported when the store is opened, so the
+    manifest knows their strength before anyone asks.
+    """
+
+    def __init__(self, root=STORE_DIR, segment_max_bytes=SEGMENT_MAX_BYTES,
+                 compaction_segments=COMPACTION_SEGMENTS):
+        self.root = root
+        self.segment_max_bytes = segment_max_bytes
+        self.compaction_segments = compaction_segments
+        self._topics = {}
+        self._lock = threading.Lock()
+        self.blobs = BlobStore(os.path.join(root, BLOB_DIR))
+        self.manifest = TopicManifest(os.path.join(root, MANIFEST_FILE))
+        if not self.manifest.exists:
+            self.rebuild_manifest()  # Store written before the manifest existed
+        self.import_legacy_topics()
+
+    def topic_dir(self, topic):
+        return os.path.join(self.root, quote(topic, safe=" "))
+
+    def _log(self, topic):
+        with self._lock:
+            log = self._topics.get(topic)
+            if log is not None:
+                return log
+            directory = self.topic_dir(topic)
+            is_new = not os.path.isdir(directory)
+            log = self._topics[topic] = _TopicLog(directory, self.segment_max_bytes)
+
+        if is_new and os.path.exists(legacy_file_name(topic)):
+            self.import_json(topic, legacy_file_name(topic))
+        elif not is_new:
+            record = self.manifest.get(topic)
+            if record is None or record["counts"] != log.counts():
+                self._reconcile(topic, log)  # Manifest missed writes, e.g. after a crash
+        return log
+
+    def _reconcile(self, topic, log):
+        with log.lock:
+            self.manifest.reset(topic, log.counts(), chain_digest("", log.read_all()))
+
+    def rebuild_manifest(self):
+        """Recomputes the manifest record of every topic directory from its segments."""
+        if not os.path.isdir(self.root):
+            return
+        for name in os.listdir(self.root):
+            if name != BLOB_DIR and os.path.isdir(os.path.join(self.root, name)):
+                self._log(unquote(name))  # Opening a topic reconciles its manifest record
+        self.manifest.flush()
+
+    def import_legacy_topics(self):
+        """Imports every legacy knowledge file whose topic the store doesn't have yet."""
+        for topic in legacy_topics():
+            if not os.path.isdir(self.topic_dir(topic)):
+                try:
+                    self._log(topic)  # Opening a new topic imports its legacy file
+                except (OSError, ValueError) as e:
+                    logging.warning(f"Could not import {legacy_file_name(topic)}: {e}")
+        self.manifest.flush()
+
+    def has_topic(self, topic):
+        if topic in self.manifest or topic in self._topics:
+            return True
+        return os.path.exists(legacy_file_name(topic))
+
+    def topics(self):
+        return self.manifest.topics()
+
+    def append(self, topic, field, value):
+        self.append_many(topic, [(field, value)])
+
+    @instrument("persistence")
+    def append_many(self, topic, records):
+        """Appends (field, value) pairs to a topic with a single write."""
+        if not records:
+            return
+        # Article texts go to the blob store once, the topic log keeps a reference
+        records = [(field, make_ref(self.blobs.put(value)))
+                   if field == ARTICLES_FIELD and isinstance(value, str) else (field, value)
+                   for field, value in records]
+        log = self._log(topic)
+        with log.lock:
+            log.append(records)
+            self.manifest.record_append(topic, records)
+        self._maybe_compact(log)
+
+    def read(self, topic, field, start=0, stop=None):
+        values = self._log(topic).read(field, start, stop)
+        if field == ARTICLES_FIELD:
+            return [self.blobs.resolve(value) for value in values]
+        return values
+
+    def read_lazy(self, topic, field, start=0, stop=None):
+        """Like read(), but article texts are only decompressed when accessed."""
+        return LazyBlobList(self._log(topic).read(field, start, stop), self.blobs)
+
+    def read_raw(self, topic, field, start=0, stop=None):
+        """Like read(), but article values stay blob references."""
+        return self._log(topic).read(field, start, stop)
+
+    def count(self, topic, field):
+        return self._log(topic).count(field)
+
+    def counts(self, topic):
+        """Number of stored values per field of a topic."""
+        return self._log(topic).counts()
+
+    def load_schema(self, topic):
+        """Rebuilds the JSON schema dictionary APLS has always worked with."""
+        schema = {"topic": topic}
+        for field in SCHEMA_FIELDS:
+            schema[field] = []
+        for field, value in self._log(topic).read_all():
+            schema.setdefault(field, []).append(self.blobs.resolve(value) if is_ref(value) else value)
+        return schema
+
+    # Function to import a legacy `{topic}_knowledge.json` file into the store
+    def import_json(self, topic, file_name=None):
+        file_name = file_name or legacy_file_name(topic)
+        with open(file_name, "r") as file:
+            knowledge = json.load(file)
+
+        if isinstance(knowledge, list):  # KTPM writes a plain list of articles
+            records = [(ARTICLES_FIELD, value) for value in knowledge]
+        else:
+            records = [(field, value)
+                       for field in SCHEMA_FIELDS + (ARTICLES_FIELD,)
+                       for value in knowledge.get(field, [])]
+        self.append_many(topic, records)
+
+    # Function to export a topic back to the single-file JSON format
+    def export_json(self, topic, file_name=None):
+        file_name = file_name or legacy_file_name(topic)
+        log = self._log(topic)
+        if log.fields() == [ARTICLES_FIELD]:
+            knowledge = self.read(topic, ARTICLES_FIELD)
+        else:
+            knowledge = self.load_schema(topic)
+
+        with open(file_name, "w") as file:
+            json.dump(knowledge, file, indent=4)
+
+    def _maybe_compact(self, log):
+        if len(log.sealed_segments()) < self.compaction_segments:
+            return
+        with log.lock:
+            if log.compacting:
+                return
+            log.compacting = True
+
+        def run():
+            try:
+                log.compact()
+            finally:
+                log.compacting = False
+
+        threading.Thread(target=run, daemon=True).start()
+
+    def compact(self, topic):
+        return self._log(topic).compact()
+
+    def close(self):
+        self.manifest.flush()
+        self.blobs.close()
+        with self._lock:
+            self._topics.clear()
+
+
+_stores = {}
+_stores_lock = threading.Lock()
+
+
+# Function to get the store shared by every module of this process
+def get_store(root=STORE_DIR):
+    with _stores_lock:
+        if root not in _stores:
+            _stores[root] = KnowledgeStore(root)
+        return _stores[root]
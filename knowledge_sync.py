@@ -0,0 +1,483 @@
+# Digest-based delta sync of knowledge between two brains
+#
+# Brains used to exchange only chat strings; comparing or merging knowledge meant
+# shipping whole `{topic}_knowledge.json` files. Here every stored record of a topic
+# is identified by a hash of its field and value (article texts are blob references,
+# so an article is identified by its content hash), and each brain summarises a
+# topic as a hash tree over those entry hashes:
+#
+#   node(prefix) = digest of all entry hashes starting with `prefix`, plus their count
+#
+# A node has one child per next hex digit. Two brains compare their root digests,
+# then only descend into children whose digests differ. Once a subtree holds at most
+# LEAF_SIZE entries on both sides, its entry hashes are listed and compared directly.
+# Only the entries one side lacks are transferred, in batches of at most SYNC_BATCH
+# entries, and article texts only when the receiving blob store lacks them.
+#
+# Every batch is applied on its own and applying an entry twice is a no-op, so an
+# interrupted sync simply resumes: the next run's digest walk only finds what is
+# still missing. Two brains with 100k entries that differ by a handful converge in
+# a few small requests.
+#
+#   GET  /sync/topics   {"topics": {topic: {"digest", "count"}}}
+#   POST /sync/digest   {"topic", "prefixes"} -> child digests and counts per prefix
+#   POST /sync/hashes   {"topic", "prefixes"} -> entry hashes per prefix
+#   POST /sync/entries  {"topic", "hashes"}   -> [{"h", "f", "v"}] stored entries
+#   POST /sync/blobs    {"hashes"}            -> {"blobs": {sha256: text}}
+#   POST /sync/push     {"topic", "entries", "blobs"} -> entries applied, blobs still missing
+#
+# Bodies are negotiated like the other peer traffic (JSON, msgpack, gzip/zstd; see wire.py).
+import argparse
+import hashlib
+import json
+import logging
+import threading
+from bisect import bisect_left, insort
+
+import requests
+from flask import jsonify, request
+
+import metrics
+from blob_store import content_hash, is_ref, make_ref
+from dedup_index import catch_up_dedup_index
+from knowledge_store import ARTICLES_FIELD, get_store
+from message_routes import request_token
+from serving import PROCESSES_CONFIG
+from wire import PeerEncoding, post, request_data, respond
+
+HEX_DIGITS = "0123456789abcdef"
+LEAF_SIZE = 64  # Subtrees this small on both sides are compared entry by entry
+MAX_PREFIXES = 256  # Prefixes per digest or hashes request
+MAX_HASHES = 4096  # Entry hashes per hashes response
+SYNC_BATCH = 500  # Entries per entries or push request
+BLOB_BATCH_BYTES = 8 * 1024 * 1024  # Article text bytes per blobs or push request
+TIMEOUT = 30
+
+
+# Function to identify a stored record by its field and (raw, blob-referencing) value
+def entry_hash(field, value):
+    data = json.dumps([field, value], sort_keys=True, separators=(",", ":")).encode("utf-8")
+    return hashlib.blake2b(data, digest_size=16).hexdigest()
+
+
+def _chunks(items, size):
+    for start in range(0, len(items), size):
+        yield items[start:start + size]
+
+
+class TopicDigest:
+    """Sorted entry hashes of one topic and the hash tree over them, kept up to date incrementally."""
+
+    def __init__(self, store, topic):
+        self.store = store
+        self.topic = topic
+        self.hashes = []  # Sorted, one per distinct entry
+        self.locations = {}  # entry hash -> (field, position in the field)
+        self.processed = {}  # field -> values already hashed
+        self.lock = threading.RLock()
+        self._nodes = {}  # prefix -> (digest, count)
+
+    def refresh(self):
+        with self.lock:
+            added = []
+            for field, count in self.store.counts(self.topic).items():
+                start = self.processed.get(field, 0)
+                if count <= start:
+                    continue
+                for position, value in enumerate(self.store.read_raw(self.topic, field, start, count), start):
+                    digest = entry_hash(field, value)
+                    if digest not in self.locations:
+                        self.locations[digest] = (field, position)
+                        added.append(digest)
+                self.processed[field] = count
+            if len(added) > LEAF_SIZE:
+                self.hashes = sorted(self.locations)
+            else:
+                for digest in added:
+                    insort(self.hashes, digest)
+            if added:
+                self._nodes.clear()
+        return self
+
+    def _range(self, prefix):
+        # "g" sorts after every hex digit, so [prefix, prefix + "g") is the subtree
+        return bisect_left(self.hashes, prefix), bisect_left(self.hashes, prefix + "g")
+
+    def node(self, prefix=""):
+        """Returns (digest, count) of the entries whose hash starts with `prefix`."""
+        with self.lock:
+            node = self._nodes.get(prefix)
+            if node is None:
+                low, high = self._range(prefix)
+                digest = hashlib.blake2b("".join(self.hashes[low:high]).encode("ascii"),
+                                         digest_size=16).hexdigest() if high > low else ""
+                node = self._nodes[prefix] = (digest, high - low)
+            return node
+
+    def children(self, prefix):
+        return [self.node(prefix + digit) for digit in HEX_DIGITS]
+
+    def hashes_under(self, prefix):
+        with self.lock:
+            low, high = self._range(prefix)
+            return self.hashes[low:high]
+
+    def entries(self, hashes):
+        """Returns the stored entries behind the given hashes, skipping unknown ones."""
+        entries = []
+        with self.lock:
+            for digest in hashes:
+                location = self.locations.get(digest)
+                if location is None:
+                    continue
+                field, position = location
+                value = self.store.read_raw(self.topic, field, position, position + 1)[0]
+                entries.append({"h": digest, "f": field, "v": value})
+        return entries
+
+    def apply(self, entries):
+        """
+        Stores the entries this topic lacks. Returns how many were added and the blob
+        hashes of the entries that couldn't be, because their article text is missing.
+        """
+        records = []
+        missing_blobs = []
+        with self.lock:
+            self.refresh()
+            known = set(self.locations)
+            for entry in entries:
+                field, value = (entry.get("f"), entry.get("v")) if isinstance(entry, dict) else (None, None)
+                if not isinstance(field, str):
+                    continue
+                if field == ARTICLES_FIELD and isinstance(value, str):
+                    value = make_ref(self.store.blobs.put(value))  # What append_many would store
+                if is_ref(value) and value["blob"] not in self.store.blobs:
+                    missing_blobs.append(value["blob"])
+                    continue
+                digest = entry_hash(field, value)
+                if digest not in known:
+                    known.add(digest)
+                    records.append((field, value))
+            self.store.append_many(self.topic, records)
+            self.refresh()
+        # Synced articles need MinHash signatures, or KTPM's duplicate check can't see them
+        if any(field == ARTICLES_FIELD for field, _ in records):
+            catch_up_dedup_index(self.topic, self.store)
+        return len(records), missing_blobs
+
+
+class SyncIndex:
+    """TopicDigest of every topic of a knowledge store."""
+
+    def __init__(self, store):
+        self.store = store
+        self._topics = {}
+        self._lock = threading.Lock()
+
+    def topic(self, topic):
+        with self._lock:
+            digest = self._topics.get(topic)
+            if digest is None:
+                digest = self._topics[topic] = TopicDigest(self.store, topic)
+        return digest.refresh()
+
+    def summary(self):
+        summary = {}
+        for topic in self.store.topics():
+            digest, count = self.topic(topic).node("")
+            summary[topic] = {"digest": digest, "count": count}
+        return summary
+
+
+_indexes = {}
+_indexes_lock = threading.Lock()
+
+
+# Function to get the sync index of a knowledge store (the process-wide store by default)
+def get_sync_index(store=None):
+    store = store or get_store()
+    with _indexes_lock:
+        index = _indexes.get(id(store))
+        if index is None:
+            index = _indexes[id(store)] = SyncIndex(store)
+        return index
+
+
+# Function to add blob texts to a store, returning the hashes that were stored
+def store_blobs(store, blobs):
+    stored = []
+    for digest, text in blobs.items():
+        # A text is only accepted under its own content hash
+        if isinstance(text, str) and content_hash(text) == digest:
+            store.blobs.put(text)
+            stored.append(digest)
+    return stored
+
+
+def register_sync_routes(app, password, get_index=get_sync_index):
+    """
+    Adds the knowledge sync routes to a Flask app. `password` is a callable returning
+    the token requests must carry, `get_index` returns the SyncIndex to serve.
+
+    The routes answer 503 when the app is served by several processes: each would
+    append to the same knowledge store with its own offsets and manifest.
+    """
+
+    @app.before_request
+    def single_process_only():
+        if request.path.startswith("/sync/") and app.config.get(PROCESSES_CONFIG, 1) > 1:
+            return jsonify({"error": "Knowledge sync needs a single-process server, e.g. --serve waitress"}), 503
+
+    def unauthorized():
+        return request_token() != password()
+
+    def topic_request(limit_key, limit):
+        data = request_data()
+        if not isinstance(data, dict) or not isinstance(data.get("topic"), str) \
+                or not isinstance(data.get(limit_key, []), list):
+            return None, (jsonify({"error": "Invalid request format"}), 400)
+        if len(data.get(limit_key, [])) > limit:
+            return None, (jsonify({"error": f"At most {limit} {limit_key} per request"}), 413)
+        return data, None
+
+    @app.route('/sync/topics', methods=['GET'])
+    @metrics.instrument("sync_topics")
+    def sync_topics():
+        if unauthorized():
+            return jsonify({"error": "Unauthorized"}), 401
+        return respond({"topics": get_index().summary()})
+
+    @app.route('/sync/digest', methods=['POST'])
+    @metrics.instrument("sync_digest")
+    def sync_digest():
+        if unauthorized():
+            return jsonify({"error": "Unauthorized"}), 401
+        data, error = topic_request("prefixes", MAX_PREFIXES)
+        if error:
+            return error
+        digest = get_index().topic(data["topic"])
+        return respond({"children": {prefix: digest.children(prefix) for prefix in data["prefixes"]}})
+
+    @app.route('/sync/hashes', methods=['POST'])
+    @metrics.instrument("sync_hashes")
+    def sync_hashes():
+        if unauthorized():
+            return jsonify({"error": "Unauthorized"}), 401
+        data, error = topic_request("prefixes", MAX_PREFIXES)
+        if error:
+            return error
+        digest = get_index().topic(data["topic"])
+        hashes = {prefix: digest.hashes_under(prefix) for prefix in data["prefixes"]}
+        if sum(map(len, hashes.values())) > MAX_HASHES:
+            return jsonify({"error": f"More than {MAX_HASHES} hashes, ask for narrower prefixes"}), 413
+        return respond({"hashes": hashes})
+
+    @app.route('/sync/entries', methods=['POST'])
+    @metrics.instrument("sync_entries")
+    def sync_entries():
+        if unauthorized():
+            return jsonify({"error": "Unauthorized"}), 401
+        data, error = topic_request("hashes", SYNC_BATCH)
+        if error:
+            return error
+        return respond({"entries": get_index().topic(data["topic"]).entries(data["hashes"])})
+
+    @app.route('/sync/blobs', methods=['POST'])
+    @metrics.instrument("sync_blobs")
+    def sync_blobs():
+        """Returns article texts by hash, up to BLOB_BATCH_BYTES; ask again for the rest."""
+        if unauthorized():
+            return jsonify({"error": "Unauthorized"}), 401
+        data = request_data()
+        hashes = data.get("hashes") if isinstance(data, dict) else None
+        if not isinstance(hashes, list):
+            return jsonify({"error": "Invalid request format"}), 400
+        blobs = get_index().store.blobs
+        texts, size = {}, 0
+        for digest in hashes:
+            if digest not in blobs:
+                continue
+            if texts and size >= BLOB_BATCH_BYTES:
+                break
+            texts[digest] = blobs.get(digest)
+            size += len(texts[digest])
+        return respond({"blobs": texts})
+
+    @app.route('/sync/push', methods=['POST'])
+    @metrics.instrument("sync_push")
+    def sync_push():
+        """Applies entries a peer found missing here; reports article texts still needed."""
+        if unauthorized():
+            return jsonify({"error": "Unauthorized"}), 401
+        data, error = topic_request("entries", SYNC_BATCH)
+        if error:
+            return error
+        index = get_index()
+        blobs = data.get("blobs")
+        if isinstance(blobs, dict):
+            store_blobs(index.store, blobs)
+        applied, missing_blobs = index.topic(data["topic"]).apply(data["entries"])
+        metrics.inc("sync_entries_received", applied)
+        return respond({"applied": applied, "missing_blobs": sorted(set(missing_blobs))})
+
+
+class SyncClient:
+    """Reconciles the local knowledge store with one peer's, topic by topic."""
+
+    def __init__(self, base_url, password, index=None, timeout=TIMEOUT):
+        self.base_url = base_url.rstrip("/")
+        self.index = index or get_sync_index()
+        self.store = self.index.store
+        self.timeout = timeout
+        self.session = requests.Session()
+        self.session.headers["X-Brain-Token"] = password
+        self.encoding = PeerEncoding()
+        self.stats = {"topics": 0, "requests": 0, "pulled": 0, "pushed": 0, "blobs": 0}
+
+    def _call(self, method, path, payload=None):
+        self.stats["requests"] += 1
+        response = post(self.session, self.base_url + path, payload, self.encoding, self.timeout, method)
+        response.raise_for_status()
+        if response.data is None:
+            raise ValueError(f"Undecodable answer from {self.base_url + path}")
+        return response.data
+
+    def diff(self, topic, remote_count):
+        """Walks both hash trees; returns (hashes only the peer has, hashes only we have)."""
+        local = self.index.topic(topic)
+        missing_local, missing_remote = [], []
+        pending, leaves = [("", remote_count)], []
+        while pending:
+            descend = []
+            for prefix, count in pending:
+                local_count = local.node(prefix)[1]
+                if count == 0:
+                    missing_remote.extend(local.hashes_under(prefix))  # Nothing to ask the peer
+                elif max(count, local_count) <= LEAF_SIZE:
+                    leaves.append((prefix, count))
+                else:
+                    descend.append(prefix)
+            pending = []
+            for prefixes in _chunks(descend, MAX_PREFIXES):
+                children = self._call("POST", "/sync/digest", {"topic": topic, "prefixes": prefixes})["children"]
+                for prefix in prefixes:
+                    for digit, (digest, count) in zip(HEX_DIGITS, children[prefix]):
+                        if local.node(prefix + digit)[0] != digest:
+                            pending.append((prefix + digit, count))
+
+        # List the differing leaves in requests of at most MAX_HASHES hashes
+        batches, batch, size = [], [], 0
+        for prefix, count in leaves:
+            if batch and (len(batch) >= MAX_PREFIXES or size + count > MAX_HASHES):
+                batches.append(batch)
+                batch, size = [], 0
+            batch.append(prefix)
+            size += count
+        if batch:
+            batches.append(batch)
+        for prefixes in batches:
+            remote = self._call("POST", "/sync/hashes", {"topic": topic, "prefixes": prefixes})["hashes"]
+            for prefix in prefixes:
+                theirs, ours = set(remote[prefix]), set(local.hashes_under(prefix))
+                missing_local.extend(sorted(theirs - ours))
+                missing_remote.extend(sorted(ours - theirs))
+        return missing_local, missing_remote
+
+    def _fetch_blobs(self, hashes):
+        hashes = [digest for digest in dict.fromkeys(hashes) if digest not in self.store.blobs]
+        while hashes:
+            blobs = self._call("POST", "/sync/blobs", {"hashes": hashes})["blobs"]
+            # Only the requested texts are taken, and only under their own hash
+            stored = set(store_blobs(self.store, {digest: blobs[digest] for digest in hashes if digest in blobs}))
+            if not stored:
+                break  # The peer doesn't have the rest either, or only sent texts that don't match
+            self.stats["blobs"] += len(stored)
+            hashes = [digest for digest in hashes if digest not in stored]
+
+    def pull(self, topic, hashes):
+        local = self.index.topic(topic)
+        for batch in _chunks(hashes, SYNC_BATCH):
+            entries = self._call("POST", "/sync/entries", {"topic": topic, "hashes": batch})["entries"]
+            self._fetch_blobs([entry["v"]["blob"] for entry in entries if is_ref(entry.get("v"))])
+            applied, _ = local.apply(entries)
+            self.stats["pulled"] += applied
+
+    def push(self, topic, hashes):
+        local = self.index.topic(topic)
+        for batch in _chunks(hashes, SYNC_BATCH):
+            entries = local.entries(batch)
+            result = self._call("POST", "/sync/push", {"topic": topic, "entries": entries})
+            self.stats["pushed"] += result["applied"]
+            if not result["missing_blobs"]:
+                continue
+
+            # Send the entries the peer couldn't store again, with their article texts
+            waiting = {}
+            for entry in entries:
+                if is_ref(entry["v"]):
+                    waiting.setdefault(entry["v"]["blob"], []).append(entry)
+            group, texts, size = [], {}, 0
+            for digest in result["missing_blobs"]:
+                text = self.store.blobs.get(digest)
+                group.extend(waiting.get(digest, []))
+                texts[digest] = text
+                size += len(text)
+                if size >= BLOB_BATCH_BYTES:
+                    self._push_with_blobs(topic, group, texts)
+                    group, texts, size = [], {}, 0
+            if group:
+                self._push_with_blobs(topic, group, texts)
+
+    def _push_with_blobs(self, topic, entries, texts):
+        result = self._call("POST", "/sync/push", {"topic": topic, "entries": entries, "blobs": texts})
+        self.stats["pushed"] += result["applied"]
+        self.stats["blobs"] += len(texts)
+
+    def sync(self, topics=None, push=True):
+        """Brings the given topics (default: every topic on either side) in line with the peer."""
+        remote = self._call("GET", "/sync/topics")["topics"]
+        if topics is None:
+            topics = sorted(set(remote) | set(self.store.topics()))
+        for topic in topics:
+            summary = remote.get(topic, {"digest": "", "count": 0})
+            if summary["count"] == 0 and not self.store.has_topic(topic):
+                continue
+            if self.index.topic(topic).node("")[0] == summary["digest"]:
+                continue
+            missing_local, missing_remote = self.diff(topic, summary["count"])
+            self.pull(topic, missing_local)
+            if push:
+                self.push(topic, missing_remote)
+            self.stats["topics"] += 1
+        metrics.inc("sync_entries_pulled", self.stats["pulled"])
+        metrics.inc("sync_entries_pushed", self.stats["pushed"])
+        return self.stats
+
+    def close(self):
+        self.session.close()
+
+
+# Function to sync the local knowledge store with a peer brain, returning transfer statistics
+def sync_with_peer(base_url, password, topics=None, push=True, index=None):
+    client = SyncClient(base_url, password, index)
+    try:
+        return client.sync(topics, push)
+    finally:
+        client.close()
+
+
+def parse_arguments():
+    parser = argparse.ArgumentParser(description="Sync this brain's knowledge store with a peer brain")
+    parser.add_argument('--peer', type=str, required=True, help='Base URL of the peer, e.g. http://localhost:5001')
+    parser.add_argument('--password', type=str, required=True, help='Token the peer accepts')
+    parser.add_argument('--topic', action='append', default=None, help='Topic to sync (repeatable, default: all)')
+    parser.add_argument('--pull-only', action='store_true', help="Only fetch what we lack, don't push to the peer")
+    return parser.parse_args()
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    args = parse_arguments()
+    stats = sync_with_peer(args.peer, args.password, args.topic, push=not args.pull_only)
+    logging.info(f"Synced {stats['topics']} topics in {stats['requests']} requests: pulled {stats['pulled']}, "
+                 f"pushed {stats['pushed']} entries and {stats['blobs']} article texts")
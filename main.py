@@ -1,77 +1,147 @@
 # brain_communication.py
+import argparse
 import os
 import threading
-from flask import Flask, request, jsonify
+import time
+from flask import Flask, Response, jsonify
 import streamlit as st
+import metrics
+from message_log import follow, open_message_log
+from knowledge_sync import register_sync_routes
+from message_routes import register_message_routes
+from peer_client import MAIN_PATH, get_peer_client, stream_events
+from serving import add_serving_arguments, serve_from_args, store_path
+from wire import install_wire, request_data
 
 # Flask Server Setup
 app = Flask(__name__)
+install_wire(app)  # Peers may send and accept msgpack and compressed bodies
 
 # Secure communication settings
 DEFAULT_PASSWORD = "securepassword"
 DEFAULT_PORT = 5000
 password = os.getenv("BRAIN_COMM_PASSWORD", DEFAULT_PASSWORD)
-messages = []
+# Bounded conversation log; set BRAIN_COMM_SPILL_FILE to also keep every message on disk,
+# or BRAIN_COMM_STORE (--store) to share it through sqlite with other processes
+messages = open_message_log(os.getenv("BRAIN_COMM_STORE"), os.getenv("BRAIN_COMM_SPILL_FILE"))
+DISPLAY_LIMIT = 200  # Messages shown in the UI
+STATUS_LIMIT = 10  # Recent deliveries whose status is shown
+LIVE_HEARTBEAT = 1  # Seconds between keep-alives of the UI's event stream, so reruns aren't held up
 
 @app.route('/send_message', methods=['POST'])
+@metrics.instrument("send_message")
 def send_message():
     """Endpoint to handle incoming messages."""
-    data = request.json
+    data = request_data()
     if not data or "message" not in data or "token" not in data:
         return jsonify({"error": "Invalid request format"}), 400
 
     if data["token"] != password:
+        metrics.inc("messages_rejected")
         return jsonify({"error": "Unauthorized"}), 403
 
     # Add message to the conversation
-    messages.append({"sender": "Remote Brain", "message": data["message"]})
+    messages.append("Remote Brain", data["message"])
+    metrics.inc("messages_received")
     return jsonify({"success": True}), 200
 
-def run_flask():
+@app.route('/metrics', methods=['GET'])
+def metrics_endpoint():
+    """Endpoint exposing stage latencies and counters in the Prometheus text format."""
+    return Response(metrics.render_prometheus(), content_type=metrics.CONTENT_TYPE)
+
+register_message_routes(app, lambda: messages, lambda: password, sender="Remote Brain")
+register_sync_routes(app, lambda: password)
+
+def run_flask(port=DEFAULT_PORT):
     """Run the Flask app on a separate thread."""
-    app.run(host='0.0.0.0', port=DEFAULT_PORT, debug=False, use_reloader=False)
+    app.run(host='0.0.0.0', port=port, debug=False, use_reloader=False)
+
+def parse_arguments():
+    """Command line options; pass them after `--` when started with `streamlit run`."""
+    parser = argparse.ArgumentParser(description="AI Brain Communication")
+    parser.add_argument('--port', type=int, default=DEFAULT_PORT, help=f'Port to run the Flask server (default: {DEFAULT_PORT})')
+    add_serving_arguments(parser)
+    return parser.parse_args()
 
 # Streamlit UI
-def streamlit_ui():
+def streamlit_ui(port=DEFAULT_PORT):
     """Streamlit UI for interaction with the Flask server."""
     st.title("AI Brain Communication")
 
     # Configurations
     st.sidebar.header("Configuration")
-    port = st.sidebar.number_input("Port", min_value=1, max_value=65535, value=DEFAULT_PORT)
+    port = st.sidebar.number_input("Port", min_value=1, max_value=65535, value=port)
     local_password = st.sidebar.text_input("Password", value=DEFAULT_PASSWORD, type="password")
 
-    # Display current conversation
+    # Display current conversation, fetching only the messages added since the last rerun
     st.header("Conversation")
-    for msg in messages:
-        st.markdown(f"**{msg['sender']}**: {msg['message']}")
+    conversation = follow(messages, st.session_state.setdefault("conversation", []), keep=DISPLAY_LIMIT)
+    feed = st.container()
+    for msg in conversation:
+        feed.markdown(f"**{msg['sender']}**: {msg['message']}")
+    live = st.empty()
 
     # Message sending
     st.header("Send a Message")
-    target_url = st.text_input("Target Brain URL", f"http://localhost:{port}/send_message")
+    # Either the brain's base URL or its old /send_message endpoint URL
+    target_url = st.text_input("Target Brain URL", f"http://localhost:{port}")
     user_message = st.text_area("Your Message")
+    deliveries = st.session_state.setdefault("deliveries", [])
     if st.button("Send"):
         if user_message.strip():
-            # Send message to the target brain
-            import requests
-            payload = {"message": user_message, "token": local_password}
-            try:
-                response = requests.post(target_url, json=payload)
-                if response.status_code == 200:
-                    messages.append({"sender": "You", "message": user_message})
-                    st.success("Message sent successfully!")
-                else:
-                    st.error(f"Failed to send message: {response.json().get('error', 'Unknown error')}")
-            except requests.exceptions.RequestException as e:
-                st.error(f"Error connecting to the target brain: {e}")
+            # Queue the message for the target brain; the pooled client delivers it in the background
+            deliveries.append(get_peer_client(target_url, local_password, MAIN_PATH).send(user_message))
+            del deliveries[:-STATUS_LIMIT]
+            messages.append("You", user_message)
+            st.info("Message queued for delivery.")
         else:
             st.error("Message cannot be empty!")
 
+    # Delivery status of the most recent messages, redrawn below whenever one of them changes
+    status_box = st.empty()
+    def show_statuses():
+        with status_box.container():
+            for delivery in reversed(deliveries):
+                if delivery.status == "delivered":
+                    st.success(f"Delivered: {delivery.message[:40]}")
+                elif delivery.status == "failed":
+                    st.error(f"Failed to send message: {delivery.error}")
+                else:
+                    st.info(f"{delivery.status.capitalize()}: {delivery.message[:40]}")
+        return [delivery.status for delivery in deliveries]
+    shown = show_statuses()
+
+    # Append messages pushed by the server's /events channel until the next rerun
+    last_id = conversation[-1]["id"] if conversation else messages.last_id
+    appended = 0
+    for msg in stream_events(f"http://localhost:{port}", password, last_id, heartbeat=LIVE_HEARTBEAT):
+        if [delivery.status for delivery in deliveries] != shown:
+            shown = show_statuses()  # Queued messages resolve in the background
+        if msg is None:
+            live.caption(f"Live, updated {time.strftime('%H:%M:%S')}")
+            continue
+        feed.markdown(f"**{msg['sender']}**: {msg['message']}")
+        conversation.append(msg)
+        appended += 1
+        if appended >= DISPLAY_LIMIT:
+            st.rerun()  # Re-render the bounded history instead of growing the page forever
+
 if __name__ == '__main__':
-    # Run Flask server in a separate thread
-    flask_thread = threading.Thread(target=run_flask)
-    flask_thread.daemon = True
-    flask_thread.start()
+    args = parse_arguments()
+    if store_path(args):
+        # Production servers and separate UI processes share the conversation through sqlite
+        messages = open_message_log(store_path(args))
+
+    if args.serve != "dev":
+        # Production mode: only the routes, under a multi-worker server in the foreground
+        serve_from_args(app, '0.0.0.0', args.port, args)
+    else:
+        if not args.ui_only:
+            # Run Flask server in a separate thread
+            flask_thread = threading.Thread(target=run_flask, args=(args.port,))
+            flask_thread.daemon = True
+            flask_thread.start()
 
-    # Start Streamlit UI
-    streamlit_ui()
+        # Start Streamlit UI
+        streamlit_ui(args.port)
@@ -0,0 +1,133 @@
+# Topic manifest
+#
+# Deciding whether a topic is weak used to mean opening and json.load-ing its whole
+# knowledge file just to count its entries. The manifest keeps one small record per
+# topic instead, so strength checks and topic listings read a single file:
+#
+#   {"machine learning": {"strength": 7, "counts": {"definitions": 7, ...},
+#                         "updated_at": ..., "fetched_at": ..., "sources": [...],
+#                         "digest": "<sha256 chained over every stored record>"}}
+#
+# The knowledge store updates it on every append. It is rewritten atomically
+# (temp file + rename), at most every FLUSH_INTERVAL seconds and on exit.
+import atexit
+import hashlib
+import json
+import os
+import threading
+import time
+
+MANIFEST_FILE = "manifest.json"
+FLUSH_INTERVAL = 2.0  # Seconds between manifest rewrites while topics are being written
+MAX_SOURCES = 10  # Most recently fetched sources kept per topic
+STRENGTH_FIELDS = ("definitions", "articles")  # What APLS and KTPM count as schema strength
+
+
+# Function to extend a topic digest with newly stored records
+def chain_digest(digest, records):
+    for field, value in records:
+        digest = hashlib.sha256((digest + json.dumps([field, value])).encode("utf-8")).hexdigest()
+    return digest
+
+
+# Function to tell whether a record is for a topic with stored knowledge, not just a search
+def _stored(record):
+    return any(record["counts"].values())
+
+
+def _empty_record():
+    return {"strength": 0, "counts": {}, "updated_at": None, "fetched_at": None, "sources": [], "digest": ""}
+
+
+class TopicManifest:
+    """One compact metadata record per topic, persisted as a single JSON file."""
+
+    def __init__(self, path):
+        self.path = path
+        self.records = {}
+        self.exists = os.path.exists(path)
+        self._lock = threading.RLock()
+        self._dirty = False
+        self._last_flush = 0.0
+        self._timer = None
+        if self.exists:
+            with open(path, "r") as file:
+                self.records = json.load(file)
+        atexit.register(self.flush)
+
+    def __contains__(self, topic):
+        with self._lock:
+            record = self.records.get(topic)
+            return record is not None and _stored(record)
+
+    def get(self, topic):
+        with self._lock:
+            record = self.records.get(topic)
+            return json.loads(json.dumps(record)) if record else None
+
+    def topics(self):
+        with self._lock:
+            return sorted(topic for topic, record in self.records.items() if _stored(record))
+
+    def strength(self, topic):
+        with self._lock:
+            record = self.records.get(topic)
+            return record["strength"] if record else 0
+
+    def strengths(self):
+        with self._lock:
+            return {topic: record["strength"] for topic, record in self.records.items() if _stored(record)}
+
+    def record_append(self, topic, records):
+        """Accounts for (field, value) pairs that were just appended to the store."""
+        with self._lock:
+            record = self.records.setdefault(topic, _empty_record())
+            for field, _ in records:
+                record["counts"][field] = record["counts"].get(field, 0) + 1
+            record["strength"] = sum(record["counts"].get(field, 0) for field in STRENGTH_FIELDS)
+            record["digest"] = chain_digest(record["digest"], records)
+            record["updated_at"] = time.time()
+            self._changed()
+
+    def record_fetch(self, topic, sources):
+        """Remembers the sources a learning pass just fetched for a topic; it isn't listed until it stores something."""
+        with self._lock:
+            record = self.records.setdefault(topic, _empty_record())
+            record["sources"] = list(sources)[-MAX_SOURCES:]
+            record["fetched_at"] = time.time()
+            self._changed()
+
+    def reset(self, topic, counts, digest):
+        """Replaces a topic's counts and digest with values recomputed from the store."""
+        with self._lock:
+            record = self.records.setdefault(topic, _empty_record())
+            record["counts"] = dict(counts)
+            record["strength"] = sum(counts.get(field, 0) for field in STRENGTH_FIELDS)
+            record["digest"] = digest
+            self._changed()
+
+    def _changed(self):
+        self._dirty = True
+        wait = self._last_flush + FLUSH_INTERVAL - time.time()
+        if wait <= 0:
+            self.flush()
+        elif self._timer is None:
+            self._timer = threading.Timer(wait, self.flush)
+            self._timer.daemon = True
+            self._timer.start()
+
+    def flush(self):
+        with self._lock:
+            self._timer = None
+            if not self._dirty:
+                return
+            directory = os.path.dirname(self.path)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+            tmp_path = self.path + ".tmp"
+            with open(tmp_path, "w") as file:
+                json.dump(self.records, file)
+            os.replace(tmp_path, self.path)
+            self.exists = True
+            self._dirty = False
+            self._last_flush = time.time()
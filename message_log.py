@@ -0,0 +1,228 @@
+# Bounded, cursor-paged message log for the brain communication servers
+#
+# main.py and FACE.py used to keep their conversations in plain global lists that
+# grew for as long as the server ran and were re-rendered in full on every
+# Streamlit rerun. MessageLog keeps the most recent `capacity` messages in a ring
+# buffer. Every message gets a monotonically increasing sequence ID, so readers ask
+# for everything after the last ID they saw instead of re-reading the whole list.
+#
+# With a spill file, every message is also appended to disk as a JSON line. Messages
+# that fell out of the ring can still be paged from there, and IDs carry on from the
+# last one on disk after a restart.
+#
+# Servers running several worker processes can't share an in-memory ring, so they
+# use SqliteMessageLog instead: the same interface over a sqlite table in WAL mode,
+# where every worker and the UI process see the same messages and IDs.
+import json
+import os
+import sqlite3
+import threading
+import time
+from collections import deque
+from itertools import islice
+
+MAX_MESSAGES = 1000  # Messages kept in memory
+PAGE_LIMIT = 100  # Default and maximum page size of since()
+POLL_INTERVAL = 0.25  # Seconds between checks of a shared store for new messages
+
+
+class MessageLog:
+    """Thread-safe ring buffer of messages with monotonic sequence IDs."""
+
+    def __init__(self, capacity=MAX_MESSAGES, spill_path=None):
+        self.capacity = capacity
+        self.spill_path = spill_path
+        self.messages = deque(maxlen=capacity)
+        self.last_id = 0
+        self._lock = threading.Lock()
+        self._changed = threading.Condition(self._lock)
+        self._spill = None
+        if spill_path:
+            if os.path.exists(spill_path):
+                self._reload()
+            self._spill = open(spill_path, "a")
+
+    def _reload(self):
+        valid = 0
+        with open(self.spill_path, "rb") as file:
+            for line in file:
+                if not line.endswith(b"\n"):
+                    break  # Torn write from a crash, drop it below
+                try:
+                    entry = json.loads(line)
+                except ValueError:
+                    break
+                self.messages.append(entry)
+                self.last_id = entry["id"]
+                valid += len(line)
+
+        # Appending onto a torn fragment would corrupt the next message too
+        if valid != os.path.getsize(self.spill_path):
+            with open(self.spill_path, "r+b") as file:
+                file.truncate(valid)
+
+    def append(self, sender, message):
+        return self.extend([(sender, message)])[0]
+
+    def extend(self, items):
+        """Appends (sender, message) pairs under one lock and returns their entries."""
+        now = time.time()
+        with self._lock:
+            entries = []
+            for sender, message in items:
+                self.last_id += 1
+                entries.append({"id": self.last_id, "sender": sender, "message": message, "time": now})
+            if self._spill is not None and entries:
+                self._spill.write("".join(json.dumps(entry) + "\n" for entry in entries))
+                self._spill.flush()
+            self.messages.extend(entries)
+            self._changed.notify_all()
+            return entries
+
+    def since(self, since_id=0, limit=PAGE_LIMIT):
+        """Returns up to `limit` messages with an ID greater than `since_id`, oldest first."""
+        limit = max(0, min(limit, PAGE_LIMIT))
+        with self._lock:
+            first_id = self.messages[0]["id"] if self.messages else self.last_id + 1
+            if since_id + 1 >= first_id:
+                start = since_id + 1 - first_id
+                return list(islice(self.messages, start, start + limit))
+        return self._read_spilled(since_id, limit)
+
+    def wait_for(self, since_id, timeout=None):
+        """Blocks until a message newer than `since_id` exists; returns False on timeout."""
+        with self._changed:
+            return self._changed.wait_for(lambda: self.last_id > since_id, timeout)
+
+    def _read_spilled(self, since_id, limit):
+        # Older than the ring: page through the spill file, if there is one
+        if not self.spill_path or not os.path.exists(self.spill_path):
+            with self._lock:
+                return list(islice(self.messages, 0, limit))
+        entries = []
+        with open(self.spill_path, "rb") as file:
+            for line in file:
+                if not line.endswith(b"\n"):
+                    break
+                entry = json.loads(line)
+                if entry["id"] > since_id:
+                    entries.append(entry)
+                    if len(entries) >= limit:
+                        break
+        return entries
+
+    def latest(self, limit=PAGE_LIMIT):
+        """Returns the last `limit` messages, oldest first."""
+        with self._lock:
+            start = max(0, len(self.messages) - limit)
+            return list(islice(self.messages, start, None))
+
+    def __len__(self):
+        with self._lock:
+            return len(self.messages)
+
+    def close(self):
+        with self._lock:
+            if self._spill is not None:
+                self._spill.close()
+                self._spill = None
+
+
+class SqliteMessageLog:
+    """MessageLog interface over a sqlite table shared by several processes."""
+
+    def __init__(self, path, capacity=MAX_MESSAGES):
+        self.path = path
+        self.capacity = capacity
+        self._local = threading.local()
+        self._connection().execute(
+            "CREATE TABLE IF NOT EXISTS messages "
+            "(id INTEGER PRIMARY KEY AUTOINCREMENT, sender TEXT NOT NULL, message TEXT NOT NULL, time REAL NOT NULL)")
+
+    def _connection(self):
+        # One connection per thread, opened again in processes forked after it was made
+        connection = getattr(self._local, "connection", None)
+        if connection is None or self._local.pid != os.getpid():
+            connection = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+            connection.execute("PRAGMA journal_mode=WAL")
+            connection.execute("PRAGMA synchronous=NORMAL")
+            self._local.connection, self._local.pid = connection, os.getpid()
+        return connection
+
+    @property
+    def last_id(self):
+        row = self._connection().execute("SELECT seq FROM sqlite_sequence WHERE name = 'messages'").fetchone()
+        return row[0] if row else 0
+
+    def append(self, sender, message):
+        return self.extend([(sender, message)])[0]
+
+    def extend(self, items):
+        now = time.time()
+        connection = self._connection()
+        entries = []
+        connection.execute("BEGIN IMMEDIATE")
+        try:
+            for sender, message in items:
+                cursor = connection.execute("INSERT INTO messages (sender, message, time) VALUES (?, ?, ?)",
+                                            (sender, message, now))
+                entries.append({"id": cursor.lastrowid, "sender": sender, "message": message, "time": now})
+            if entries:  # Keep the table bounded like the in-memory ring
+                connection.execute("DELETE FROM messages WHERE id <= ?", (entries[-1]["id"] - self.capacity,))
+            connection.execute("COMMIT")
+        except BaseException:
+            connection.execute("ROLLBACK")
+            raise
+        return entries
+
+    def wait_for(self, since_id, timeout=None):
+        """Polls the shared table until a message newer than `since_id` exists; returns False on timeout."""
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while self.last_id <= since_id:
+            if deadline is not None and time.monotonic() >= deadline:
+                return False
+            time.sleep(POLL_INTERVAL)
+        return True
+
+    def _rows(self, query, parameters):
+        return [{"id": id, "sender": sender, "message": message, "time": sent}
+                for id, sender, message, sent in self._connection().execute(query, parameters)]
+
+    def since(self, since_id=0, limit=PAGE_LIMIT):
+        limit = max(0, min(limit, PAGE_LIMIT))
+        return self._rows("SELECT id, sender, message, time FROM messages WHERE id > ? ORDER BY id LIMIT ?",
+                          (since_id, limit))
+
+    def latest(self, limit=PAGE_LIMIT):
+        rows = self._rows("SELECT id, sender, message, time FROM messages ORDER BY id DESC LIMIT ?", (limit,))
+        return rows[::-1]
+
+    def __len__(self):
+        return self._connection().execute("SELECT COUNT(*) FROM messages").fetchone()[0]
+
+    def close(self):
+        connection = getattr(self._local, "connection", None)
+        if connection is not None:
+            connection.close()
+            self._local.connection = None
+
+
+# Function to open the log a server keeps its conversation in: the shared sqlite store
+# when a path is given, otherwise the in-memory ring (optionally spilling to disk)
+def open_message_log(store_path=None, spill_path=None, capacity=MAX_MESSAGES):
+    if store_path:
+        return SqliteMessageLog(store_path, capacity)
+    return MessageLog(capacity, spill_path)
+
+
+# Function to extend a reader's list with the messages it hasn't seen yet, keeping the last `keep`
+def follow(log, seen, keep=MAX_MESSAGES):
+    cursor = seen[-1]["id"] if seen else max(0, log.last_id - keep)
+    while True:
+        page = log.since(cursor)
+        if not page:
+            break
+        seen.extend(page)
+        cursor = page[-1]["id"]
+    del seen[:-keep]
+    return seen
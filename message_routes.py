@@ -0,0 +1,165 @@
+# HTTP routes shared by the brain communication servers (main.py and FACE.py)
+#
+#   GET  /messages?since=&limit=  page through the message log after a sequence ID
+#   POST /messages/batch          {"messages": [...]} ingested with one token check
+#   POST /messages/stream         NDJSON body, one message per line, ingested as the
+#                                 lines arrive; answered with one NDJSON ack per line
+#   GET  /events                  server-sent events: every new message once, as it is
+#                                 logged; reconnects resume after their Last-Event-ID
+#                                 (header, or ?last_event_id= for clients that can't set it)
+#
+# Batch bodies and JSON answers can be msgpack and/or compressed, see wire.py.
+# Messages in a batch or stream are either strings or {"message": <string>} objects.
+# Acks are {"index": <position>, "ok": true, "id": <sequence id>} or
+# {"index": <position>, "ok": false, "error": <reason>}.
+import json
+import time
+
+from flask import Response, jsonify, request
+
+import metrics
+from message_log import PAGE_LIMIT
+from wire import JSON, MSGPACK_ALIASES, request_data, respond
+
+MAX_BATCH = 1000  # Messages accepted in one batch request
+EVENT_STREAM_SECONDS = 300  # An event stream is closed after this long; the client resumes it
+HEARTBEAT_SECONDS = 15  # Keep-alive comment sent on an idle event stream
+RETRY_MILLISECONDS = 1000  # Reconnect delay suggested to event stream clients
+
+
+# Function to find the token of a request: X-Brain-Token header, `token` query parameter or body
+def request_token():
+    token = request.headers.get("X-Brain-Token") or request.args.get("token")
+    # Only whole-document bodies; an NDJSON stream must be left for its route to read
+    if token is None and request.mimetype in (JSON,) + MSGPACK_ALIASES:
+        data = request_data()
+        if isinstance(data, dict):
+            token = data.get("token")
+    return token
+
+
+# Function to pull the text out of one batch or stream item, None when it has none
+def message_text(item):
+    if isinstance(item, dict):
+        item = item.get("message")
+    return item if isinstance(item, str) and item else None
+
+
+# Function to generate the server-sent events of every message after `cursor`
+# Streams end after `duration` seconds so long-lived clients don't pin a server thread forever
+def event_stream(log, cursor, heartbeat=HEARTBEAT_SECONDS, duration=EVENT_STREAM_SECONDS):
+    yield f"retry: {RETRY_MILLISECONDS}\n\n"
+    deadline = time.monotonic() + duration
+    while time.monotonic() < deadline:
+        page = log.since(cursor)
+        if not page:
+            if not log.wait_for(cursor, min(heartbeat, max(0.0, deadline - time.monotonic()))):
+                yield ": keep-alive\n\n"
+            continue
+        for entry in page:
+            yield f"id: {entry['id']}\nevent: message\ndata: {json.dumps(entry)}\n\n"
+        cursor = page[-1]["id"]
+
+
+def register_message_routes(app, get_log, password, sender="Remote Brain"):
+    """
+    Adds the message log routes to a Flask app. `get_log` and `password` are
+    callables returning the message log and the token requests must carry, so apps
+    that pick their store or password at startup are supported. Ingested messages
+    are logged under `sender`.
+    """
+
+    # Function to append the valid items, returning one ack per item in order
+    def ingest(items, first_index=0):
+        acks = []
+        valid = []
+        for index, item in enumerate(items, start=first_index):
+            if isinstance(item, Exception):
+                acks.append({"index": index, "ok": False, "error": "Invalid JSON"})
+                continue
+            text = message_text(item)
+            if text is None:
+                acks.append({"index": index, "ok": False, "error": "Missing message"})
+                continue
+            acks.append({"index": index, "ok": True})
+            valid.append((sender, text))
+
+        entries = iter(get_log().extend(valid))
+        for ack in acks:
+            if ack["ok"]:
+                ack["id"] = next(entries)["id"]
+        metrics.inc("messages_received", len(valid))
+        return acks
+
+    @app.route('/messages/batch', methods=['POST'])
+    @metrics.instrument("receive_batch")
+    def receive_batch():
+        """Ingests an array of messages with a single token check."""
+        if request_token() != password():
+            metrics.inc("messages_rejected")
+            return jsonify({"error": "Unauthorized"}), 401
+
+        data = request_data()
+        items = data.get("messages") if isinstance(data, dict) else data
+        if not isinstance(items, list):
+            return jsonify({"error": "Invalid request format"}), 400
+        if len(items) > MAX_BATCH:
+            return jsonify({"error": f"At most {MAX_BATCH} messages per batch"}), 413
+        return respond({"acks": ingest(items)})
+
+    @app.route('/messages/stream', methods=['POST'])
+    @metrics.instrument("receive_stream")
+    def receive_stream():
+        """Ingests an NDJSON stream of messages as the lines arrive."""
+        if request_token() != password():
+            metrics.inc("messages_rejected")
+            return jsonify({"error": "Unauthorized"}), 401
+
+        # Each line is logged as soon as it is read, so peers see it before the stream ends
+        acks = []
+        for line in request.stream:
+            line = line.strip()
+            if not line:
+                continue
+            try:
+                item = json.loads(line)
+            except ValueError as e:
+                item = e
+            acks.extend(ingest([item], len(acks)))
+
+        body = "".join(json.dumps(ack) + "\n" for ack in acks)
+        return Response(body, content_type="application/x-ndjson")
+
+    @app.route('/events', methods=['GET'])
+    def events():
+        """Pushes each new message once; resumes after Last-Event-ID (or ?last_event_id=)."""
+        if request_token() != password():
+            return jsonify({"error": "Unauthorized"}), 401
+
+        log = get_log()
+        last_event_id = request.headers.get("Last-Event-ID") or request.args.get("last_event_id")
+        # A fresh subscriber starts at the newest message; a reconnect picks up where it left off
+        cursor = int(last_event_id) if last_event_id and last_event_id.isdigit() else log.last_id
+        # Clients that must stay responsive (the Streamlit UIs) can ask for more frequent keep-alives
+        heartbeat = request.args.get("heartbeat", default=HEARTBEAT_SECONDS, type=float)
+        heartbeat = min(max(heartbeat, 1.0), HEARTBEAT_SECONDS)
+        metrics.inc("event_streams")
+        return Response(event_stream(log, cursor, heartbeat), mimetype="text/event-stream",
+                        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
+
+    @app.route('/messages', methods=['GET'])
+    @metrics.instrument("list_messages")
+    def list_messages():
+        """Pages through the message log: ?since=<last seen id>&limit=<page size>."""
+        if request_token() != password():
+            return jsonify({"error": "Unauthorized"}), 401
+
+        since = request.args.get("since", default=0, type=int)
+        limit = request.args.get("limit", default=PAGE_LIMIT, type=int)
+        log = get_log()
+        page = log.since(since, limit)
+        return respond({
+            "messages": page,
+            "next_since": page[-1]["id"] if page else since,
+            "last_id": log.last_id,
+        })
@@ -0,0 +1,178 @@
+# Hot-path instrumentation
+#
+# Counters and latency histograms for the learning pipeline (search resolution, page
+# fetch up to the response headers, page body download, HTML parse, validation,
+# persistence) and the message endpoints. Snapshots are available in-process through
+# snapshot() and as Prometheus text through render_prometheus(), which the Flask
+# apps serve on /metrics. Worker processes hand their values to the parent with
+# drain() and merge().
+#
+# Instrumentation is on by default. Set PYBRAIN_METRICS=0 before starting a process
+# to turn it off: instrument() then hands back the undecorated function and timed()
+# a shared no-op context manager, so the hot paths pay nothing.
+import os
+import threading
+import time
+from functools import wraps
+
+ENABLED = os.getenv("PYBRAIN_METRICS", "1") != "0"
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+# Upper bounds in seconds of the latency histogram buckets
+BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+_lock = threading.Lock()
+_stages = {}  # stage -> {"count", "errors", "sum", "buckets": [...]}
+_counters = {}  # name -> value
+
+
+def _new_stage():
+    return {"count": 0, "errors": 0, "sum": 0.0, "buckets": [0] * len(BUCKETS)}
+
+
+# Function to record one timed run of a stage
+def observe(stage, seconds, error=False):
+    with _lock:
+        entry = _stages.get(stage)
+        if entry is None:
+            entry = _stages[stage] = _new_stage()
+        entry["count"] += 1
+        entry["sum"] += seconds
+        if error:
+            entry["errors"] += 1
+        for i, bound in enumerate(BUCKETS):
+            if seconds <= bound:
+                entry["buckets"][i] += 1
+                break
+
+
+# Function to bump a plain counter
+def inc(name, amount=1):
+    if not ENABLED:
+        return
+    with _lock:
+        _counters[name] = _counters.get(name, 0) + amount
+
+
+class _Timer:
+    __slots__ = ("stage", "started")
+
+    def __init__(self, stage):
+        self.stage = stage
+
+    def __enter__(self):
+        self.started = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        observe(self.stage, time.perf_counter() - self.started, error=exc_type is not None)
+        return False
+
+
+class _NoopTimer:
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        return False
+
+
+_NOOP = _NoopTimer()
+
+
+# Function to time a block: `with timed("page_fetch"): ...`
+def timed(stage):
+    return _Timer(stage) if ENABLED else _NOOP
+
+
+# Decorator to time every call of a function as a stage
+def instrument(stage):
+    def decorator(func):
+        if not ENABLED:
+            return func
+
+        @wraps(func)
+        def wrapper(*args, **kwargs):
+            started = time.perf_counter()
+            try:
+                result = func(*args, **kwargs)
+            except BaseException:
+                observe(stage, time.perf_counter() - started, error=True)
+                raise
+            observe(stage, time.perf_counter() - started)
+            return result
+        return wrapper
+    return decorator
+
+
+def snapshot():
+    """Returns a copy of every stage and counter recorded so far."""
+    with _lock:
+        stages = {}
+        for stage, entry in _stages.items():
+            stages[stage] = {
+                "count": entry["count"],
+                "errors": entry["errors"],
+                "sum_seconds": entry["sum"],
+                "mean_seconds": entry["sum"] / entry["count"] if entry["count"] else 0.0,
+                "buckets": dict(zip(BUCKETS, entry["buckets"])),
+            }
+        return {"enabled": ENABLED, "stages": stages, "counters": dict(_counters)}
+
+
+# Function to take everything recorded so far and start again from zero, e.g. in a worker process
+def drain():
+    with _lock:
+        stages = {stage: dict(entry, buckets=list(entry["buckets"])) for stage, entry in _stages.items()}
+        counters = dict(_counters)
+        _stages.clear()
+        _counters.clear()
+    return stages, counters
+
+
+# Function to add values drained in another process to this process's ones
+def merge(drained):
+    stages, counters = drained
+    with _lock:
+        for stage, other in stages.items():
+            entry = _stages.get(stage)
+            if entry is None:
+                entry = _stages[stage] = _new_stage()
+            entry["count"] += other["count"]
+            entry["errors"] += other["errors"]
+            entry["sum"] += other["sum"]
+            entry["buckets"] = [a + b for a, b in zip(entry["buckets"], other["buckets"])]
+        for name, value in counters.items():
+            _counters[name] = _counters.get(name, 0) + value
+
+
+def reset():
+    with _lock:
+        _stages.clear()
+        _counters.clear()
+
+
+def render_prometheus():
+    """Renders the current values in the Prometheus text exposition format."""
+    with _lock:
+        lines = [
+            "# HELP pybrain_stage_duration_seconds Latency of learning and messaging stages.",
+            "# TYPE pybrain_stage_duration_seconds histogram",
+        ]
+        for stage, entry in sorted(_stages.items()):
+            cumulative = 0
+            for bound, count in zip(BUCKETS, entry["buckets"]):
+                cumulative += count
+                lines.append(f'pybrain_stage_duration_seconds_bucket{{stage="{stage}",le="{bound}"}} {cumulative}')
+            lines.append(f'pybrain_stage_duration_seconds_bucket{{stage="{stage}",le="+Inf"}} {entry["count"]}')
+            lines.append(f'pybrain_stage_duration_seconds_sum{{stage="{stage}"}} {entry["sum"]}')
+            lines.append(f'pybrain_stage_duration_seconds_count{{stage="{stage}"}} {entry["count"]}')
+
+        lines.append("# HELP pybrain_stage_errors_total Stage runs that raised.")
+        lines.append("# TYPE pybrain_stage_errors_total counter")
+        for stage, entry in sorted(_stages.items()):
+            lines.append(f'pybrain_stage_errors_total{{stage="{stage}"}} {entry["errors"]}')
+
+        for name, value in sorted(_counters.items()):
+            lines.append(f"# TYPE pybrain_{name}_total counter")
+            lines.append(f"pybrain_{name}_total {value}")
+        return "\n".join(lines) + "\n"
@@ -0,0 +1,228 @@
+# On-disk HTTP page cache with conditional revalidation
+#
+# Passive learning revisits the same Wikipedia pages over and over. The cache keeps
+# each page's body and extracted text compressed on disk together with its ETag and
+# Last-Modified validators. Revisits send If-None-Match / If-Modified-Since, and a
+# 304 answer is served from the cached text without downloading or parsing again.
+#
+# Layout under `page_cache/`:
+#   <sha256 of url>.body.z   zlib-compressed response body
+#   <sha256 of url>.text.z   zlib-compressed extracted text
+#   journal.jsonl            put/touch/evict records, replayed at startup to rebuild
+#                            the entry table and its LRU order; rewritten to one put per
+#                            entry once it holds more than twice as many records
+import hashlib
+import json
+import os
+import threading
+import zlib
+from collections import OrderedDict
+
+CACHE_DIR = "page_cache"
+MAX_CACHE_BYTES = 256 * 1024 * 1024  # Compressed bytes kept before LRU eviction
+COMPRESSION_LEVEL = 6
+
+
+def _cache_key(url):
+    return hashlib.sha256(url.encode("utf-8")).hexdigest()
+
+
+class PageCache:
+    """Size-bounded LRU cache of page bodies and extracted text, keyed by URL."""
+
+    def __init__(self, root=CACHE_DIR, max_bytes=MAX_CACHE_BYTES):
+        self.root = root
+        self.max_bytes = max_bytes
+        self.journal_path = os.path.join(root, "journal.jsonl")
+        self.entries = OrderedDict()  # key -> {url, etag, last_modified, size}, least recent first
+        self.total_bytes = 0
+        self.counters = {"hits": 0, "misses": 0, "stale": 0, "evictions": 0}
+        self._journal_lines = 0
+        self._lock = threading.RLock()
+        self._load()
+
+    def _paths(self, key):
+        return os.path.join(self.root, f"{key}.body.z"), os.path.join(self.root, f"{key}.text.z")
+
+    def _load(self):
+        os.makedirs(self.root, exist_ok=True)
+        if os.path.exists(self.journal_path):
+            valid = 0
+            with open(self.journal_path, "rb") as journal:
+                for line in journal:
+                    if not line.endswith(b"\n"):
+                        break  # Torn write from a crash, drop it below
+                    try:
+                        record = json.loads(line)
+                    except ValueError:
+                        break
+                    self._apply(record)
+                    self._journal_lines += 1
+                    valid += len(line)
+            if valid != os.path.getsize(self.journal_path):
+                with open(self.journal_path, "r+b") as journal:
+                    journal.truncate(valid)
+
+        # Drop entries whose files went missing, then rewrite a journal that is mostly history
+        for key in [key for key in self.entries if not all(map(os.path.exists, self._paths(key)))]:
+            self._apply({"op": "evict", "key": key})
+        self._maybe_compact()
+
+    def _apply(self, record):
+        key = record["key"]
+        if record["op"] == "put":
+            if key in self.entries:
+                self.total_bytes -= self.entries[key]["size"]
+            self.entries[key] = record["meta"]
+            self.total_bytes += record["meta"]["size"]
+        if key not in self.entries:
+            return
+        if record["op"] == "evict":
+            self.total_bytes -= self.entries.pop(key)["size"]
+        else:
+            self.entries.move_to_end(key)
+
+    def _log(self, record):
+        with open(self.journal_path, "ab") as journal:
+            journal.write((json.dumps(record) + "\n").encode("utf-8"))
+        self._journal_lines += 1
+        self._apply(record)
+        self._maybe_compact()
+
+    def _maybe_compact(self):
+        # Every hit logs a touch, so a long-running process rewrites the journal as it goes
+        if self._journal_lines > 2 * len(self.entries) + 100:
+            self._rewrite_journal()
+
+    def _rewrite_journal(self):
+        tmp_path = self.journal_path + ".tmp"
+        with open(tmp_path, "wb") as journal:
+            for key, meta in self.entries.items():
+                journal.write((json.dumps({"op": "put", "key": key, "meta": meta}) + "\n").encode("utf-8"))
+        os.replace(tmp_path, self.journal_path)
+        self._journal_lines = len(self.entries)
+
+    def _write(self, path, compressed):
+        tmp_path = path + ".tmp"
+        with open(tmp_path, "wb") as file:
+            file.write(compressed)
+        os.replace(tmp_path, path)
+        return len(compressed)
+
+    def conditional_headers(self, url):
+        with self._lock:
+            meta = self.entries.get(_cache_key(url))
+        headers = {}
+        if meta and meta.get("etag"):
+            headers["If-None-Match"] = meta["etag"]
+        if meta and meta.get("last_modified"):
+            headers["If-Modified-Since"] = meta["last_modified"]
+        return headers
+
+    def cached_text(self, url):
+        key = _cache_key(url)
+        with self._lock:
+            if key not in self.entries:
+                return None
+            with open(self._paths(key)[1], "rb") as file:
+                text = zlib.decompress(file.read()).decode("utf-8")
+            self._log({"op": "touch", "key": key})
+            return text
+
+    def cached_body(self, url):
+        key = _cache_key(url)
+        with self._lock:
+            if key not in self.entries:
+                return None
+            with open(self._paths(key)[0], "rb") as file:
+                return zlib.decompress(file.read())
+
+    def put(self, url, headers, compressed_body, text):
+        """
+        Stores a 200 response whose body was already zlib-compressed while streaming.
+        Pages without validators can't be revalidated and are skipped.
+        """
+        etag = headers.get("ETag")
+        last_modified = headers.get("Last-Modified")
+        if not (etag or last_modified):
+            return
+        key = _cache_key(url)
+        body_path, text_path = self._paths(key)
+        compressed_text = zlib.compress(text.encode("utf-8"), COMPRESSION_LEVEL)
+        with self._lock:
+            size = self._write(body_path, compressed_body) + self._write(text_path, compressed_text)
+            meta = {"url": url, "etag": etag, "last_modified": last_modified, "size": size}
+            self._log({"op": "put", "key": key, "meta": meta})
+            self._evict()
+
+    def _evict(self):
+        while self.total_bytes > self.max_bytes and len(self.entries) > 1:
+            key = next(iter(self.entries))
+            self._log({"op": "evict", "key": key})
+            for path in self._paths(key):
+                if os.path.exists(path):
+                    os.remove(path)
+            self.counters["evictions"] += 1
+
+    def revalidate(self, url, fetch):
+        """
+        Performs a conditional GET through `fetch(url, headers)`.
+
+        Returns (cached_text, None) when the server answered 304 Not Modified, and
+        (None, response) when the page has to be read and parsed again.
+        """
+        headers = self.conditional_headers(url)
+        response = fetch(url, headers)
+
+        if response.status_code == 304 and headers:
+            response.close()
+            text = self.cached_text(url)
+            if text is not None:
+                with self._lock:
+                    self.counters["hits"] += 1
+                return text, None
+            response = fetch(url, {})  # Evicted in the meantime, fetch unconditionally
+
+        with self._lock:
+            self.counters["stale" if headers else "misses"] += 1
+        return None, response
+
+    def fetch_text(self, url, fetch, parse):
+        """
+        Returns the extracted text of a page.
+
+        `fetch(url, headers)` performs a streamed GET. `parse(response, sink)` extracts
+        the text, passing every raw chunk it reads to `sink`, and returns
+        (text, complete). Neither runs again when the server answers 304 Not Modified,
+        and pages that were only partially read are not cached.
+        """
+        text, response = self.revalidate(url, fetch)
+        if response is None:
+            return text
+
+        # The body is compressed chunk by chunk while the parser reads it
+        compressor = zlib.compressobj(COMPRESSION_LEVEL)
+        compressed = []
+        text, complete = parse(response, lambda chunk: compressed.append(compressor.compress(chunk)))
+        if complete and response.status_code == 200:
+            compressed.append(compressor.flush())
+            self.put(url, response.headers, b"".join(compressed), text)
+        return text
+
+    def stats(self):
+        with self._lock:
+            requests_seen = sum(self.counters[name] for name in ("hits", "misses", "stale"))
+            return dict(self.counters, entries=len(self.entries), bytes=self.total_bytes,
+                        hit_rate=self.counters["hits"] / requests_seen if requests_seen else 0.0)
+
+
+_caches = {}
+_caches_lock = threading.Lock()
+
+
+# Function to get the page cache shared by every module of this process
+def get_page_cache(root=CACHE_DIR):
+    with _caches_lock:
+        if root not in _caches:
+            _caches[root] = PageCache(root)
+        return _caches[root]
@@ -0,0 +1,315 @@
+# Pooled, queued outbound client for peer messaging
+#
+# FACE.send_message and the Streamlit send path in main.py used to call requests.post
+# for every message: a new TCP connection each time, with the UI blocked until the
+# peer answered. PeerClient keeps one pooled keep-alive session per peer and a send
+# queue. send() returns a Delivery right away, and a sender thread coalesces
+# whatever is queued into batches for the peer's /messages/batch endpoint. Peers
+# that predate it (404) get the messages one by one on their single-message
+# endpoint instead, /send_message for main.py and /receive_message for FACE.py.
+#
+# At most `max_in_flight` batches are on the wire at once. While they are, new
+# messages wait in the queue, so the next batch picks up everything queued meanwhile.
+# Connection errors, timeouts and 429/5xx answers are retried with exponential
+# backoff and full jitter. Every Delivery ends up "delivered" with the sequence ID
+# the peer assigned, or "failed" with an error.
+#
+# stream_events() is the receiving side: it follows a server's /events push channel
+# and yields every message once, reconnecting with Last-Event-ID when the stream ends.
+import json
+import logging
+import queue
+import random
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+from requests.adapters import HTTPAdapter
+
+import metrics
+from wire import PeerEncoding, post
+
+BATCH_PATH = "/messages/batch"
+MAIN_PATH = "/send_message"  # Single-message endpoint of main.py
+FACE_PATH = "/receive_message"  # Single-message endpoint of FACE.py
+EVENTS_PATH = "/events"
+BATCH_SIZE = 100  # Messages coalesced into one request
+MAX_IN_FLIGHT = 4  # Batches sent to a peer at the same time
+MAX_QUEUED = 10000  # Messages waiting to be sent before send() refuses more
+TIMEOUT = 10  # Seconds for connect and for the peer's answer
+MAX_RETRIES = 5  # Attempts after the first one
+BACKOFF_BASE = 0.5  # Seconds, doubled per retry with full jitter
+MAX_BACKOFF = 30.0
+RETRY_STATUSES = {429, 500, 502, 503, 504}
+
+
+# Function to turn a peer address into its base URL, e.g. "http://host:5000/send_message" -> "http://host:5000"
+def peer_base_url(url):
+    url = url.strip().rstrip("/")
+    for path in (BATCH_PATH, MAIN_PATH, FACE_PATH):
+        if url.endswith(path):
+            return url[:-len(path)]
+    return url
+
+
+class Delivery:
+    """Delivery status of one message: queued -> sending -> delivered or failed."""
+
+    def __init__(self, message):
+        self.message = message
+        self.status = "queued"
+        self.id = None  # Sequence ID assigned by the peer
+        self.error = None
+        self.attempts = 0
+        self._done = threading.Event()
+
+    def _finish(self, status, id=None, error=None):
+        self.status, self.id, self.error = status, id, error
+        self._done.set()
+
+    @property
+    def done(self):
+        return self._done.is_set()
+
+    def wait(self, timeout=None):
+        """Blocks until the message is delivered or has failed; returns whether it finished."""
+        return self._done.wait(timeout)
+
+    def __repr__(self):
+        return f"Delivery({self.status!r}, id={self.id!r}, error={self.error!r})"
+
+
+class PeerClient:
+    """Queued sender to a single peer over a pooled keep-alive session."""
+
+    def __init__(self, base_url, password, single_path=None, batch_size=BATCH_SIZE, max_in_flight=MAX_IN_FLIGHT,
+                 max_queued=MAX_QUEUED, timeout=TIMEOUT, max_retries=MAX_RETRIES,
+                 backoff_base=BACKOFF_BASE, max_backoff=MAX_BACKOFF):
+        base_url = peer_base_url(base_url)
+        self.url = base_url + BATCH_PATH
+        self.single_url = base_url + single_path if single_path else None  # Used if the peer has no batch endpoint
+        self.batched = True
+        self.password = password
+        self.batch_size = batch_size
+        self.timeout = timeout
+        self.max_retries = max_retries
+        self.backoff_base = backoff_base
+        self.max_backoff = max_backoff
+
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=max_in_flight)
+        self.session.mount("http://", adapter)
+        self.session.mount("https://", adapter)
+        self.session.headers["X-Brain-Token"] = password
+        self.encoding = PeerEncoding()  # Plain JSON until the peer advertises msgpack/compression
+
+        self.queue = queue.Queue(maxsize=max_queued)
+        self.in_flight = threading.BoundedSemaphore(max_in_flight)
+        self.executor = ThreadPoolExecutor(max_workers=max_in_flight, thread_name_prefix="peer")
+        self._closed = False
+        self._sender = threading.Thread(target=self._run, daemon=True, name="peer-sender")
+        self._sender.start()
+
+    def send(self, message):
+        """Queues a message and returns its Delivery without waiting for the peer."""
+        delivery = Delivery(message)
+        if self._closed:
+            delivery._finish("failed", error="Client is closed")
+            return delivery
+        try:
+            self.queue.put_nowait(delivery)
+        except queue.Full:
+            delivery._finish("failed", error="Send queue is full")
+        return delivery
+
+    def send_many(self, messages):
+        return [self.send(message) for message in messages]
+
+    def pending(self):
+        return self.queue.qsize()
+
+    def _run(self):
+        stopping = False
+        while not stopping:
+            first = self.queue.get()
+            if first is None:
+                break
+            # Wait for an in-flight slot first, so everything queued meanwhile joins this batch
+            self.in_flight.acquire()
+            batch = [first]
+            while len(batch) < self.batch_size:
+                try:
+                    delivery = self.queue.get_nowait()
+                except queue.Empty:
+                    break
+                if delivery is None:
+                    stopping = True
+                    break
+                batch.append(delivery)
+            future = self.executor.submit(self._deliver, batch)
+            future.add_done_callback(lambda _: self.in_flight.release())
+
+    def _backoff(self, attempt, response=None):
+        retry_after = response.headers.get("Retry-After") if response is not None else None
+        if retry_after and retry_after.isdigit():
+            return min(self.max_backoff, float(retry_after))
+        return random.uniform(0, min(self.max_backoff, self.backoff_base * (2 ** attempt)))
+
+    def _post(self, url, payload, deliveries):
+        """Sends a payload, retrying transient failures; returns the answer, or None once `deliveries` failed."""
+        attempt = 0
+        while True:
+            response = None
+            try:
+                with metrics.timed("peer_send"):
+                    response = post(self.session, url, payload, self.encoding, self.timeout)
+                if response.status_code not in RETRY_STATUSES:
+                    return response
+                error = f"HTTP {response.status_code}"
+            except (requests.exceptions.ConnectionError, requests.exceptions.Timeout) as e:
+                error = str(e)
+            except Exception as e:
+                self._fail(deliveries, url, str(e))
+                return None
+
+            attempt += 1
+            for delivery in deliveries:
+                delivery.attempts = attempt
+            if attempt > self.max_retries:
+                self._fail(deliveries, url, error)
+                return None
+            time.sleep(self._backoff(attempt, response))
+
+    def _fail(self, deliveries, url, error):
+        logging.error(f"Sending {len(deliveries)} messages to {url} failed: {error}")
+        metrics.inc("messages_send_failed", len(deliveries))
+        for delivery in deliveries:
+            delivery._finish("failed", error=error)
+
+    def _deliver(self, batch):
+        for delivery in batch:
+            delivery.status = "sending"
+
+        if self.batched:
+            response = self._post(self.url, {"messages": [delivery.message for delivery in batch]}, batch)
+            if response is None:
+                return
+            if response.status_code == 404 and self.single_url:
+                logging.info(f"{self.url} not found, sending to {self.single_url} one message at a time")
+                self.batched = False
+            elif response.status_code == 200 and isinstance(response.data, dict):
+                self._acknowledge(batch, response.data.get("acks", []))
+                return
+            else:
+                self._fail(batch, self.url, f"HTTP {response.status_code}")
+                return
+
+        # Older peers only take one message per request, with the token in the body
+        for delivery in batch:
+            response = self._post(self.single_url, {"message": delivery.message, "token": self.password}, [delivery])
+            if response is None:
+                continue
+            if response.status_code == 200:
+                delivery._finish("delivered")
+                metrics.inc("messages_sent")
+            else:
+                self._fail([delivery], self.single_url, f"HTTP {response.status_code}")
+
+    def _acknowledge(self, batch, acks):
+        delivered = 0
+        for position, delivery in enumerate(batch):
+            ack = acks[position] if position < len(acks) else None
+            if ack is None:
+                delivery._finish("failed", error="No ack from peer")
+            elif ack.get("ok"):
+                delivery._finish("delivered", id=ack.get("id"))
+                delivered += 1
+            else:
+                delivery._finish("failed", error=ack.get("error"))
+        metrics.inc("messages_sent", delivered)
+        if delivered < len(batch):
+            metrics.inc("messages_send_failed", len(batch) - delivered)
+
+    def close(self, wait=True):
+        """Stops accepting messages; with `wait`, sends everything already queued first."""
+        if self._closed:
+            return
+        self._closed = True
+        self.queue.put(None)
+        if wait:
+            self._sender.join()
+            # Messages that raced in after the stop marker are never sent
+            while True:
+                try:
+                    delivery = self.queue.get_nowait()
+                except queue.Empty:
+                    break
+                if delivery is not None:
+                    delivery._finish("failed", error="Client is closed")
+        self.executor.shutdown(wait=wait)
+        self.session.close()
+
+
+_clients = {}
+_clients_lock = threading.Lock()
+
+
+# Function to get the shared client of a peer, e.g. get_peer_client("http://localhost:5001", password, FACE_PATH)
+# `single_path` is the peer's single-message endpoint, used when it has no /messages/batch
+def get_peer_client(base_url, password, single_path=None):
+    key = (peer_base_url(base_url), password, single_path)
+    with _clients_lock:
+        client = _clients.get(key)
+        if client is None:
+            client = _clients[key] = PeerClient(base_url, password, single_path)
+        return client
+
+
+# Function to follow a server's /events channel, yielding each new message entry once
+# Yields None on every keep-alive so callers can do other work while the channel is idle.
+# Reconnects with the last event ID after the server ends a stream or the connection drops.
+def stream_events(base_url, password, last_event_id=None, heartbeat=None, timeout=TIMEOUT):
+    url = base_url.rstrip("/") + EVENTS_PATH
+    params = {"heartbeat": heartbeat} if heartbeat else {}
+    retry = 1.0
+    failures = 0
+    with requests.Session() as session:
+        session.headers["X-Brain-Token"] = password
+        while True:
+            headers = {"Last-Event-ID": str(last_event_id)} if last_event_id is not None else {}
+            try:
+                # The read timeout has to outlast the server's keep-alive interval
+                with session.get(url, params=params, headers=headers, stream=True,
+                                 timeout=(timeout, (heartbeat or 15) + timeout)) as response:
+                    if response.status_code == 401:
+                        raise PermissionError(f"Unauthorized for {url}")
+                    response.raise_for_status()
+                    failures = 0
+                    event = {}
+                    for line in response.iter_lines(chunk_size=None, decode_unicode=True):
+                        if line:
+                            field, _, value = line.partition(":")
+                            value = value[1:] if value.startswith(" ") else value
+                            if field == "":
+                                event["comment"] = True
+                            elif field == "data":
+                                event["data"] = event["data"] + "\n" + value if "data" in event else value
+                            elif field in ("id", "event"):
+                                event[field] = value
+                            elif field == "retry" and value.isdigit():
+                                retry = int(value) / 1000
+                            continue
+                        # A blank line dispatches the event collected so far
+                        if "data" in event:
+                            if "id" in event:
+                                last_event_id = event["id"]
+                            yield json.loads(event["data"])
+                        elif event.get("comment"):
+                            yield None
+                        event = {}
+            except (requests.exceptions.ConnectionError, requests.exceptions.Timeout,
+                    requests.exceptions.HTTPError) as e:
+                failures += 1
+                logging.warning(f"Event stream from {url} interrupted: {e}")
+            time.sleep(min(MAX_BACKOFF, retry * 2 ** min(failures, 5)))
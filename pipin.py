@@ -19,18 +19,29 @@ Features:
    - Continues installing remaining packages even after an error occurs, logging all events for easy troubleshooting.
 
 4. **Missing Library Detection**:
-   - Scans all Python files in the project directory for third-party imports.
-   - Identifies any libraries that are imported but not listed in 'requirements.txt' and appends them.
+   - Parses all Python files in the project directory for third-party imports, including
+     indented and multi-name ones; imports guarded by 'except ImportError' are optional.
+   - Caches the imports of each file in '.pipin_imports.json' by mtime and size, so an
+     unchanged project costs a stat per file; large amounts of changed source are parsed in parallel.
+   - Identifies any libraries that are imported but not listed in 'requirements.txt' and appends
+     them under their distribution name (e.g. 'bs4' as 'beautifulsoup4'), skipping the standard
+     library and the project's own modules.
    
-5. **Customizable**:
+5. **Warm Starts**:
+   - Fingerprints 'requirements.txt' together with the installed distribution versions
+     and saves it in '.pipin_state.json' once everything is satisfied.
+   - Skips pip entirely while the fingerprint is unchanged, and otherwise installs only
+     the packages that are missing or don't match their version specifier.
+
+6. **Customizable**:
    - Users can omit certain libraries from installation by passing a list of libraries to the `install_requirements()` function.
    - The installation process can also be entirely disabled using a flag, allowing flexibility in different environments.
 
-6. **Transparency and Traceability**:
+7. **Transparency and Traceability**:
    - All installation steps are logged, making it easy to trace which packages were installed and which failed.
    - The generated log file provides clear diagnostics for faster issue resolution.
 
-7. **Efficient CI/CD and Team Collaboration**:
+8. **Efficient CI/CD and Team Collaboration**:
    - Ensures that all team members and automated environments (such as CI/CD pipelines) are working with the same set of dependencies, preventing version discrepancies.
    - The logging system makes it easy to audit installations and resolve issues across distributed teams.
 
@@ -108,11 +119,151 @@ ensure_tqdm_installed()
 # from pipin import install_requirements
 import os
 from datetime import datetime
-import shutil
+import hashlib
+import json
+import multiprocessing
+import re
+import sysconfig
 import time
+from concurrent.futures import ProcessPoolExecutor
 from tqdm import tqdm  # Loading bar library
-import pkgutil
+import ast
 import importlib
+import importlib.metadata
+import importlib.util
+
+
+REQUIREMENTS_FILE = 'requirements.txt'
+LOG_FILE = 'install_log.txt'
+STATE_FILE = '.pipin_state.json'  # Fingerprint of the last environment that satisfied the requirements
+
+# Version specifiers are checked with 'packaging' when it is importable (pip vendors a copy)
+try:
+    from packaging.specifiers import InvalidSpecifier, SpecifierSet
+except ImportError:
+    try:
+        from pip._vendor.packaging.specifiers import InvalidSpecifier, SpecifierSet
+    except ImportError:
+        SpecifierSet = InvalidSpecifier = None
+
+_REQUIREMENT = re.compile(r"^([A-Za-z0-9][A-Za-z0-9._-]*)\s*(\[[^\]]*\])?\s*([^;]*)")
+
+
+def parse_requirement(line):
+    """
+    Splits a requirements.txt line into (name, version specifier).
+    Returns None for blank lines, comments and pip options such as '-r' or '-e'.
+    """
+    line = line.split('#', 1)[0].strip()
+    if not line or line.startswith('-'):
+        return None
+    match = _REQUIREMENT.match(line)
+    if not match:
+        return None
+    return match.group(1), match.group(3).strip()
+
+
+def _is_stdlib_name(name):
+    stdlib = getattr(sys, 'stdlib_module_names', ())
+    return name in stdlib or name in sys.builtin_module_names
+
+
+# Function to map import names to the distributions providing them
+# importlib.metadata only has packages_distributions from Python 3.10 on; before that it's empty
+def _packages_distributions():
+    if not hasattr(importlib.metadata, 'packages_distributions'):
+        return {}
+    return importlib.metadata.packages_distributions()
+
+
+def installed_version(name):
+    """
+    Returns the installed version of a distribution, or None if it is missing.
+    Import names listed instead of distribution names (e.g. 'bs4') count as installed
+    when some distribution provides that module.
+    """
+    try:
+        return importlib.metadata.version(name)
+    except importlib.metadata.PackageNotFoundError:
+        pass
+    # Without packages_distributions, fall back to the known import names (e.g. 'bs4')
+    for distribution in _packages_distributions().get(name) or [KNOWN_DISTRIBUTIONS.get(name, name)]:
+        try:
+            return importlib.metadata.version(distribution)
+        except importlib.metadata.PackageNotFoundError:
+            continue
+    return None
+
+
+def is_satisfied(specifier, version):
+    """
+    Checks an installed version against a requirement's specifier.
+    """
+    if version is None:
+        return False
+    if not specifier:
+        return True
+    if SpecifierSet is None:
+        # Without 'packaging' only exact pins can be checked; anything else goes to pip
+        return specifier.startswith('==') and specifier[2:].strip() == version
+    try:
+        return SpecifierSet(specifier).contains(version, prereleases=True)
+    except InvalidSpecifier:
+        return False
+
+
+def read_requirements(omit_libraries=None):
+    """
+    Returns the installable requirement lines of 'requirements.txt' as (line, name, specifier).
+
+    Standard library modules and the project's own modules (e.g. 'pipin') are listed in
+    the file by the import scan, but are not packages pip could install, so they are left out.
+    """
+    with open(REQUIREMENTS_FILE, 'r') as req_file:
+        lines = [line.strip() for line in req_file]
+
+    # Filter out any libraries the user wants to omit
+    if omit_libraries:
+        lines = [line for line in lines if not any(omit in line for omit in omit_libraries)]
+
+    project_dir = os.path.dirname(os.path.abspath(REQUIREMENTS_FILE))
+    requirements = []
+    for line in lines:
+        parsed = parse_requirement(line)
+        if parsed is None:
+            continue
+        name, specifier = parsed
+        if _is_stdlib_name(name) or os.path.exists(os.path.join(project_dir, f"{name}.py")):
+            continue
+        requirements.append((line, name, specifier))
+    return requirements
+
+
+def environment_fingerprint(requirements):
+    """
+    Hashes the requirements together with the interpreter and the installed version of
+    each required distribution. It changes whenever pip could have something to do.
+    """
+    digest = hashlib.sha256()
+    digest.update(f"{sys.executable}\n{sys.version}\n".encode('utf-8'))
+    for line, name, specifier in requirements:
+        digest.update(f"{line}\0{installed_version(name)}\n".encode('utf-8'))
+    return digest.hexdigest()
+
+
+def _load_state():
+    try:
+        with open(STATE_FILE, 'r') as state_file:
+            return json.load(state_file)
+    except (OSError, ValueError):
+        return {}
+
+
+def _save_state(fingerprint):
+    tmp_path = STATE_FILE + '.tmp'
+    with open(tmp_path, 'w') as state_file:
+        json.dump({"fingerprint": fingerprint, "checked_at": time.time()}, state_file)
+    os.replace(tmp_path, STATE_FILE)
 
 
 def install_requirements(omit_libraries=None, disable_installation=False):
@@ -122,12 +273,17 @@ def install_requirements(omit_libraries=None, disable_installation=False):
     - Omits specified libraries if needed.
     - Handles cases where 'pip' is not installed.
     - Optionally disable installation via a function argument.
+
+    Imports of the project's files that 'requirements.txt' lacks are added to it first.
+    When neither the requirements nor the installed versions changed since the last
+    satisfied run, pip is not started at all. Otherwise only the packages that are
+    missing or don't match their version specifier are installed.
     
     Args:
         omit_libraries (list, optional): A list of libraries to omit from installation.
         disable_installation (bool, optional): If set to True, skips the installation process.
     """
-    log_file = 'install_log.txt'
+    log_file = LOG_FILE
 
     # If disable_installation is set to True, skip the entire installation process
     if disable_installation:
@@ -136,64 +292,68 @@ def install_requirements(omit_libraries=None, disable_installation=False):
         print("Installation is disabled. Skipping the installation process.")
         return
 
-    # Check if pip is installed
-    if shutil.which('pip') is None:
-        with open(log_file, 'a') as log:
-            log.write(f"===== Critical Error: 'pip' is missing! at {datetime.now()} =====\n")
-        print("Error: 'pip' is not installed. Please install 'pip' to proceed.")
-        return
+    # Check and add missing libraries to requirements.txt first, so they are installed on this run
+    # Unchanged files aren't read again, so on warm starts this costs a stat per file
+    if os.path.exists(REQUIREMENTS_FILE):
+        add_missing_libraries_to_requirements()
 
     # Read the requirements.txt file
     try:
-        with open('requirements.txt', 'r') as req_file:
-            requirements = req_file.readlines()
+        requirements = read_requirements(omit_libraries)
     except FileNotFoundError:
         with open(log_file, 'a') as log:
             log.write(f"===== Critical Error: 'requirements.txt' not found at {datetime.now()} =====\n")
         print("Error: 'requirements.txt' not found. Ensure the file exists in the project directory.")
         return
 
-    # Filter out any libraries the user wants to omit
-    if omit_libraries:
-        requirements = [req for req in requirements if not any(omit in req for omit in omit_libraries)]
+    # Warm start: the same environment already satisfied these requirements
+    fingerprint = environment_fingerprint(requirements)
+    if _load_state().get("fingerprint") == fingerprint:
+        return
+
+    missing = [line for line, name, specifier in requirements
+               if not is_satisfied(specifier, installed_version(name))]
+    if not missing:
+        _save_state(fingerprint)
+        return
+
+    # Check if pip is installed
+    if importlib.util.find_spec('pip') is None:
+        with open(log_file, 'a') as log:
+            log.write(f"===== Critical Error: 'pip' is missing! at {datetime.now()} =====\n")
+        print("Error: 'pip' is not installed. Please install 'pip' to proceed.")
+        return
 
     with open(log_file, 'a') as log:
         log.write(f"\n\n===== Installation started at {datetime.now()} =====\n")
+        log.write(f"Missing or mismatched: {', '.join(missing)}\n")
 
-    # Install packages with a progress bar
+    # Install only the unsatisfied packages, with a progress bar
     try:
-        # Install the filtered list of requirements
-        if requirements:
-            # Create a temporary requirements file excluding omitted libraries
-            temp_req_file = 'temp_requirements.txt'
-            with open(temp_req_file, 'w') as temp_file:
-                temp_file.writelines(requirements)
-
-            # Loading bar for installation progress
-            with tqdm(total=len(requirements), desc="Installing Packages") as pbar:
-                result = subprocess.run(['pip', 'install', '-r', temp_req_file], capture_output=True, text=True)
-                pbar.update(len(requirements))  # Update the loading bar once installation is complete
-
-            # Log success messages
+        # Loading bar for installation progress
+        with tqdm(total=len(missing), desc="Installing Packages") as pbar:
+            result = subprocess.run([sys.executable, '-m', 'pip', 'install', *missing],
+                                    capture_output=True, text=True)
+            pbar.update(len(missing))  # Update the loading bar once installation is complete
+
+        # Log success messages
+        with open(log_file, 'a') as log:
+            log.write("===== Successful Installation =====\n")
+            log.write(result.stdout)
+
+        # Check for errors
+        if result.returncode != 0:
             with open(log_file, 'a') as log:
-                log.write("===== Successful Installation =====\n")
-                log.write(result.stdout)
-
-            # Check for errors
-            if result.returncode != 0:
-                with open(log_file, 'a') as log:
-                    log.write("===== Installation Errors =====\n")
-                    log.write(result.stderr)
-                print("Failed to install some packages. Check 'install_log.txt' for details.")
-            else:
-                print("All packages installed successfully.")
-
-            # Clean up the temporary requirements file
-            os.remove(temp_req_file)
+                log.write("===== Installation Errors =====\n")
+                log.write(result.stderr)
+            print("Failed to install some packages. Check 'install_log.txt' for details.")
         else:
-            print("No packages to install. All requested libraries were omitted.")
+            print("All packages installed successfully.")
+            # Remember the environment as it is now, with the new versions installed
+            importlib.invalidate_caches()
+            _save_state(environment_fingerprint(requirements))
 
-    except subprocess.CalledProcessError as e:
+    except (subprocess.CalledProcessError, OSError) as e:
         # Log critical errors (if subprocess itself fails)
         with open(log_file, 'a') as log:
             log.write(f"===== Critical Error: {e} =====\n")
@@ -203,52 +363,211 @@ def install_requirements(omit_libraries=None, disable_installation=False):
     with open(log_file, 'a') as log:
         log.write(f"===== Installation ended at {datetime.now()} =====\n")
 
-    # Check and add missing libraries to requirements.txt
-    add_missing_libraries_to_requirements()
-
 
 def is_standard_lib(module_name):
     """
     Checks if a module is part of the Python standard library.
     """
-    return module_name in sys.builtin_module_names or pkgutil.find_loader(module_name) is None
+    if _is_stdlib_name(module_name) or module_name == '__future__':
+        return True
+    if hasattr(sys, 'stdlib_module_names'):
+        return False
+    # Python < 3.10: look where the module would be loaded from
+    try:
+        spec = importlib.util.find_spec(module_name)
+    except (ImportError, ValueError):
+        return False
+    origin = getattr(spec, 'origin', None) or ''
+    stdlib = sysconfig.get_paths()['stdlib']
+    return origin in ('built-in', 'frozen') or (origin.startswith(stdlib) and 'site-packages' not in origin)
+
+
+# Distributions whose name differs from the module they install, for packages that
+# aren't installed yet (installed ones are looked up through importlib.metadata)
+KNOWN_DISTRIBUTIONS = {
+    'bs4': 'beautifulsoup4',
+    'yaml': 'PyYAML',
+    'PIL': 'Pillow',
+    'cv2': 'opencv-python',
+    'sklearn': 'scikit-learn',
+    'skimage': 'scikit-image',
+    'dateutil': 'python-dateutil',
+    'dotenv': 'python-dotenv',
+    'attr': 'attrs',
+    'jwt': 'PyJWT',
+    'serial': 'pyserial',
+    'Crypto': 'pycryptodome',
+    'google': 'protobuf',
+    'magic': 'python-magic',
+    'docx': 'python-docx',
+}
+IMPORT_CACHE_FILE = '.pipin_imports.json'  # Imports found per file, keyed by mtime and size
+PARALLEL_BYTES = 4 * 1024 * 1024  # Changed source scanned in worker processes from this much on (~2 s serially)
+_IMPORT_ERRORS = {'ImportError', 'ModuleNotFoundError', 'Exception', 'BaseException'}
+
+
+def _normalize(name):
+    return re.sub(r'[-_.]+', '-', name).lower()
+
+
+def distribution_name(module_name, distributions=None):
+    """
+    Maps a top-level import name to the distribution that provides it (e.g. 'bs4' to 'beautifulsoup4').
+    """
+    distributions = _packages_distributions() if distributions is None else distributions
+    provided = distributions.get(module_name)
+    if provided:
+        return sorted(provided)[0]
+    return KNOWN_DISTRIBUTIONS.get(module_name, module_name)
+
+
+class _ImportCollector(ast.NodeVisitor):
+    """Collects absolute top-level imports, anywhere in a module, except optional ones."""
+
+    def __init__(self):
+        self.imports = set()
+        self.optional_depth = 0
+
+    def visit_Try(self, node):
+        # Imports guarded by `except ImportError` are optional dependencies
+        guarded = any(
+            handler.type is None
+            or any(isinstance(name, ast.Name) and name.id in _IMPORT_ERRORS
+                   for name in (handler.type.elts if isinstance(handler.type, ast.Tuple) else [handler.type]))
+            for handler in node.handlers
+        )
+        self.optional_depth += guarded
+        for statement in node.body:
+            self.visit(statement)
+        self.optional_depth -= guarded
+        for child in node.handlers + node.orelse + node.finalbody:
+            self.visit(child)
+
+    visit_TryStar = visit_Try
+
+    def visit_Import(self, node):
+        if not self.optional_depth:
+            self.imports.update(alias.name.split('.')[0] for alias in node.names)
+
+    def visit_ImportFrom(self, node):
+        if not self.optional_depth and node.level == 0 and node.module:
+            self.imports.add(node.module.split('.')[0])
+
+
+def scan_imports(path):
+    """
+    Returns the top-level modules a Python file imports, found by parsing it.
+    Relative and optional (ImportError-guarded) imports are left out.
+    """
+    try:
+        with open(path, 'rb') as source:
+            tree = ast.parse(source.read(), filename=path)
+    except (SyntaxError, ValueError, OSError):
+        return []
+    collector = _ImportCollector()
+    collector.visit(tree)
+    return sorted(collector.imports)
 
 
-def add_missing_libraries_to_requirements():
+def _load_import_cache():
+    try:
+        with open(IMPORT_CACHE_FILE, 'r') as cache_file:
+            return json.load(cache_file)
+    except (OSError, ValueError):
+        return {}
+
+
+def _save_import_cache(cache):
+    tmp_path = IMPORT_CACHE_FILE + '.tmp'
+    with open(tmp_path, 'w') as cache_file:
+        json.dump(cache, cache_file)
+    os.replace(tmp_path, IMPORT_CACHE_FILE)
+
+
+def project_imports(directory='.'):
     """
-    Scans all .py files in the current directory for third-party imports and adds any missing libraries to requirements.txt.
+    Returns every module imported by the .py files of a directory.
+    Files whose mtime and size are unchanged since the last scan are not read again.
     """
-    all_imports = set()
-    py_files = [f for f in os.listdir('.') if f.endswith('.py')]
+    cache = _load_import_cache()
+    fresh = {}
+    changed = []
+    changed_bytes = 0
+    for entry in os.scandir(directory):
+        if not (entry.is_file() and entry.name.endswith('.py')):
+            continue
+        stat = entry.stat()
+        cached = cache.get(entry.name)
+        if cached and cached['mtime_ns'] == stat.st_mtime_ns and cached['size'] == stat.st_size:
+            fresh[entry.name] = cached
+        else:
+            fresh[entry.name] = {'mtime_ns': stat.st_mtime_ns, 'size': stat.st_size, 'imports': []}
+            changed.append(entry.name)
+            changed_bytes += stat.st_size
+
+    if changed:
+        paths = [os.path.join(directory, name) for name in changed]
+        # A process pool costs more to start than parsing a project of ordinary size, so it is
+        # only used for a lot of source; never from a worker process, as under spawn workers
+        # re-import the script that calls pipin
+        if changed_bytes >= PARALLEL_BYTES and multiprocessing.parent_process() is None:
+            with ProcessPoolExecutor() as executor:
+                results = list(executor.map(scan_imports, paths, chunksize=4))
+        else:
+            results = [scan_imports(path) for path in paths]
+        for name, imports in zip(changed, results):
+            fresh[name]['imports'] = imports
+
+    if changed or len(fresh) != len(cache):
+        _save_import_cache(fresh)
+    return set().union(*(record['imports'] for record in fresh.values()))
+
+
+def _local_modules(directory='.'):
+    local = set()
+    for entry in os.scandir(directory):
+        if entry.is_file() and entry.name.endswith('.py'):
+            local.add(entry.name[:-3])
+        elif entry.is_dir() and os.path.exists(os.path.join(entry.path, '__init__.py')):
+            local.add(entry.name)
+    return local
 
-    for file in py_files:
-        with open(file, 'r') as f:
-            lines = f.readlines()
 
-        for line in lines:
-            if line.startswith('import ') or line.startswith('from '):
-                parts = line.replace('import', '').replace('from', '').strip().split()
-                if parts:
-                    module = parts[0].split('.')[0]
-                    if not is_standard_lib(module):
-                        all_imports.add(module)
+def add_missing_libraries_to_requirements():
+    """
+    Scans all .py files in the current directory for third-party imports and adds any missing libraries to requirements.txt.
+    Imports are added under their distribution name; standard library and local modules are skipped.
+    """
+    local = _local_modules()
+    modules = [module for module in project_imports()
+               if module not in local and not is_standard_lib(module)]
 
     # Update requirements.txt with missing third-party libraries
     try:
-        with open('requirements.txt', 'r') as req_file:
-            existing_requirements = req_file.readlines()
-            existing_requirements = [r.strip() for r in existing_requirements]
+        with open(REQUIREMENTS_FILE, 'r') as req_file:
+            existing_requirements = [parse_requirement(line) for line in req_file]
     except FileNotFoundError:
         existing_requirements = []
 
-    missing_libs = [lib for lib in all_imports if lib not in existing_requirements]
+    names = [requirement[0] for requirement in existing_requirements if requirement]
+    covered = {_normalize(name) for name in names}
+    modules = [module for module in modules
+               if not {_normalize(module), _normalize(KNOWN_DISTRIBUTIONS.get(module, module))} & covered]
+
+    missing_libs = []
+    if modules:
+        # Only now pay for the metadata lookup of every installed distribution
+        distributions = _packages_distributions()
+        # A listed import name (e.g. 'bs4') covers its distribution too
+        covered.update(_normalize(distribution_name(name, distributions)) for name in names)
+        missing_libs = sorted({distribution_name(module, distributions) for module in modules
+                               if _normalize(distribution_name(module, distributions)) not in covered})
 
     if missing_libs:
-        with open('requirements.txt', 'a') as req_file:
+        with open(REQUIREMENTS_FILE, 'a') as req_file:
             req_file.writelines([lib + '\n' for lib in missing_libs])
         print(f"Added missing libraries to requirements.txt: {missing_libs}")
-    else:
-        print("No new libraries to add to requirements.txt.")
+    return missing_libs
 
 
 # Ensure that the script runs when install_requirements() is called
@@ -0,0 +1,198 @@
+# Priority-driven passive learning scheduler
+#
+# start_passive_learning used to arm a single threading.Timer that walked every topic
+# once, serially. This scheduler keeps every topic in a min-heap ordered by when it
+# is next due and, among due topics, by how weak its schema is. A dispatcher thread
+# hands due topics to a bounded worker pool; topics that fail or yield nothing back
+# off exponentially with jitter. The schedule is saved to disk so a restart picks up
+# where the last run stopped instead of re-assessing every topic at once; it is also
+# saved when the interpreter exits.
+import atexit
+import heapq
+import json
+import logging
+import os
+import random
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+STATE_FILE = "passive_scheduler.json"
+WORKERS = 4  # Topics assessed at the same time
+INTERVAL = 3600  # Seconds between assessments of a healthy topic
+BACKOFF_BASE = 60  # Seconds before retrying a topic after its first failure
+MAX_BACKOFF = 24 * 3600
+JITTER = 0.2  # Delays are spread by +/- this fraction so topics don't fire in lockstep
+SAVE_INTERVAL = 30  # Seconds between state saves while running
+
+
+class PassiveLearningScheduler:
+    """
+    Keeps topics fresh by calling `assess(topic)` whenever they are due.
+
+    `assess` returns True when the topic is healthy (strong, or it learned something)
+    and False when it tried and came back empty; raising counts as a failure. Both of
+    the latter back off. `weakness(topic)` ranks every topic that is due, weakest
+    first, whatever their exact due times; unknown topics are treated as weak as possible.
+    """
+
+    def __init__(self, assess, weakness, state_file=STATE_FILE, workers=WORKERS, interval=INTERVAL,
+                 backoff_base=BACKOFF_BASE, max_backoff=MAX_BACKOFF, jitter=JITTER):
+        self.assess = assess
+        self.weakness = weakness
+        self.state_file = state_file
+        self.workers = workers
+        self.interval = interval
+        self.backoff_base = backoff_base
+        self.max_backoff = max_backoff
+        self.jitter = jitter
+        self.topics = {}  # topic -> {"due", "failures", "weakness"}
+        self.heap = []  # (due, -weakness, sequence, topic); stale entries are skipped on pop
+        self.ready = []  # (-weakness, due, sequence, topic) of topics that are due, weakest first
+        self.running = set()
+        self._sequence = 0
+        self._condition = threading.Condition()
+        self._executor = None
+        self._dispatcher = None
+        self._stopping = False
+        self._dirty = False
+        self._last_save = time.time()
+        self._load()
+
+    def _load(self):
+        if not os.path.exists(self.state_file):
+            return
+        with open(self.state_file, "r") as file:
+            state = json.load(file)
+        with self._condition:
+            for topic, entry in state.items():
+                self._schedule(topic, entry["due"], entry.get("failures", 0), entry.get("weakness"))
+
+    def save(self):
+        with self._condition:
+            state = {topic: dict(entry) for topic, entry in self.topics.items()}
+            self._dirty = False
+            self._last_save = time.time()
+        tmp_path = self.state_file + ".tmp"
+        with open(tmp_path, "w") as file:
+            json.dump(state, file)
+        os.replace(tmp_path, self.state_file)
+
+    def _schedule(self, topic, due, failures=0, weakness=None):
+        self.topics[topic] = {"due": due, "failures": failures, "weakness": weakness}
+        self._sequence += 1
+        priority = -weakness if weakness is not None else float("-inf")
+        heapq.heappush(self.heap, (due, priority, self._sequence, topic))
+        self._dirty = True
+        self._condition.notify_all()
+
+    def add_topics(self, topics, due=None):
+        """Adds topics that aren't scheduled yet; they are due immediately by default."""
+        due = time.time() if due is None else due
+        with self._condition:
+            new = [topic for topic in dict.fromkeys(topics) if topic not in self.topics]
+        ranked = {topic: self._weakness(topic) for topic in new}
+        with self._condition:
+            for topic, weakness in ranked.items():
+                if topic not in self.topics:
+                    self._schedule(topic, due, weakness=weakness)
+
+    def _weakness(self, topic):
+        try:
+            return self.weakness(topic)
+        except Exception:
+            return None
+
+    def set_interval(self, interval):
+        """Changes the interval; healthy topics due later than one new interval from now are pulled in."""
+        with self._condition:
+            if interval == self.interval:
+                return
+            self.interval = interval
+            latest = time.time() + interval
+            for topic, entry in list(self.topics.items()):
+                if not entry["failures"] and entry["due"] > latest and topic not in self.running:
+                    self._schedule(topic, time.time() + self._spread(interval), 0, entry["weakness"])
+
+    def _spread(self, delay):
+        return delay * random.uniform(1 - self.jitter, 1 + self.jitter)
+
+    def _current(self, topic, due):
+        # False for heap entries superseded by a later reschedule of the same topic
+        entry = self.topics.get(topic)
+        return entry is not None and entry["due"] == due and topic not in self.running
+
+    def _pop_due(self, now):
+        # Everything that is due moves to the ready heap, which hands out the weakest topic first
+        while self.heap and self.heap[0][0] <= now:
+            due, priority, sequence, topic = heapq.heappop(self.heap)
+            if self._current(topic, due):
+                heapq.heappush(self.ready, (priority, due, sequence, topic))
+        while self.ready:
+            _, due, _, topic = heapq.heappop(self.ready)
+            if self._current(topic, due):
+                return topic
+        return None
+
+    def _dispatch(self):
+        with self._condition:
+            while not self._stopping:
+                now = time.time()
+                if self._dirty and now - self._last_save >= SAVE_INTERVAL:
+                    self._condition.release()
+                    try:
+                        self.save()
+                    finally:
+                        self._condition.acquire()
+
+                topic = self._pop_due(now) if len(self.running) < self.workers else None
+                if topic is not None:
+                    self.running.add(topic)
+                    self._executor.submit(self._run, topic)
+                    continue
+
+                # Sleep until the next topic is due, a worker frees up or a topic is added
+                timeout = SAVE_INTERVAL
+                if self.heap and len(self.running) < self.workers:
+                    timeout = min(timeout, max(0.0, self.heap[0][0] - now))
+                self._condition.wait(timeout)
+
+    def _run(self, topic):
+        try:
+            healthy = self.assess(topic)
+        except Exception as e:
+            logging.error(f"Passive learning for '{topic}' failed: {e}")
+            healthy = False
+
+        weakness = self._weakness(topic)
+
+        with self._condition:
+            self.running.discard(topic)
+            failures = 0 if healthy else self.topics[topic]["failures"] + 1
+            if failures:
+                delay = min(self.max_backoff, self.backoff_base * 2 ** (failures - 1))
+            else:
+                delay = self.interval
+            self._schedule(topic, time.time() + self._spread(delay), failures, weakness)
+
+    def start(self):
+        with self._condition:
+            if self._dispatcher is not None:
+                return
+            self._stopping = False
+            self._executor = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix="passive")
+            self._dispatcher = threading.Thread(target=self._dispatch, name="passive-dispatcher", daemon=True)
+            self._dispatcher.start()
+        atexit.register(self.stop, False)  # Keep the schedule of a process that never calls stop()
+
+    def stop(self, wait=True):
+        with self._condition:
+            if self._dispatcher is None:
+                return
+            self._stopping = True
+            self._condition.notify_all()
+        atexit.unregister(self.stop)
+        self._dispatcher.join()
+        self._executor.shutdown(wait=wait)
+        self._dispatcher = None
+        self.save()
@@ -0,0 +1,132 @@
+# Topic -> Wikipedia URL resolution cache
+#
+# Every learning cycle used to run a fresh search and parse the result page, even for
+# a topic resolved minutes earlier. Resolutions are now kept for SEARCH_TTL seconds:
+# a bounded in-memory LRU answers repeat lookups, and a sqlite table behind it keeps
+# them across restarts. A search that found nothing is cached too (negative caching),
+# for the shorter NEGATIVE_TTL so a topic gets another try soon. Failed searches are
+# never cached.
+#
+# Concurrent lookups of the same key share a single search: the first caller runs
+# it and the others wait for its result.
+import json
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import Future
+
+import metrics
+
+CACHE_FILE = "search_cache.db"
+SEARCH_TTL = 24 * 3600  # Seconds a resolution with links stays fresh
+NEGATIVE_TTL = 3600  # Seconds a resolution without links stays fresh
+MEMORY_ENTRIES = 1024  # Resolutions kept in memory in front of the sqlite table
+
+
+class SearchCache:
+    """LRU in front of a sqlite table of search resolutions, with in-flight dedupe."""
+
+    def __init__(self, path=CACHE_FILE, ttl=SEARCH_TTL, negative_ttl=NEGATIVE_TTL,
+                 memory_entries=MEMORY_ENTRIES):
+        self.ttl = ttl
+        self.negative_ttl = negative_ttl
+        self.memory_entries = memory_entries
+        self.memory = OrderedDict()  # key -> (links, expires_at), least recent first
+        self._inflight = {}  # key -> Future of the search running for it
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(path, check_same_thread=False)
+        with self._db:
+            self._db.execute("CREATE TABLE IF NOT EXISTS resolutions "
+                             "(key TEXT PRIMARY KEY, links TEXT NOT NULL, expires_at REAL NOT NULL)")
+
+    def _remember(self, key, links, expires_at):
+        self.memory[key] = (links, expires_at)
+        self.memory.move_to_end(key)
+        while len(self.memory) > self.memory_entries:
+            self.memory.popitem(last=False)
+
+    def get(self, key):
+        """Returns the cached links for a key ([] for a negative entry), or None on a miss."""
+        now = time.time()
+        with self._lock:
+            entry = self.memory.get(key)
+            if entry is None:
+                row = self._db.execute("SELECT links, expires_at FROM resolutions WHERE key = ?",
+                                       (key,)).fetchone()
+                if row is not None:
+                    entry = (json.loads(row[0]), row[1])
+                    self._remember(key, *entry)
+            else:
+                self.memory.move_to_end(key)
+
+            if entry is None or entry[1] <= now:
+                metrics.inc("search_cache_misses")
+                return None
+            metrics.inc("search_cache_hits")
+            return list(entry[0])
+
+    def put(self, key, links):
+        expires_at = time.time() + (self.ttl if links else self.negative_ttl)
+        with self._lock:
+            self._remember(key, list(links), expires_at)
+            with self._db:
+                self._db.execute("INSERT OR REPLACE INTO resolutions (key, links, expires_at) VALUES (?, ?, ?)",
+                                 (key, json.dumps(list(links)), expires_at))
+
+    def resolve(self, key, search):
+        """
+        Returns the links for a key, calling `search()` only when no fresh entry is
+        cached. Callers asking for a key whose search is already running wait for it.
+        """
+        links = self.get(key)
+        if links is not None:
+            return links
+
+        with self._lock:
+            future = self._inflight.get(key)
+            owner = future is None
+            if owner:
+                future = self._inflight[key] = Future()
+        if not owner:
+            return list(future.result())
+
+        try:
+            links = search()
+            self.put(key, links)
+            future.set_result(links)
+        except BaseException as e:
+            future.set_exception(e)
+            raise
+        finally:
+            with self._lock:
+                del self._inflight[key]
+        return list(links)
+
+    def invalidate(self, key):
+        with self._lock:
+            self.memory.pop(key, None)
+            with self._db:
+                self._db.execute("DELETE FROM resolutions WHERE key = ?", (key,))
+
+    def purge_expired(self):
+        """Deletes expired resolutions from the sqlite table."""
+        now = time.time()
+        with self._lock:
+            for key in [key for key, (_, expires_at) in self.memory.items() if expires_at <= now]:
+                del self.memory[key]
+            with self._db:
+                return self._db.execute("DELETE FROM resolutions WHERE expires_at <= ?", (now,)).rowcount
+
+
+_cache = None
+_cache_lock = threading.Lock()
+
+
+# Function to get the search cache shared by every module of this process
+def get_search_cache():
+    global _cache
+    with _cache_lock:
+        if _cache is None:
+            _cache = SearchCache()
+        return _cache
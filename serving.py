@@ -0,0 +1,129 @@
+# Serving modes for the Flask message servers (main.py and FACE.py)
+#
+#   dev       Flask's development server on a background thread next to the
+#             Streamlit UI, as before
+#   waitress  waitress in the foreground: one process, `threads` request threads
+#   gunicorn  gunicorn in the foreground: `workers` processes with `threads` threads
+#             each (gthread workers)
+#
+# The production modes run the routes without the UI. They keep idle connections
+# open for `keepalive` seconds, and on SIGTERM/SIGINT they stop accepting
+# connections and give in-flight requests up to `graceful_timeout` seconds to
+# finish. Every worker has to see the same conversation, so these modes keep
+# messages in the shared sqlite store (--store). Run the UI as its own process
+# against that store with --ui-only. The number of server processes is put in the
+# app's config under PROCESSES_CONFIG, for routes that need a single process.
+import logging
+import os
+import signal
+import threading
+
+SERVING_MODES = ("dev", "waitress", "gunicorn")
+DEFAULT_WORKERS = (os.cpu_count() or 1) * 2 + 1
+DEFAULT_THREADS = 8
+DEFAULT_KEEPALIVE = 5  # Seconds an idle keep-alive connection stays open
+DEFAULT_GRACEFUL_TIMEOUT = 30  # Seconds in-flight requests get to finish on shutdown
+DEFAULT_STORE = "messages.db"
+PROCESSES_CONFIG = "SERVING_PROCESSES"  # App config key holding the number of server processes
+
+
+# Function to add the serving options to a script's argument parser
+def add_serving_arguments(parser):
+    group = parser.add_argument_group("serving")
+    group.add_argument('--serve', choices=SERVING_MODES, default="dev",
+                       help='Server to run the message routes on (default: dev)')
+    group.add_argument('--host', type=str, default=None,
+                       help='Interface to bind (default: the script\'s usual one)')
+    group.add_argument('--workers', type=int, default=DEFAULT_WORKERS,
+                       help=f'Worker processes in gunicorn mode (default: {DEFAULT_WORKERS})')
+    group.add_argument('--threads', type=int, default=DEFAULT_THREADS,
+                       help=f'Request threads per worker (default: {DEFAULT_THREADS})')
+    group.add_argument('--keepalive', type=int, default=DEFAULT_KEEPALIVE,
+                       help=f'Seconds to keep idle connections open (default: {DEFAULT_KEEPALIVE})')
+    group.add_argument('--graceful-timeout', type=int, default=DEFAULT_GRACEFUL_TIMEOUT,
+                       help=f'Seconds in-flight requests get on shutdown (default: {DEFAULT_GRACEFUL_TIMEOUT})')
+    group.add_argument('--store', type=str, default=os.getenv("BRAIN_COMM_STORE"),
+                       help=f'Shared sqlite message store; production modes default to {DEFAULT_STORE}')
+    group.add_argument('--ui-only', action='store_true',
+                       help='Only run the Streamlit UI, against the shared --store of a production server')
+    return parser
+
+
+# Function to decide which message store a run uses, None for the in-process ring
+def store_path(args):
+    if args.store:
+        return args.store
+    return DEFAULT_STORE if args.serve != "dev" or args.ui_only else None
+
+
+def _serve_dev(app, host, port, threads, keepalive, graceful_timeout, workers):
+    app.run(host=host, port=port, debug=False, use_reloader=False, threaded=True)
+
+
+def _serve_waitress(app, host, port, threads, keepalive, graceful_timeout, workers):
+    try:
+        from waitress import create_server
+    except ImportError:
+        raise SystemExit("The waitress serving mode needs the waitress package: pip install waitress")
+    if workers > 1:
+        logging.info("waitress runs a single process; use --threads to scale it")
+
+    server = create_server(app, host=host, port=port, threads=threads, channel_timeout=keepalive)
+    stopping = threading.Event()
+
+    def shutdown(signum, frame):
+        if not stopping.is_set():
+            stopping.set()
+            raise KeyboardInterrupt
+
+    signal.signal(signal.SIGTERM, shutdown)
+    signal.signal(signal.SIGINT, shutdown)
+    try:
+        server.run()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        # Stop accepting, then let the request threads finish what they have
+        server.close()
+        server.task_dispatcher.shutdown(timeout=graceful_timeout)
+
+
+def _serve_gunicorn(app, host, port, threads, keepalive, graceful_timeout, workers):
+    try:
+        from gunicorn.app.base import BaseApplication
+    except ImportError:
+        raise SystemExit("The gunicorn serving mode needs the gunicorn package: pip install gunicorn")
+
+    class Application(BaseApplication):
+        def load_config(self):
+            # gunicorn drains its workers for graceful_timeout seconds on SIGTERM by itself
+            for key, value in {
+                "bind": f"{host}:{port}",
+                "workers": workers,
+                "threads": threads,
+                "worker_class": "gthread",
+                "keepalive": keepalive,
+                "graceful_timeout": graceful_timeout,
+            }.items():
+                self.cfg.set(key, value)
+
+        def load(self):
+            return app
+
+    Application().run()
+
+
+_SERVERS = {"dev": _serve_dev, "waitress": _serve_waitress, "gunicorn": _serve_gunicorn}
+
+
+def serve(app, host, port, mode="dev", workers=DEFAULT_WORKERS, threads=DEFAULT_THREADS,
+          keepalive=DEFAULT_KEEPALIVE, graceful_timeout=DEFAULT_GRACEFUL_TIMEOUT):
+    """Runs a Flask app in the given serving mode; blocks until the server stops."""
+    app.config[PROCESSES_CONFIG] = workers if mode == "gunicorn" else 1
+    _SERVERS[mode](app, host, port, threads, keepalive, graceful_timeout, workers)
+
+
+# Function to serve with the options parsed by add_serving_arguments; `host` is used unless --host was given
+def serve_from_args(app, host, port, args):
+    serve(app, args.host or host, port, args.serve, args.workers, args.threads, args.keepalive,
+          args.graceful_timeout)
@@ -0,0 +1,117 @@
+# Per-source paragraph fingerprints for delta ingestion
+#
+# Passive learning keeps revisiting the same pages. Without fingerprints, every
+# revisit stored the whole article again (KTPM) or re-appended the same first
+# sentence as a new definition (APLS). Each topic now remembers, for every source
+# URL it learned from, a hash of the page text and a hash of each paragraph:
+#
+#   knowledge_store/<topic>/sources.jsonl   {"url", "page", "paragraphs"} records,
+#                                           the last record of a URL wins
+#
+# On a revisit an unchanged page costs one hash comparison. A changed page only
+# hands back the paragraphs whose hashes weren't seen on the previous visit.
+import hashlib
+import json
+import os
+import threading
+
+from knowledge_store import get_store
+
+FINGERPRINT_FILE = "sources.jsonl"
+
+
+# Function to split extracted page text into its paragraphs (html_stream joins them with newlines)
+def split_paragraphs(text):
+    return [paragraph.strip() for paragraph in text.split("\n") if paragraph.strip()]
+
+
+def _hash(text):
+    return hashlib.blake2b(text.encode("utf-8"), digest_size=8).hexdigest()
+
+
+class SourceFingerprints:
+    """Page and paragraph hashes of every source a topic has learned from."""
+
+    def __init__(self, topic, store=None):
+        self.topic = topic
+        self.store = store or get_store()
+        self.path = os.path.join(self.store.topic_dir(topic), FINGERPRINT_FILE)
+        self.sources = {}  # url -> {"page": hash, "paragraphs": [hash, ...]}
+        self._lines = 0
+        self._lock = threading.Lock()
+        self._load()
+
+    def _load(self):
+        if not os.path.exists(self.path):
+            return
+        valid = 0
+        with open(self.path, "rb") as file:
+            for line in file:
+                if not line.endswith(b"\n"):
+                    break  # Torn write, that source is simply processed in full again
+                try:
+                    record = json.loads(line)
+                except ValueError:
+                    break
+                self.sources[record["url"]] = {"page": record["page"], "paragraphs": record["paragraphs"]}
+                self._lines += 1
+                valid += len(line)
+        # Cut the fragment off so the next record() starts on a line of its own
+        if valid != os.path.getsize(self.path):
+            with open(self.path, "r+b") as file:
+                file.truncate(valid)
+        if self._lines > 2 * len(self.sources) + 100:
+            self._rewrite()
+
+    def _rewrite(self):
+        temp_path = self.path + ".tmp"
+        with open(temp_path, "w") as file:
+            for url, fingerprint in self.sources.items():
+                file.write(json.dumps({"url": url, **fingerprint}) + "\n")
+        os.replace(temp_path, self.path)
+        self._lines = len(self.sources)
+
+    def delta(self, url, text):
+        """
+        Returns (paragraphs, fingerprint): the paragraphs of `text` that are new since
+        the last recorded visit of `url`, and the fingerprint to record() once they are
+        stored. An unchanged page returns ([], None).
+        """
+        page = _hash(text)
+        with self._lock:
+            previous = self.sources.get(url)
+        if previous is not None and previous["page"] == page:
+            return [], None
+
+        paragraphs = split_paragraphs(text)
+        hashes = [_hash(paragraph) for paragraph in paragraphs]
+        seen = set(previous["paragraphs"]) if previous is not None else set()
+        changed = [paragraph for paragraph, digest in zip(paragraphs, hashes) if digest not in seen]
+        return changed, {"page": page, "paragraphs": hashes}
+
+    def record(self, url, fingerprint):
+        if fingerprint is None:
+            return
+        with self._lock:
+            self.sources[url] = fingerprint
+            os.makedirs(os.path.dirname(self.path), exist_ok=True)
+            with open(self.path, "a") as file:
+                file.write(json.dumps({"url": url, **fingerprint}) + "\n")
+            self._lines += 1
+
+    def __contains__(self, url):
+        return url in self.sources
+
+
+_fingerprints = {}
+_fingerprints_lock = threading.Lock()
+
+
+# Function to get the shared source fingerprints of a topic
+def get_source_fingerprints(topic, store=None):
+    store = store or get_store()
+    key = (store.root, topic)
+    with _fingerprints_lock:
+        if key not in _fingerprints:
+            _fingerprints[key] = SourceFingerprints(topic, store)
+        return _fingerprints[key]
@@ -0,0 +1,168 @@
+# Inverted full-text index with BM25 ranking
+#
+# answer_question used to reload a topic's knowledge and scan every definition for
+# the question as a substring. This index tokenizes definitions, examples and use
+# cases once, when they are stored, and answers questions from in-memory postings.
+#
+# Two append-only files live under `text_index/`:
+#   docs.jsonl      one JSON string per document, the text returned as an answer
+#   postings.jsonl  one record per document: topic, field, store position, the
+#                   offset/length of its text in docs.jsonl and its term counts
+# Postings are rebuilt in memory from postings.jsonl at startup; document texts are
+# only read back for the hits that are returned.
+import json
+import math
+import os
+import re
+import threading
+
+from knowledge_store import get_store
+
+INDEX_DIR = "text_index"
+INDEXED_FIELDS = ("definitions", "examples", "use_cases")
+BM25_K1 = 1.5
+BM25_B = 0.75
+
+_TOKEN_RE = re.compile(r"\w+")
+STOPWORDS = frozenset(
+    "a an and are as at be by does for from how in is it of on or that the this to was "
+    "what when where which who why with".split()
+)
+
+
+# Function to turn text into lowercase index terms
+def tokenize(text):
+    return [token for token in _TOKEN_RE.findall(text.lower()) if token not in STOPWORDS]
+
+
+class TextIndex:
+    """BM25 index over the schema fields of every topic in the knowledge store."""
+
+    def __init__(self, root=INDEX_DIR, store=None):
+        self.root = root
+        self.store = store or get_store()
+        self.docs_path = os.path.join(root, "docs.jsonl")
+        self.postings_path = os.path.join(root, "postings.jsonl")
+        self.postings = {}  # term -> [(doc_id, term_frequency)]
+        self.doc_meta = []  # doc_id -> (topic, field, text_offset, text_length, length)
+        self.indexed = {}  # (topic, field) -> number of store entries already indexed
+        self.total_length = 0
+        self._lock = threading.RLock()
+        self._load()
+
+    def _load(self):
+        os.makedirs(self.root, exist_ok=True)
+        if not os.path.exists(self.postings_path):
+            return
+        valid = 0
+        with open(self.postings_path, "rb") as file:
+            for line in file:
+                if not line.endswith(b"\n"):
+                    break  # Torn write, the catch-up pass re-indexes the entry
+                try:
+                    record = json.loads(line)
+                except ValueError:
+                    break
+                self._insert(record)
+                valid += len(line)
+
+        # Cut the fragment off, or the next append would be joined onto it
+        if valid != os.path.getsize(self.postings_path):
+            with open(self.postings_path, "r+b") as file:
+                file.truncate(valid)
+        # Texts written before a crash stopped their postings line are unreferenced
+        end = max((offset + length for _, _, offset, length, _ in self.doc_meta), default=0)
+        if os.path.exists(self.docs_path) and os.path.getsize(self.docs_path) > end:
+            with open(self.docs_path, "r+b") as file:
+                file.truncate(end)
+
+    def _insert(self, record):
+        doc_id = len(self.doc_meta)
+        terms = record["tf"]
+        length = sum(terms.values())
+        self.doc_meta.append((record["topic"], record["field"], record["o"], record["l"], length))
+        self.total_length += length
+        for term, frequency in terms.items():
+            self.postings.setdefault(term, []).append((doc_id, frequency))
+        key = (record["topic"], record["field"])
+        self.indexed[key] = max(self.indexed.get(key, 0), record["pos"] + 1)
+
+    def _index_entries(self, topic, entries):
+        # Entries must be the store values that follow the ones already indexed
+        with self._lock:
+            records = []
+            with open(self.docs_path, "ab") as docs:
+                for field, text in entries:
+                    if field not in INDEXED_FIELDS:
+                        continue
+                    encoded = (json.dumps(text) + "\n").encode("utf-8")
+                    offset = docs.tell()
+                    docs.write(encoded)
+                    terms = {}
+                    for token in tokenize(text):
+                        terms[token] = terms.get(token, 0) + 1
+                    position = self.indexed.get((topic, field), 0)
+                    self.indexed[(topic, field)] = position + 1
+                    records.append({"topic": topic, "field": field, "pos": position,
+                                    "o": offset, "l": len(encoded), "tf": terms})
+            if not records:
+                return
+            with open(self.postings_path, "ab") as postings:
+                postings.write("".join(json.dumps(record) + "\n" for record in records).encode("utf-8"))
+            for record in records:
+                self._insert(record)
+
+    def catch_up(self, topic):
+        """Indexes store entries of a topic that were written without the index."""
+        with self._lock:
+            for field in INDEXED_FIELDS:
+                start = self.indexed.get((topic, field), 0)
+                if self.store.count(topic, field) > start:
+                    values = self.store.read(topic, field, start=start)
+                    self._index_entries(topic, [(field, value) for value in values])
+
+    def _read_text(self, docs, doc_id):
+        _, _, offset, length, _ = self.doc_meta[doc_id]
+        docs.seek(offset)
+        return json.loads(docs.read(length))
+
+    def search(self, query, top_k=5, topic=None):
+        """Returns up to top_k dicts with score, topic, field and text, best first."""
+        with self._lock:
+            count = len(self.doc_meta)
+            if not count:
+                return []
+            average_length = self.total_length / count or 1.0
+            scores = {}
+            for term in set(tokenize(query)):
+                postings = self.postings.get(term)
+                if not postings:
+                    continue
+                idf = math.log(1 + (count - len(postings) + 0.5) / (len(postings) + 0.5))
+                for doc_id, frequency in postings:
+                    meta = self.doc_meta[doc_id]
+                    if topic is not None and meta[0] != topic:
+                        continue
+                    norm = BM25_K1 * (1 - BM25_B + BM25_B * meta[4] / average_length)
+                    scores[doc_id] = scores.get(doc_id, 0.0) + idf * frequency * (BM25_K1 + 1) / (frequency + norm)
+
+            best = sorted(scores.items(), key=lambda item: item[1], reverse=True)[:top_k]
+            results = []
+            with open(self.docs_path, "rb") as docs:
+                for doc_id, score in best:
+                    meta = self.doc_meta[doc_id]
+                    results.append({"score": score, "topic": meta[0], "field": meta[1],
+                                    "text": self._read_text(docs, doc_id)})
+            return results
+
+
+_indexes = {}
+_indexes_lock = threading.Lock()
+
+
+# Function to get the text index shared by every module of this process
+def get_text_index(root=INDEX_DIR):
+    with _indexes_lock:
+        if root not in _indexes:
+            _indexes[root] = TextIndex(root)
+        return _indexes[root]
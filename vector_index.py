@@ -0,0 +1,193 @@
+# Vectorized batch question answering
+#
+# The chat front-end sends bursts of questions about one topic. Ranking them one by
+# one walks the BM25 postings once per question; this index instead keeps each
+# topic's definitions, examples and use cases as sparse hashed term-frequency rows
+# and scores a whole batch of questions against them with NumPy array operations.
+#
+# Terms are hashed into FEATURES columns (the hashing trick), so no vocabulary has
+# to be kept or grown. Rows are stored in CSR form (column indices and sublinear
+# term frequencies of their non-zero entries only), so memory grows with the text
+# rather than with rows x FEATURES. Document frequencies are kept next to them and
+# IDF is applied at query time, so entries appended to the store are added as new
+# rows without reweighting the existing ones.
+import math
+import threading
+import zlib
+from collections import OrderedDict
+
+import numpy as np
+
+from knowledge_store import get_store
+from text_index import INDEXED_FIELDS, tokenize
+
+FEATURES = 2 ** 13  # Hashed term columns per topic
+MAX_TOPICS = 64  # Topic matrices kept in memory, least recently used are dropped
+PRODUCT_CELLS = 1 << 22  # Questions x non-zero entries computed per step of a batched search
+
+
+# Function to map text to {column: sublinear term frequency}
+def hashed_terms(text):
+    counts = {}
+    for token in tokenize(text):
+        column = zlib.crc32(token.encode("utf-8")) % FEATURES
+        counts[column] = counts.get(column, 0) + 1
+    return {column: 1.0 + math.log(count) for column, count in counts.items()}
+
+
+def _vectors(texts):
+    matrix = np.zeros((len(texts), FEATURES), dtype=np.float32)
+    for row, text in enumerate(texts):
+        for column, weight in hashed_terms(text).items():
+            matrix[row, column] = weight
+    return matrix
+
+
+# Function to copy an array into a larger one, at least doubling it so appends stay amortized O(1)
+def _grow(array, needed):
+    if needed <= len(array):
+        return array
+    grown = np.zeros(max(needed, 2 * len(array)), dtype=array.dtype)
+    grown[:len(array)] = array
+    return grown
+
+
+class TopicMatrix:
+    """Sparse hashed term-frequency rows of one topic plus the documents they came from."""
+
+    def __init__(self):
+        self.rows = 0
+        self.nnz = 0  # Non-zero entries over all rows
+        self.columns = np.zeros(256, dtype=np.int32)  # CSR column index of every non-zero entry
+        self.tf = np.zeros(256, dtype=np.float32)  # CSR value of every non-zero entry
+        self.indptr = np.zeros(17, dtype=np.int64)  # CSR row pointers: row i is entries indptr[i]:indptr[i + 1]
+        self.df = np.zeros(FEATURES, dtype=np.float32)
+        self.docs = []  # row -> (field, text)
+        self.indexed = {}  # field -> number of store entries already added
+        self._weighted = None  # (idf, TF-IDF weight and norm of every row), rebuilt after appends
+
+    def add(self, field, texts):
+        for text in texts:
+            terms = hashed_terms(text)
+            needed = self.nnz + len(terms)
+            self.columns = _grow(self.columns, needed)
+            self.tf = _grow(self.tf, needed)
+            self.indptr = _grow(self.indptr, self.rows + 2)
+            self.columns[self.nnz:needed] = list(terms.keys())
+            self.tf[self.nnz:needed] = list(terms.values())
+            self.df[self.columns[self.nnz:needed]] += 1
+            self.nnz = needed
+            self.rows += 1
+            self.indptr[self.rows] = needed
+        self.docs.extend((field, text) for text in texts)
+        self.indexed[field] = self.indexed.get(field, 0) + len(texts)
+        self._weighted = None
+
+    def weighted(self):
+        # O(non-zero entries), the rows themselves are never rewritten
+        if self._weighted is None:
+            idf = (np.log((1.0 + self.rows) / (1.0 + self.df)) + 1.0).astype(np.float32)
+            weights = self.tf[:self.nnz] * idf[self.columns[:self.nnz]]
+            norms = np.sqrt(self._row_sums(weights * weights))
+            self._weighted = (idf, weights, norms)
+        return self._weighted
+
+    def _row_sums(self, values):
+        """Sums per-entry values (last axis) over each CSR row; rows without entries sum to 0."""
+        starts, ends = self.indptr[:self.rows], self.indptr[1:self.rows + 1]
+        filled = starts < ends
+        sums = np.zeros(values.shape[:-1] + (self.rows,), dtype=values.dtype)
+        if filled.any():
+            # reduceat sums up to the next listed start, which is where a filled row ends
+            sums[..., filled] = np.add.reduceat(values, starts[filled], axis=-1)
+        return sums
+
+    def search(self, queries, top_k):
+        if not self.rows or not queries:
+            return [[] for _ in queries]
+        idf, weights, doc_norms = self.weighted()
+        query_matrix = _vectors(queries) * idf
+        norms = np.linalg.norm(query_matrix, axis=1, keepdims=True)
+        np.divide(query_matrix, norms, out=query_matrix, where=norms > 0)
+
+        # questions x documents cosine similarities: one sparse-dense product, in slices of
+        # questions so the questions x entries intermediate stays bounded
+        columns = self.columns[:self.nnz]
+        step = max(1, PRODUCT_CELLS // max(1, self.nnz))
+        scores = np.concatenate([self._row_sums(query_matrix[start:start + step][:, columns] * weights)
+                                 for start in range(0, len(queries), step)])
+        np.divide(scores, doc_norms, out=scores, where=doc_norms > 0)
+        k = min(top_k, self.rows)
+        if k < self.rows:
+            best = np.argpartition(-scores, k - 1, axis=1)[:, :k]
+        else:
+            best = np.tile(np.arange(self.rows), (len(queries), 1))
+        order = np.take_along_axis(scores, best, axis=1).argsort(axis=1)[:, ::-1]
+        best = np.take_along_axis(best, order, axis=1)
+
+        results = []
+        for row, columns in enumerate(best):
+            hits = []
+            for column in columns:
+                score = float(scores[row, column])
+                if score <= 0.0:
+                    break
+                field, text = self.docs[column]
+                hits.append({"score": score, "field": field, "text": text})
+            results.append(hits)
+        return results
+
+
+class VectorIndex:
+    """Per-topic TF-IDF matrices over the schema fields of the knowledge store."""
+
+    def __init__(self, store=None, max_topics=MAX_TOPICS):
+        self.store = store or get_store()
+        self.max_topics = max_topics
+        self.topics = OrderedDict()  # topic -> TopicMatrix, least recently used first
+        self._lock = threading.RLock()
+
+    def _refresh(self, topic, matrix):
+        for field in INDEXED_FIELDS:
+            start = matrix.indexed.get(field, 0)
+            if self.store.count(topic, field) > start:
+                matrix.add(field, self.store.read(topic, field, start=start))
+
+    def catch_up(self, topic):
+        """Adds entries appended to the store since the topic's matrix was built or refreshed."""
+        with self._lock:
+            matrix = self.topics.get(topic)
+            if matrix is not None:  # Topics nobody asked about are built on their first question
+                self._refresh(topic, matrix)
+
+    def _matrix(self, topic):
+        matrix = self.topics.get(topic)
+        if matrix is None:
+            matrix = self.topics[topic] = TopicMatrix()
+            while len(self.topics) > self.max_topics:
+                self.topics.popitem(last=False)
+        self.topics.move_to_end(topic)
+        self._refresh(topic, matrix)
+        return matrix
+
+    def search_many(self, topic, queries, top_k=5):
+        """Returns, for every query, up to top_k dicts with score, topic, field and text."""
+        with self._lock:
+            results = self._matrix(topic).search(list(queries), top_k)
+        for hits in results:
+            for hit in hits:
+                hit["topic"] = topic
+        return results
+
+
+_index = None
+_index_lock = threading.Lock()
+
+
+# Function to get the vector index shared by every module of this process
+def get_vector_index():
+    global _index
+    with _index_lock:
+        if _index is None:
+            _index = VectorIndex()
+        return _index
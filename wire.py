@@ -0,0 +1,245 @@
+# Negotiated payload encodings for brain-to-brain traffic
+#
+# Peer requests and answers used to be plain JSON. Message batches and knowledge
+# sync payloads are large enough that JSON parsing and bytes on the wire add up, so
+# bodies can now be sent in another format and compressed, using plain HTTP
+# negotiation:
+#
+#   Content-Type / Accept                application/json or application/msgpack
+#   Content-Encoding / Accept-Encoding   zstd, gzip or none
+#
+# Servers answer in the best format and coding the request's Accept headers allow,
+# and advertise what they can decode with Accept-Post and Accept-Encoding response
+# headers. Clients (PeerEncoding) start every peer at plain JSON and only switch to
+# a denser encoding once that peer has advertised it. Old peers never see anything
+# but JSON, and a peer that rejects an encoded body gets the request again in JSON.
+#
+# msgpack and zstandard are optional: without them those encodings are simply not
+# offered.
+import gzip
+import json
+import zlib
+
+from flask import Response, g, request
+
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+JSON = "application/json"
+MSGPACK = "application/msgpack"
+MSGPACK_ALIASES = ("application/msgpack", "application/x-msgpack", "application/vnd.msgpack")
+MIN_COMPRESS_BYTES = 1024  # Smaller bodies are sent uncompressed
+MAX_BODY_BYTES = 64 * 1024 * 1024  # Decompressed request bodies larger than this are refused
+GZIP_LEVEL = 6
+ZSTD_LEVEL = 3
+ZSTD_MAGIC = b"\x28\xb5\x2f\xfd"
+
+
+# Function to list the body formats this process can encode and decode, preferred first
+def formats():
+    return [MSGPACK, JSON] if msgpack is not None else [JSON]
+
+
+# Function to list the content codings this process can encode and decode, preferred first
+def codings():
+    return ["zstd", "gzip"] if zstandard is not None else ["gzip"]
+
+
+def _media_type(content_type):
+    media = (content_type or "").split(";")[0].strip().lower()
+    return MSGPACK if media in MSGPACK_ALIASES else media
+
+
+def _preferences(header):
+    """Parses an Accept-style header into [(value, quality)], best first."""
+    preferences = []
+    for position, part in enumerate((header or "").split(",")):
+        value, _, parameters = part.strip().partition(";")
+        quality = 1.0
+        for parameter in parameters.split(";"):
+            name, _, number = parameter.strip().partition("=")
+            if name == "q":
+                try:
+                    quality = float(number)
+                except ValueError:
+                    quality = 0.0
+        if value:
+            preferences.append((value.strip().lower(), quality, position))
+    preferences.sort(key=lambda item: (-item[1], item[2]))
+    return [(value, quality) for value, quality, _ in preferences]
+
+
+# Function to pick the response format for an Accept header; JSON unless something better is asked for
+def negotiate_format(accept):
+    for value, quality in _preferences(accept):
+        media = _media_type(value)
+        if quality > 0 and media in formats():
+            return media
+        if quality > 0 and media in ("*/*", "application/*"):
+            return JSON  # Anything goes: stay with what every peer understands
+    return JSON
+
+
+# Function to pick the response coding for an Accept-Encoding header, None for no compression
+def negotiate_coding(accept_encoding):
+    accepted = {value: quality for value, quality in _preferences(accept_encoding)}
+    for coding in codings():
+        if accepted.get(coding, 0) > 0:
+            return coding
+    return None
+
+
+def compress(data, coding):
+    if coding == "gzip":
+        return gzip.compress(data, GZIP_LEVEL)
+    if coding == "zstd":
+        return zstandard.ZstdCompressor(level=ZSTD_LEVEL).compress(data)
+    return data
+
+
+def decompress(data, coding, limit=MAX_BODY_BYTES):
+    """Undoes a content coding, refusing output beyond `limit` bytes."""
+    if not coding or coding == "identity":
+        return data
+    try:
+        if coding in ("gzip", "x-gzip", "deflate"):
+            # 32 lets zlib detect the gzip header; HTTP deflate is a zlib stream
+            decompressor = zlib.decompressobj(zlib.MAX_WBITS if coding == "deflate" else zlib.MAX_WBITS | 32)
+            output = decompressor.decompress(data, limit + 1)
+        elif coding == "zstd" and zstandard is not None:
+            with zstandard.ZstdDecompressor().stream_reader(data) as reader:
+                output = reader.read(limit + 1)
+        else:
+            raise ValueError(f"Unsupported content coding: {coding}")
+    except (zlib.error, EOFError) as e:
+        raise ValueError(f"Corrupt {coding} body: {e}")
+    except Exception as e:
+        if zstandard is not None and isinstance(e, zstandard.ZstdError):
+            raise ValueError(f"Corrupt {coding} body: {e}")
+        raise
+    if len(output) > limit:
+        raise ValueError(f"Body larger than {limit} bytes once decompressed")
+    return output
+
+
+# Function to serialise a payload, returning the body and its Content-Type/Content-Encoding headers
+def encode_body(data, content_type=JSON, coding=None):
+    if content_type == MSGPACK:
+        body = msgpack.packb(data, use_bin_type=True)
+    else:
+        body = json.dumps(data, separators=(",", ":")).encode("utf-8")
+        content_type = JSON
+    headers = {"Content-Type": content_type}
+    if coding and len(body) >= MIN_COMPRESS_BYTES:
+        body = compress(body, coding)
+        headers["Content-Encoding"] = coding
+    return body, headers
+
+
+# Function to turn a body back into a payload given its Content-Type and Content-Encoding
+def decode_body(body, content_type=JSON, coding=None):
+    body = decompress(body, coding)
+    if _media_type(content_type) == MSGPACK:
+        if msgpack is None:
+            raise ValueError("msgpack bodies need the msgpack package")
+        return msgpack.unpackb(body, raw=False)
+    return json.loads(body)
+
+
+# Function to decode the current Flask request's body in whatever format it was sent, None when it can't be
+def request_data():
+    if "wire_data" not in g:
+        try:
+            g.wire_data = decode_body(request.get_data(cache=True), request.content_type or JSON,
+                                      request.headers.get("Content-Encoding"))
+        except Exception:
+            g.wire_data = None
+    return g.wire_data
+
+
+# Function to answer the current Flask request in the format and coding it asked for
+def respond(data, status=200):
+    content_type = negotiate_format(request.headers.get("Accept"))
+    coding = negotiate_coding(request.headers.get("Accept-Encoding"))
+    body, headers = encode_body(data, content_type, coding)
+    headers["Vary"] = "Accept, Accept-Encoding"
+    return Response(body, status=status, headers=headers)
+
+
+# Function to make a Flask app advertise the encodings it accepts on every response
+def install_wire(app):
+    @app.after_request
+    def advertise_encodings(response):
+        response.headers["Accept-Post"] = ", ".join(formats())
+        response.headers["Accept-Encoding"] = ", ".join(codings())
+        return response
+    return app
+
+
+class PeerEncoding:
+    """
+    The encoding used for one peer. Starts at plain JSON and switches to the
+    preferred format and coding once the peer has advertised them.
+    """
+
+    def __init__(self, content_type=None, coding=None):
+        self.preferred_type = content_type or formats()[0]
+        self.preferred_coding = coding or codings()[0]
+        self.content_type = JSON
+        self.coding = None
+
+    def headers(self):
+        # Responses can come back in any format we decode; requests undoes gzip by itself
+        return {"Accept": ", ".join(f"{media};q={1.0 - 0.1 * rank:.1f}" for rank, media in enumerate(formats())),
+                "Accept-Encoding": ", ".join(codings() + ["deflate"])}
+
+    def encode(self, data):
+        """Returns the body and headers to send `data` to the peer with."""
+        body, headers = encode_body(data, self.content_type, self.coding)
+        headers.update(self.headers())
+        return body, headers
+
+    def learn(self, response):
+        """Upgrades to what the peer advertises on its responses."""
+        accepted = [_media_type(value) for value, _ in _preferences(response.headers.get("Accept-Post"))]
+        if self.preferred_type in accepted:
+            self.content_type = self.preferred_type
+        encodings = [value for value, _ in _preferences(response.headers.get("Accept-Encoding"))]
+        if self.preferred_coding in encodings:
+            self.coding = self.preferred_coding
+
+    def rejected(self, response):
+        """Falls back to plain JSON when the peer refused an encoded body; returns whether to resend."""
+        if response.status_code in (400, 415) and (self.content_type != JSON or self.coding):
+            self.content_type, self.coding = JSON, None
+            return True
+        return False
+
+    def decode(self, response):
+        content = response.content
+        # requests leaves codings it doesn't know (zstd) as they are
+        if response.headers.get("Content-Encoding") == "zstd" and content.startswith(ZSTD_MAGIC):
+            content = decompress(content, "zstd")
+        return decode_body(content, response.headers.get("Content-Type") or JSON)
+
+
+# Function to send a payload to a peer with its negotiated encoding and decode the answer
+# Returns the response with the decoded payload in `response.data` (None if it couldn't be decoded)
+def post(session, url, data, encoding, timeout=None, method="POST"):
+    while True:
+        body, headers = encoding.encode(data) if data is not None else (None, encoding.headers())
+        response = session.request(method, url, data=body, headers=headers, timeout=timeout)
+        if body is not None and encoding.rejected(response):
+            continue  # Sent again in plain JSON
+        encoding.learn(response)
+        try:
+            response.data = encoding.decode(response) if response.content else None
+        except ValueError:
+            response.data = None
+        return response